@@ -0,0 +1,184 @@
+import csv
+from collections import Counter
+
+from archive import Archive
+from db import session
+from schema import ROLLUPS, fill_bird_stats
+
+DIMENSIONS = {
+    "bird": "sighting_counts_by_bird",
+    "location": "sighting_counts_by_location",
+    "day": "sighting_counts_by_day",
+    "month": "sighting_counts_by_month",
+}
+
+
+def _table(dimension):
+    try:
+        return DIMENSIONS[dimension]
+    except KeyError:
+        raise ValueError(f"Unknown dimension '{dimension}', expected one of {', '.join(DIMENSIONS)}.")
+
+
+def counts(dimension, start=None, end=None, limit=None):
+    """
+    Return [(key, count), ...] from the rollup table of a dimension
+    ('bird', 'location', 'day' or 'month'). Keys of the bird dimension are
+    bird names. Day and month keys can be limited to an inclusive range
+    and are returned in order; other dimensions are returned busiest first.
+    """
+    table = _table(dimension)
+    key = ROLLUPS[table][0]
+    conditions = []
+    params = []
+    if start:
+        conditions.append(f"r.{key} >= ?")
+        params.append(start)
+    if end:
+        conditions.append(f"r.{key} <= ?")
+        params.append(end)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    order = f"r.{key}" if dimension in ("day", "month") else "r.count DESC"
+
+    if dimension == "bird":
+        sql = f"SELECT b.name, r.count FROM {table} r JOIN bird_details b ON b.id = r.bird_id{where} ORDER BY {order}"
+    else:
+        sql = f"SELECT r.{key}, r.count FROM {table} r{where} ORDER BY {order}"
+    if limit:
+        sql += " LIMIT ?"
+        params.append(limit)
+
+    with session() as conn:
+        return conn.execute(sql, params).fetchall()
+
+
+def count_for(dimension, key):
+    """
+    Return the number of sightings for one key, e.g.
+    count_for('bird', bird_id) or count_for('month', '2024-05').
+    """
+    table = _table(dimension)
+    key_column = ROLLUPS[table][0]
+    with session() as conn:
+        row = conn.execute(f"SELECT count FROM {table} WHERE {key_column} = ?", (key,)).fetchone()
+    return row[0] if row else 0
+
+
+def compute_counts(dimension, archive=None):
+    """
+    Aggregate a dimension directly from avian_sightings and the archived
+    sightings, bypassing the rollups. Used to check and rebuild them.
+    """
+    table = _table(dimension)
+    expression = ROLLUPS[table][1]
+    archive = archive or Archive()
+    with session() as conn:
+        totals = Counter(dict(conn.execute(
+            f"SELECT {expression.format(r='a')}, COUNT(*) FROM avian_sightings a GROUP BY 1"
+        )))
+        totals.update(archive.group_counts(conn, expression))
+    return sorted(totals.items())
+
+
+def rebuild_rollups(archive=None):
+    """
+    Recompute every rollup table, and bird_stats, from avian_sightings and
+    the archived sightings in one transaction.
+    """
+    archive = archive or Archive()
+    with session() as conn:
+        for table, (key, expression) in ROLLUPS.items():
+            conn.execute(f"DELETE FROM {table}")
+            conn.execute(f'''
+                INSERT INTO {table} ({key}, count)
+                SELECT {expression.format(r="a")}, COUNT(*) FROM avian_sightings a GROUP BY 1
+            ''')
+        fill_bird_stats(conn)
+        archive.rebuild_rollups(conn)
+
+
+def summarize(rows):
+    """
+    Summarize [(key, count), ...] as the total, number of keys, mean,
+    median, 90th percentile and the busiest key.
+    """
+    import statistics
+
+    if not rows:
+        return {"total": 0, "keys": 0, "mean": 0.0, "median": 0.0, "p90": 0, "busiest": None}
+
+    values = sorted(count for _, count in rows)
+    busiest = max(rows, key=lambda row: row[1])
+    return {
+        "total": sum(values),
+        "keys": len(values),
+        "mean": statistics.fmean(values),
+        "median": statistics.median(values),
+        "p90": values[min(len(values) - 1, int(len(values) * 0.9))],
+        "busiest": busiest[0],
+    }
+
+
+def totals(dimension):
+    """
+    Return the total, number of keys, mean and busiest key of a
+    dimension, aggregated by SQLite over its rollup table, so no more
+    than one key is read back however many there are.
+    """
+    table = _table(dimension)
+    key = ROLLUPS[table][0]
+    if dimension == "bird":
+        busiest_sql = (f"SELECT b.name FROM {table} r JOIN bird_details b ON b.id = r.bird_id "
+                       f"ORDER BY r.count DESC LIMIT 1")
+    else:
+        busiest_sql = f"SELECT {key} FROM {table} ORDER BY count DESC LIMIT 1"
+
+    with session() as conn:
+        total, keys = conn.execute(f"SELECT COALESCE(SUM(count), 0), COUNT(*) FROM {table}").fetchone()
+        busiest = conn.execute(busiest_sql).fetchone()
+    return {"total": total, "keys": keys, "mean": total / keys if keys else 0.0,
+            "busiest": busiest[0] if busiest else None}
+
+
+def export_counts(path, dimension, start=None, end=None):
+    """
+    Write the rollup of a dimension to a CSV file and return its summary.
+    """
+    rows = counts(dimension, start, end)
+    with open(path, mode='w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow([dimension, "sightings"])
+        writer.writerows(rows)
+    return summarize(rows)
+
+
+def main():
+    """
+    Command line entry point: python analytics.py month --from 2024-01
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Sighting counts per bird, location, day or month.")
+    parser.add_argument("dimension", choices=list(DIMENSIONS))
+    parser.add_argument("--from", dest="start")
+    parser.add_argument("--to", dest="end")
+    parser.add_argument("--limit", type=int)
+    parser.add_argument("--out", help="write the counts to this CSV file")
+    parser.add_argument("--rebuild", action="store_true", help="recompute the rollups and bird summaries first")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        rebuild_rollups()
+    if args.out:
+        summary = export_counts(args.out, args.dimension, args.start, args.end)
+        print(f"Counts written to '{args.out}'.")
+    else:
+        rows = counts(args.dimension, args.start, args.end, args.limit)
+        for key, count in rows:
+            print(f"{key}\t{count}")
+        summary = summarize(rows)
+    print(", ".join(f"{name}: {value}" for name, value in summary.items()))
+
+
+if __name__ == "__main__":
+    main()
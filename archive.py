@@ -0,0 +1,446 @@
+import datetime
+import json
+import math
+import os
+import re
+import struct
+import sys
+import time
+import zlib
+from array import array
+from collections import Counter
+from dataclasses import dataclass
+from itertools import accumulate
+
+from cache import LRUCache
+from db import session
+from schema import ISO_DATE_OR_NULL, ROLLUPS
+
+ARCHIVE_DIR = "archive"
+CHUNK_ROWS = 100000
+CACHED_CHUNKS = 16
+COMPRESSION_LEVEL = 6
+
+MAGIC = b"BSA1"
+ISO_DATE = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+# Archived rows, in avian_sightings column order.
+COLUMNS = ('id', 'bird_id', 'date', 'location', 'observer', 'notes', 'latitude', 'longitude')
+
+
+def _dictionary(values):
+    """
+    Dictionary-encode a column: return (distinct values, codes array).
+    """
+    codes = {}
+    encoded = array('I', (codes.setdefault(value, len(codes)) for value in values))
+    return list(codes), encoded
+
+
+def encode_chunk(rows):
+    """
+    Encode archived rows (tuples in COLUMNS order, sorted by id) as a
+    compressed column-oriented chunk. Ids are delta-encoded; bird_id,
+    location and observer are dictionary-encoded; dates are day ordinals
+    when every date in the chunk is YYYY-MM-DD, else dictionary-encoded;
+    coordinates are float arrays with NaN for a missing value.
+    """
+    ids, bird_ids, dates, locations, observers, notes, latitudes, longitudes = zip(*rows)
+    header = {"rows": len(rows), "byteorder": sys.byteorder, "columns": {}}
+    arrays = []
+
+    def add(name, kind, data, **meta):
+        header["columns"][name] = dict(meta, kind=kind, typecode=data.typecode, length=len(data))
+        arrays.append(data.tobytes())
+
+    add("id", "delta", array('q', (b - a for a, b in zip((0,) + ids, ids))))
+    for name, column in (("bird_id", bird_ids), ("location", locations), ("observer", observers)):
+        dictionary, codes = _dictionary(column)
+        add(name, "dictionary", codes, values=dictionary)
+    if all(isinstance(date, str) and len(date) == 10 and ISO_DATE.fullmatch(date) for date in dates):
+        add("date", "ordinal", array('i', (datetime.date.fromisoformat(date).toordinal() for date in dates)))
+    else:
+        dictionary, codes = _dictionary(dates)
+        add("date", "dictionary", codes, values=dictionary)
+    for name, column in (("latitude", latitudes), ("longitude", longitudes)):
+        add(name, "float", array('d', (math.nan if value is None else value for value in column)))
+    header["notes"] = list(notes)
+
+    header_bytes = json.dumps(header, separators=(",", ":")).encode()
+    payload = struct.pack("<I", len(header_bytes)) + header_bytes + b"".join(arrays)
+    return MAGIC + zlib.compress(payload, COMPRESSION_LEVEL)
+
+
+class Chunk:
+    """
+    A decoded chunk, kept column by column. Rows are only built for the
+    positions asked for, so reading one bird out of a chunk does not
+    materialize the others.
+    """
+
+    def __init__(self, header, columns):
+        self.header = header
+        self.columns = columns
+        self.notes = header["notes"]
+
+    def __len__(self):
+        return self.header["rows"]
+
+    def positions(self, bird_id):
+        """
+        Return the positions of a bird's rows, without decoding any other column.
+        """
+        try:
+            code = self.header["columns"]["bird_id"]["values"].index(bird_id)
+        except ValueError:
+            return []
+        return [i for i, value in enumerate(self.columns["bird_id"]) if value == code]
+
+    def _value(self, name, i):
+        meta = self.header["columns"][name]
+        value = self.columns[name][i]
+        if meta["kind"] == "dictionary":
+            return meta["values"][value]
+        if meta["kind"] == "ordinal":
+            return datetime.date.fromordinal(value).isoformat()
+        if meta["kind"] == "float":
+            return None if math.isnan(value) else value
+        return value
+
+    def rows(self, positions=None):
+        """
+        Yield row tuples in COLUMNS order, for every row or the given positions.
+        """
+        if positions is None:
+            positions = range(len(self))
+        for i in positions:
+            yield (self.columns["id"][i], self._value("bird_id", i), self._value("date", i),
+                   self._value("location", i), self._value("observer", i), self.notes[i],
+                   self._value("latitude", i), self._value("longitude", i))
+
+
+def decode_chunk(data):
+    """
+    Decode a chunk written by encode_chunk into a Chunk.
+    """
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError("Not a sighting archive chunk.")
+    payload = zlib.decompress(data[len(MAGIC):])
+    (header_length,) = struct.unpack_from("<I", payload)
+    header = json.loads(payload[4:4 + header_length])
+    offset = 4 + header_length
+
+    columns = {}
+    for name in ("id", "bird_id", "location", "observer", "date", "latitude", "longitude"):
+        meta = header["columns"][name]
+        values = array(meta["typecode"])
+        size = values.itemsize * meta["length"]
+        values.frombytes(payload[offset:offset + size])
+        offset += size
+        if header["byteorder"] != sys.byteorder:
+            values.byteswap()
+        columns[name] = array('q', accumulate(values)) if meta["kind"] == "delta" else values
+    return Chunk(header, columns)
+
+
+@dataclass
+class ArchiveReport:
+    rows: int = 0
+    chunks: int = 0
+    bytes: int = 0
+    elapsed: float = 0.0
+
+
+# Chunks archived before dates were checked may hold unreadable ones,
+# which count as sightings but not as a first or last date.
+SEEN_DATE = ISO_DATE_OR_NULL.format(date="date")
+
+
+def _fill_temp_table(conn, rows):
+    """
+    Put (bird_id, date, location, observer) of archived rows in a temporary
+    table, for the rollup queries, which take their key expressions from
+    schema.ROLLUPS, and the bird_stats ones.
+    """
+    conn.execute('''
+        CREATE TEMP TABLE IF NOT EXISTS archived_sightings (bird_id INTEGER, date TEXT, location TEXT, observer TEXT)
+    ''')
+    conn.execute("DELETE FROM temp.archived_sightings")
+    conn.executemany("INSERT INTO temp.archived_sightings VALUES (?, ?, ?, ?)",
+                     ((row[1], row[2], row[3], row[4]) for row in rows))
+
+
+def _add_to_rollups(conn):
+    """
+    Add the rows in temp.archived_sightings to the rollup tables, leaving
+    out those of deleted birds.
+    """
+    for table, (key, expression) in ROLLUPS.items():
+        conn.execute(f'''
+            INSERT INTO {table} ({key}, count)
+            SELECT {expression.format(r="x")}, COUNT(*) FROM temp.archived_sightings x
+            WHERE x.bird_id IN (SELECT id FROM bird_details) GROUP BY 1
+            ON CONFLICT ({key}) DO UPDATE SET count = count + excluded.count
+        ''')
+
+
+def _remove_from_rollups(conn):
+    """
+    Take the rows in temp.archived_sightings out of the rollup tables.
+    """
+    for table, (key, expression) in ROLLUPS.items():
+        conn.execute(f'''
+            UPDATE {table} SET count = count - (
+                SELECT COUNT(*) FROM temp.archived_sightings x WHERE {expression.format(r="x")} = {table}.{key})
+            WHERE {key} IN (SELECT {expression.format(r="x")} FROM temp.archived_sightings x)
+        ''')
+        conn.execute(f"DELETE FROM {table} WHERE count <= 0")
+
+
+def _add_to_bird_stats(conn):
+    """
+    Add the rows in temp.archived_sightings to bird_stats and bird_observers.
+    """
+    conn.execute('''
+        INSERT INTO bird_observers (bird_id, observer, sightings)
+        SELECT bird_id, observer, COUNT(*) FROM temp.archived_sightings
+        WHERE observer IS NOT NULL AND bird_id IN (SELECT id FROM bird_details)
+        GROUP BY 1, 2
+        ON CONFLICT (bird_id, observer) DO UPDATE SET sightings = sightings + excluded.sightings
+    ''')
+    conn.execute(f'''
+        INSERT INTO bird_stats (bird_id, sightings, first_seen, last_seen, observers)
+        SELECT bird_id, COUNT(*), MIN({SEEN_DATE}), MAX({SEEN_DATE}), 0 FROM temp.archived_sightings
+        WHERE bird_id IN (SELECT id FROM bird_details)
+        GROUP BY 1
+        ON CONFLICT (bird_id) DO UPDATE SET
+            sightings = sightings + excluded.sightings,
+            first_seen = min(first_seen, excluded.first_seen),
+            last_seen = max(last_seen, excluded.last_seen)
+    ''')
+    conn.execute('''
+        UPDATE bird_stats SET observers = (SELECT COUNT(*) FROM bird_observers o WHERE o.bird_id = bird_stats.bird_id)
+        WHERE bird_id IN (SELECT bird_id FROM temp.archived_sightings)
+    ''')
+
+
+class Archive:
+    """
+    Archival tier for old sightings. Rows move out of avian_sightings into
+    immutable, compressed, column-oriented chunk files in `directory`,
+    indexed by the archive_chunks and archive_chunk_birds tables. Archived
+    sightings still count in the sighting statistics and are merged back
+    into per-bird listings and exports, but are read-only, and are not
+    covered by full-text search or the coordinate index.
+    """
+
+    def __init__(self, directory=ARCHIVE_DIR, cached_chunks=CACHED_CHUNKS):
+        self.directory = directory
+        self.cache = LRUCache(cached_chunks)
+
+    def _path(self, file):
+        return os.path.join(self.directory, file)
+
+    def read_chunk(self, file):
+        """
+        Return the decoded Chunk of a chunk file, through a small LRU cache.
+        """
+        chunk = self.cache.get(file)
+        if chunk is None:
+            with open(self._path(file), "rb") as data:
+                chunk = decode_chunk(data.read())
+            self.cache.put(file, chunk)
+        return chunk
+
+    def _write_chunk(self, rows):
+        os.makedirs(self.directory, exist_ok=True)
+        file = f"sightings-{rows[0][0]:012d}-{rows[-1][0]:012d}.chunk"
+        data = encode_chunk(rows)
+        temp = self._path(file + ".tmp")
+        with open(temp, "wb") as chunk:
+            chunk.write(data)
+            chunk.flush()
+            os.fsync(chunk.fileno())
+        os.replace(temp, self._path(file))
+        return file, len(data)
+
+    def archive_before(self, cutoff, chunk_rows=CHUNK_ROWS):
+        """
+        Move sightings dated before `cutoff` into chunk files of up to
+        `chunk_rows` rows, one transaction per chunk. Sightings with an edit
+        history stay live. The rollup counts are kept as they were. Other
+        writers wait while a chunk is read, written and committed.
+        """
+        report = ArchiveReport()
+        start = time.perf_counter()
+        with session() as conn:
+            if conn.in_transaction:
+                conn.commit()
+            while True:
+                # The rows are read under the write lock, which is held until
+                # their delete commits, so an update committed in between
+                # cannot be lost with the rows it changed.
+                conn.execute("BEGIN IMMEDIATE")
+                file = None
+                try:
+                    rows = conn.execute(f'''
+                        SELECT {", ".join(COLUMNS)} FROM avian_sightings a
+                        WHERE a.date < ?
+                          AND NOT EXISTS (SELECT 1 FROM sighting_revisions r WHERE r.sighting_id = a.id)
+                        ORDER BY a.id
+                        LIMIT ?
+                    ''', (cutoff, chunk_rows)).fetchall()
+                    if not rows:
+                        conn.rollback()
+                        break
+
+                    file, size = self._write_chunk(rows)
+                    dates = [row[2] for row in rows]
+                    birds = {}
+                    for row in rows:
+                        count, first, last = birds.get(row[1], (0, row[2], row[2]))
+                        birds[row[1]] = (count + 1, min(first, row[2]), max(last, row[2]))
+                    chunk_id = conn.execute(
+                        "INSERT INTO archive_chunks (file, rows, min_date, max_date, bytes) VALUES (?, ?, ?, ?, ?)",
+                        (file, len(rows), min(dates), max(dates), size)
+                    ).lastrowid
+                    conn.executemany(
+                        "INSERT INTO archive_chunk_birds (bird_id, chunk_id, rows, first_date, last_date) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        [(bird_id, chunk_id, *summary) for bird_id, summary in birds.items()]
+                    )
+                    logged = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM change_log").fetchone()[0]
+                    conn.executemany("DELETE FROM avian_sightings WHERE id = ?", ((row[0],) for row in rows))
+                    # Archived sightings have not been deleted as far as
+                    # downstream copies go, so the deletes are not logged.
+                    conn.execute("DELETE FROM change_log WHERE seq > ?", (logged,))
+                    # The delete triggers took the rows out of the rollups and
+                    # bird_stats; archived sightings still count, so put them back.
+                    _fill_temp_table(conn, rows)
+                    _add_to_rollups(conn)
+                    _add_to_bird_stats(conn)
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    if file is not None:
+                        os.remove(self._path(file))
+                    raise
+
+                report.rows += len(rows)
+                report.chunks += 1
+                report.bytes += size
+        report.elapsed = time.perf_counter() - start
+        return report
+
+    def chunks(self, conn, bird_id=None, start_date=None, end_date=None):
+        """
+        Return the files of the chunks that may hold rows for a bird and
+        date range, oldest first.
+        """
+        conditions = []
+        params = []
+        if bird_id is not None:
+            conditions.append("id IN (SELECT chunk_id FROM archive_chunk_birds WHERE bird_id = ?)")
+            params.append(bird_id)
+        if start_date:
+            conditions.append("max_date >= ?")
+            params.append(start_date)
+        if end_date:
+            conditions.append("min_date <= ?")
+            params.append(end_date)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        return [file for (file,) in conn.execute(f"SELECT file FROM archive_chunks{where} ORDER BY id", params)]
+
+    def iter_rows(self, conn, bird_id=None, start_date=None, end_date=None):
+        """
+        Yield archived rows (tuples in COLUMNS order) of a bird and/or an
+        inclusive date range.
+        """
+        for file in self.chunks(conn, bird_id, start_date, end_date):
+            chunk = self.read_chunk(file)
+            for row in chunk.rows(chunk.positions(bird_id) if bird_id is not None else None):
+                if start_date and row[2] < start_date:
+                    continue
+                if end_date and row[2] > end_date:
+                    continue
+                yield row
+
+    def rebuild_rollups(self, conn):
+        """
+        Add every archived row to the rollup tables and bird_stats, after
+        they have been recomputed from avian_sightings. Also records each
+        bird's date range in chunks archived before archive_chunk_birds
+        had one.
+        """
+        for chunk_id, file in conn.execute("SELECT id, file FROM archive_chunks ORDER BY id").fetchall():
+            _fill_temp_table(conn, self.read_chunk(file).rows())
+            _add_to_rollups(conn)
+            _add_to_bird_stats(conn)
+            conn.execute(f'''
+                UPDATE archive_chunk_birds SET (first_date, last_date) = (
+                    SELECT MIN({SEEN_DATE}), MAX({SEEN_DATE}) FROM temp.archived_sightings x
+                    WHERE x.bird_id = archive_chunk_birds.bird_id)
+                WHERE chunk_id = ? AND first_date IS NULL
+            ''', (chunk_id,))
+
+    def drop_bird(self, conn, bird_id):
+        """
+        Forget a bird's archived rows, as part of the transaction deleting
+        the bird: take them out of the rollups and the chunk index. The
+        chunk files are immutable and keep them, but per-bird reads no
+        longer open those chunks and every other reader skips rows of
+        deleted birds.
+        """
+        rows = list(self.iter_rows(conn, bird_id))
+        if rows:
+            _fill_temp_table(conn, rows)
+            _remove_from_rollups(conn)
+        conn.execute("DELETE FROM archive_chunk_birds WHERE bird_id = ?", (bird_id,))
+        return len(rows)
+
+    def group_counts(self, conn, expression):
+        """
+        Count archived rows per key of a schema.ROLLUPS expression, leaving
+        out those of deleted birds.
+        """
+        counts = Counter()
+        for (file,) in conn.execute("SELECT file FROM archive_chunks ORDER BY id").fetchall():
+            _fill_temp_table(conn, self.read_chunk(file).rows())
+            counts.update(dict(conn.execute(
+                f"SELECT {expression.format(r='x')}, COUNT(*) FROM temp.archived_sightings x "
+                f"WHERE x.bird_id IN (SELECT id FROM bird_details) GROUP BY 1"
+            )))
+        return counts
+
+    def stats(self, conn):
+        """
+        Return (chunks, rows, bytes) of the archive.
+        """
+        return conn.execute("SELECT COUNT(*), COALESCE(SUM(rows), 0), COALESCE(SUM(bytes), 0) FROM archive_chunks").fetchone()
+
+
+def main():
+    """
+    Command line entry point: python archive.py --before 2020-01-01
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Move old sightings into the compressed archive.")
+    parser.add_argument("--before", help="archive sightings dated before this date")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    parser.add_argument("--dir", default=ARCHIVE_DIR)
+    args = parser.parse_args()
+
+    archive = Archive(args.dir)
+    if args.before:
+        report = archive.archive_before(args.before, args.chunk_rows)
+        print(f"Archived {report.rows} sightings into {report.chunks} chunks "
+              f"({report.bytes} bytes) in {report.elapsed:.2f}s.")
+    with session() as conn:
+        chunks, rows, size = archive.stats(conn)
+    print(f"Archive: {rows} sightings in {chunks} chunks, {size} bytes"
+          f"{f' ({size / rows:.1f} bytes per sighting)' if rows else ''}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import deque
+
+# scrypt work factor. Raise SCRYPT_N as hardware allows; `python auth.py
+# benchmark` reports the largest N that keeps login p99 within budget.
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+SALT_BYTES = 16
+HASH_BYTES = 32
+
+MAX_ATTEMPTS = 5
+ATTEMPT_WINDOW = 300.0
+
+PREFIX = "scrypt"
+
+
+class TooManyAttempts(Exception):
+    """
+    Raised when a user or address has used up its login attempts.
+    """
+
+    def __init__(self, retry_after):
+        super().__init__(f"Too many failed login attempts. Try again in {retry_after:.0f} seconds.")
+        self.retry_after = retry_after
+
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p,
+                          maxmem=256 * n * r + 1024 * 1024, dklen=HASH_BYTES)
+
+
+def hash_password(password, n=None, r=None, p=None):
+    """
+    Return a salted scrypt hash of the password in the form
+    scrypt$N$r$p$salt$hash, so the cost travels with each stored hash.
+    """
+    n = n or SCRYPT_N
+    r = r or SCRYPT_R
+    p = p or SCRYPT_P
+    salt = os.urandom(SALT_BYTES)
+    digest = _scrypt(password, salt, n, r, p)
+    return f"{PREFIX}${n}${r}${p}${salt.hex()}${digest.hex()}"
+
+
+def is_hashed(stored):
+    return stored.startswith(PREFIX + "$")
+
+
+def verify_password(password, stored):
+    """
+    Check a password against a stored hash. Rows written before hashing
+    was introduced hold the plaintext password and are compared directly.
+    """
+    if not is_hashed(stored):
+        return hmac.compare_digest(password.encode('utf-8'), stored.encode('utf-8'))
+    try:
+        _, n, r, p, salt, digest = stored.split("$")
+        expected = bytes.fromhex(digest)
+        actual = _scrypt(password, bytes.fromhex(salt), int(n), int(r), int(p))
+    except ValueError:
+        return False
+    return hmac.compare_digest(actual, expected)
+
+
+def needs_rehash(stored):
+    """
+    True for plaintext passwords and for hashes made with another cost.
+    """
+    if not is_hashed(stored):
+        return True
+    return stored.split("$")[1:4] != [str(SCRYPT_N), str(SCRYPT_R), str(SCRYPT_P)]
+
+
+class LoginRateLimiter:
+    """
+    In-process sliding-window limit on failed logins per key, where a key
+    is a user name or a client address. Checking a blocked key never
+    touches the database.
+    """
+
+    def __init__(self, max_attempts=MAX_ATTEMPTS, window=ATTEMPT_WINDOW, clock=time.monotonic):
+        self.max_attempts = max_attempts
+        self.window = window
+        self.clock = clock
+        self._failures = {}
+        self._lock = threading.Lock()
+
+    def _prune(self, key, now):
+        failures = self._failures.get(key)
+        while failures and now - failures[0] >= self.window:
+            failures.popleft()
+        if failures is not None and not failures:
+            del self._failures[key]
+            return None
+        return failures
+
+    def check(self, *keys):
+        """
+        Raise TooManyAttempts if any of the keys is currently blocked.
+        """
+        now = self.clock()
+        with self._lock:
+            for key in keys:
+                failures = self._prune(key, now)
+                if failures and len(failures) >= self.max_attempts:
+                    raise TooManyAttempts(self.window - (now - failures[0]))
+
+    def record_failure(self, *keys):
+        now = self.clock()
+        with self._lock:
+            for key in keys:
+                self._prune(key, now)
+                self._failures.setdefault(key, deque()).append(now)
+
+    def reset(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._failures.pop(key, None)
+
+
+limiter = LoginRateLimiter()
+
+
+def _limit_keys(username_or_email, remote_addr):
+    keys = [f"user:{username_or_email.lower()}"]
+    if remote_addr:
+        keys.append(f"addr:{remote_addr}")
+    return keys
+
+
+_dummy = None
+
+
+def _dummy_hash():
+    global _dummy
+    if _dummy is None or needs_rehash(_dummy):
+        _dummy = hash_password(os.urandom(16).hex())
+    return _dummy
+
+
+def authenticate(users, username_or_email, password, user_type, remote_addr=None, rate_limiter=None):
+    """
+    Return the user for these credentials, or None if they do not match.
+
+    Raises TooManyAttempts once the user name or remote address has failed
+    too often. Plaintext or outdated hashes are re-hashed with the current
+    cost after a successful login.
+    """
+    rate_limiter = rate_limiter or limiter
+    keys = _limit_keys(username_or_email, remote_addr)
+    rate_limiter.check(*keys)
+
+    user = users.find_for_login(username_or_email, user_type)
+    # Unknown users still pay for one hash so response time does not
+    # reveal which user names exist.
+    stored = user.password if user is not None else _dummy_hash()
+    if not verify_password(password, stored) or user is None:
+        rate_limiter.record_failure(*keys)
+        return None
+
+    rate_limiter.reset(*keys)
+    if needs_rehash(user.password):
+        user.password = hash_password(password)
+        users.set_password(user.id, user.password)
+    return user
+
+
+def benchmark_cost(budget_ms=250.0, concurrency=8, samples=32, max_log2_n=20):
+    """
+    Time hash verification at increasing scrypt N with `concurrency`
+    simultaneous logins and return [(N, p50 ms, p99 ms), ...] together
+    with the largest N whose p99 fits the budget.
+    """
+    import statistics
+    from concurrent.futures import ThreadPoolExecutor
+
+    results = []
+    chosen = None
+    for log2_n in range(10, max_log2_n + 1):
+        n = 2 ** log2_n
+        stored = hash_password("benchmark", n=n)
+
+        def timed(_):
+            start = time.perf_counter()
+            verify_password("benchmark", stored)
+            return (time.perf_counter() - start) * 1000
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            latencies = sorted(executor.map(timed, range(samples)))
+        p50 = statistics.median(latencies)
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        results.append((n, p50, p99))
+        if p99 > budget_ms:
+            break
+        chosen = n
+    return results, chosen
+
+
+def main():
+    """
+    Command line entry point: python auth.py benchmark --budget-ms 250
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Password hashing tools.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    bench = commands.add_parser("benchmark", help="choose the scrypt cost for a login latency budget")
+    bench.add_argument("--budget-ms", type=float, default=250.0)
+    bench.add_argument("--concurrency", type=int, default=8)
+    bench.add_argument("--samples", type=int, default=32)
+    args = parser.parse_args()
+
+    results, chosen = benchmark_cost(args.budget_ms, args.concurrency, args.samples)
+    for n, p50, p99 in results:
+        print(f"N = 2^{n.bit_length() - 1:<2}  p50 {p50:8.1f} ms  p99 {p99:8.1f} ms")
+    if chosen:
+        print(f"Largest N within {args.budget_ms:.0f} ms p99: SCRYPT_N = 2 ** {chosen.bit_length() - 1}")
+    else:
+        print(f"No tested cost fits within {args.budget_ms:.0f} ms p99.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,570 @@
+import argparse
+import asyncio
+import csv
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import db
+
+# Cold start of a short-lived invocation on an up-to-date database:
+# interpreter start, importing bird_management and the schema check.
+STARTUP_TARGET_MS = 100.0
+
+
+def _seed(path, birds=1000):
+    """
+    Create a throwaway database with the base tables and a set of birds
+    to look up.
+    """
+    from schema import create_tables
+
+    conn = sqlite3.connect(path)
+    create_tables(conn)
+    conn.executemany(
+        "INSERT INTO bird_details (name, bio_name, origin, habitat, diet, conservation_status, description) "
+        "VALUES (?, ?, ?, ?, ?, 'not extinct', ?)",
+        [(f"Bird {i}", f"Avis {i}", "Asia", "Forest", "Seeds", "Synthetic bird") for i in range(birds)]
+    )
+    conn.commit()
+    conn.close()
+
+
+def _operation(conn, i, birds):
+    """
+    One unit of work: resolve a bird name and record a sighting for it,
+    the same shape as add_avian_sighting.
+    """
+    bird_id = conn.execute(
+        "SELECT id FROM bird_details WHERE LOWER(name) = LOWER(?)", (f"bird {i % birds}",)
+    ).fetchone()[0]
+    conn.execute(
+        "INSERT INTO avian_sightings (bird_id, date, location, observer, notes) VALUES (?, ?, ?, ?, ?)",
+        (bird_id, "2024-01-01", "Park", "Benchmark", None)
+    )
+    conn.commit()
+
+
+def bench_pool(ops=2000, birds=1000):
+    """
+    Compare ops/sec of opening a new connection per call (the old
+    behaviour) against borrowing one from the shared pool.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        _seed(path, birds)
+
+        start = time.perf_counter()
+        for i in range(ops):
+            conn = sqlite3.connect(path)
+            _operation(conn, i, birds)
+            conn.close()
+        per_call = ops / (time.perf_counter() - start)
+
+        pool = db.ConnectionPool(path)
+        start = time.perf_counter()
+        for i in range(ops):
+            with pool.connection() as conn:
+                _operation(conn, i, birds)
+        pooled = ops / (time.perf_counter() - start)
+        pool.close()
+
+    print(f"Per-call connect : {per_call:10.0f} ops/sec")
+    print(f"Connection pool  : {pooled:10.0f} ops/sec")
+    print(f"Speed-up         : {pooled / per_call:10.2f}x")
+    return {"per_call_ops_per_sec": per_call, "pooled_ops_per_sec": pooled}
+
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of a list of numbers, e.g. percentile(v, 0.99).
+    """
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def _client(port, requests, birds, write_ratio, latencies, seed):
+    """
+    One simulated field observer: sends requests one after another over a
+    single connection and records each round trip.
+    """
+    rng = random.Random(seed)
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    for i in range(requests):
+        name = f"Bird {rng.randrange(birds)}"
+        if rng.random() < write_ratio:
+            request = {"op": "add_sighting", "args": {"bird_name": name, "date": "2024-01-01",
+                                                      "location": "Park", "observer": "Loadgen"}}
+        elif rng.random() < 0.5:
+            request = {"op": "get_bird", "args": {"name": name}}
+        else:
+            request = {"op": "sightings_for_bird", "args": {"name": name}}
+        request["id"] = i
+
+        start = time.perf_counter()
+        writer.write(json.dumps(request).encode() + b"\n")
+        await writer.drain()
+        response = json.loads(await reader.readline())
+        latencies.append(time.perf_counter() - start)
+        if not response["ok"]:
+            raise RuntimeError(response["error"])
+    writer.close()
+    await writer.wait_closed()
+
+
+async def _load(clients, requests, birds, write_ratio, workers):
+    import server
+
+    service = server.BirdService(workers)
+    listener = await service.start("127.0.0.1", 0)
+    port = listener.sockets[0].getsockname()[1]
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        _client(port, requests, birds, write_ratio, latencies, seed) for seed in range(clients)
+    ))
+    elapsed = time.perf_counter() - start
+    batches, rows = service.writer.batches, service.writer.rows
+    await service.close()
+    return latencies, elapsed, batches, rows
+
+
+def bench_server(clients=50, requests=200, birds=1000, write_ratio=0.3, workers=8):
+    """
+    Start the asyncio service on a throwaway database and drive it with
+    `clients` concurrent connections. Prints throughput, p50/p99 latency
+    and how many sightings each write transaction carried.
+    """
+    from schema import migrate
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        _seed(path, birds)
+        db.configure(path=path, size=workers + 1)
+        migrate()
+        try:
+            latencies, elapsed, batches, rows = asyncio.run(
+                _load(clients, requests, birds, write_ratio, workers)
+            )
+        finally:
+            db.get_pool().close()
+
+    results = {
+        "requests": len(latencies),
+        "requests_per_sec": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "write_batches": batches,
+        "rows_per_batch": rows / batches if batches else 0.0,
+    }
+    print(f"Requests         : {results['requests']:10d}")
+    print(f"Throughput       : {results['requests_per_sec']:10.0f} req/sec")
+    print(f"Latency p50      : {results['p50_ms']:10.2f} ms")
+    print(f"Latency p99      : {results['p99_ms']:10.2f} ms")
+    print(f"Rows per write   : {results['rows_per_batch']:10.1f} ({batches} transactions)")
+    return results
+
+
+def _write_catalog(path, rows):
+    """
+    Write a synthetic catalog CSV with `rows` distinct birds.
+    """
+    with open(path, mode='w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(['name', 'bio_name', 'origin', 'habitat', 'diet', 'conservation_status', 'description'])
+        for i in range(rows):
+            writer.writerow([f"Catalog bird {i}", f"Avis catalogi {i}", "Asia", "Forest", "Seeds",
+                             "extinct" if i % 50 == 0 else "not extinct", f"Synthetic catalog entry {i}"])
+
+
+def bench_catalog(rows=1000000, workers=None):
+    """
+    Import a synthetic catalog of `rows` birds into an empty database
+    through catalog_import and print rows/sec.
+    """
+    from catalog_import import WORKERS, import_catalog
+    from schema import migrate
+
+    workers = workers or WORKERS
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        catalog = os.path.join(tmp, "catalog.csv")
+        _seed(path, 0)
+        _write_catalog(catalog, rows)
+        db.configure(path=path)
+        migrate()
+        try:
+            report = import_catalog(catalog, workers)
+        finally:
+            db.get_pool().close()
+
+    print(f"Rows imported    : {report.inserted:10d} ({report.rejected} rejected)")
+    print(f"Workers          : {workers:10d}")
+    print(f"Elapsed          : {report.elapsed:10.2f} s")
+    print(f"Throughput       : {report.rows_per_sec:10.0f} rows/sec")
+    return {"rows": report.inserted, "workers": workers, "elapsed": report.elapsed,
+            "rows_per_sec": report.rows_per_sec}
+
+
+def _destination(latitude, longitude, km, bearing):
+    """
+    The point `km` from a point along an initial bearing in degrees, on
+    the sphere geo.haversine_km() measures on.
+    """
+    import math
+    from geo import EARTH_RADIUS_KM
+
+    phi, theta, delta = math.radians(latitude), math.radians(bearing), km / EARTH_RADIUS_KM
+    phi2 = math.asin(math.sin(phi) * math.cos(delta) + math.cos(phi) * math.sin(delta) * math.cos(theta))
+    lam = math.radians(longitude) + math.atan2(math.sin(theta) * math.sin(delta) * math.cos(phi),
+                                               math.cos(delta) - math.sin(phi) * math.sin(phi2))
+    return math.degrees(phi2), (math.degrees(lam) + 540.0) % 360.0 - 180.0
+
+
+def bench_geo(sightings=200000, queries=200, radius_km=100.0, checks=20, seed=0):
+    """
+    Time within_radius() over `sightings` random points and check the
+    first `checks` queries against a full haversine scan. Each checked
+    centre, including one on the equator and one on the antimeridian,
+    gets points just inside and just outside the radius in eight
+    directions, so a bounding box that cuts into the circle shows up as
+    missed sightings.
+    """
+    import geo
+    from schema import migrate
+
+    rng = random.Random(seed)
+    centres = [(0.0, 0.0), (0.0, 180.0), (60.0, -179.9)]
+    centres += [(rng.uniform(-80.0, 80.0), rng.uniform(-180.0, 180.0)) for _ in range(queries - len(centres))]
+    points = [(rng.uniform(-90.0, 90.0), rng.uniform(-180.0, 180.0)) for _ in range(sightings)]
+    for latitude, longitude in centres[:checks]:
+        for bearing in range(0, 360, 45):
+            for factor in (0.9999, 1.0001):
+                points.append(_destination(latitude, longitude, radius_km * factor, bearing))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        _seed(path, 1)
+        db.configure(path=path)
+        migrate()
+        try:
+            with db.session() as conn:
+                conn.executemany(
+                    "INSERT INTO avian_sightings (bird_id, date, location, latitude, longitude) "
+                    "VALUES (1, '2024-01-01', 'Synthetic', ?, ?)", points
+                )
+                rows = conn.execute("SELECT id, latitude, longitude FROM avian_sightings").fetchall()
+
+            latencies = _time_calls(geo.within_radius, [(lat, lon, radius_km) for lat, lon in centres])
+            missed = extra = 0
+            for latitude, longitude in centres[:checks]:
+                found = {sighting.id for sighting, _ in geo.within_radius(latitude, longitude, radius_km)}
+                expected = {i for i, lat, lon in rows if geo.haversine_km(latitude, longitude, lat, lon) <= radius_km}
+                missed += len(expected - found)
+                extra += len(found - expected)
+        finally:
+            db.get_pool().close()
+
+    results = _timings(latencies)
+    results.update({"sightings": len(points), "radius_km": radius_km, "checked": min(checks, len(centres)),
+                    "missed": missed, "extra": extra})
+    print(f"Sightings        : {len(points):10d}")
+    print(f"Radius queries   : {len(latencies):10d} ({radius_km:g} km)")
+    print(f"Latency p50      : {results['p50_ms']:10.2f} ms")
+    print(f"Latency p99      : {results['p99_ms']:10.2f} ms")
+    print(f"Checked queries  : {results['checked']:10d} ({missed} missed, {extra} extra)")
+    return results
+
+
+def _timings(latencies, elapsed=None):
+    """
+    Summarize per-operation latencies in seconds as throughput and
+    percentiles in milliseconds.
+    """
+    elapsed = sum(latencies) if elapsed is None else elapsed
+    return {
+        "ops": len(latencies),
+        "seconds": elapsed,
+        "ops_per_sec": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p90_ms": percentile(latencies, 0.90) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": max(latencies, default=0.0) * 1000,
+    }
+
+
+def _time_calls(function, calls):
+    """
+    Call `function(*args)` for each args tuple and return the latencies.
+    """
+    latencies = []
+    for args in calls:
+        start = time.perf_counter()
+        function(*args)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _run_suite(scale, ops, logins, exports, seed, tmp):
+    from auth import LoginRateLimiter, authenticate
+    from cache import LRUCache
+    from datagen import PASSWORD
+    from export import export_sightings
+    from repository import USER_TYPES, BirdRepository, Sighting, SightingRepository, UserRepository
+    from writebehind import WriteBehind
+
+    rng = random.Random(seed)
+    names = [f"Bird {rng.randrange(scale['birds'])}" for _ in range(ops)]
+    birds = BirdRepository()
+    uncached = BirdRepository(cache=LRUCache(1))
+    sightings = SightingRepository()
+    users = UserRepository()
+    results = {}
+
+    def login(i):
+        user = authenticate(users, f"user{i}", PASSWORD, USER_TYPES[i % len(USER_TYPES)],
+                            rate_limiter=LoginRateLimiter())
+        if user is None:
+            raise RuntimeError(f"Login failed for user{i}.")
+
+    user_ids = [rng.randrange(scale["users"]) for _ in range(logins)]
+    results["login"] = _timings(_time_calls(login, [(i,) for i in user_ids]))
+    results["name_lookup"] = _timings(_time_calls(birds.get_by_name, [(name,) for name in names]))
+    results["name_lookup_uncached"] = _timings(_time_calls(uncached.get_by_name, [(name,) for name in names]))
+    # A misspelt name: one character dropped.
+    typos = [(name[:i] + name[i + 1:],) for name, i in ((name, rng.randrange(len(name))) for name in names)]
+    results["name_index_build"] = _timings(_time_calls(birds.suggest, typos[:1]))
+    results["name_suggest"] = _timings(_time_calls(birds.suggest, typos))
+    results["sightings_for_bird"] = _timings(
+        _time_calls(sightings.list_for_bird_name, [(name,) for name in names])
+    )
+    bird_ids = [(rng.randrange(1, scale["birds"] + 1),) for _ in range(ops)]
+    results["timeline_page"] = _timings(_time_calls(sightings.timeline, bird_ids))
+    results["bird_summaries_page"] = _timings(_time_calls(birds.summaries_page, bird_ids))
+
+    out = os.path.join(tmp, "export.csv")
+    exported = []
+    latencies = _time_calls(lambda: exported.append(export_sightings(out)), [()] * exports)
+    results["full_export"] = _timings(latencies)
+    results["full_export"]["rows_per_sec"] = sum(exported) / sum(latencies) if latencies else 0.0
+
+    def insert(i):
+        sightings.add(Sighting(bird_id=rng.randrange(1, scale["birds"] + 1), date="2024-06-01",
+                               location="Benchmark site", observer=f"user{i % scale['users']}",
+                               latitude=51.5, longitude=-0.1))
+
+    results["sighting_insert"] = _timings(_time_calls(insert, [(i,) for i in range(ops)]))
+
+    writer = WriteBehind(flush_on_exit=False)
+
+    def queue_insert(i):
+        writer.add(Sighting(bird_id=rng.randrange(1, scale["birds"] + 1), date="2024-06-01",
+                            location="Benchmark site", observer=f"user{i % scale['users']}",
+                            latitude=51.5, longitude=-0.1))
+
+    start = time.perf_counter()
+    latencies = _time_calls(queue_insert, [(i,) for i in range(ops)])
+    writer.close()
+    # Throughput counts the time to commit the last queued sighting.
+    results["sighting_insert_write_behind"] = _timings(latencies, time.perf_counter() - start)
+    results["sighting_insert_write_behind"]["batches"] = writer.batches
+    return results
+
+
+def bench_suite(sightings=10000, birds=None, users=None, ops=1000, logins=20, exports=3, seed=0,
+                path=None, out=None):
+    """
+    Time the core operations (login, name lookup and suggestions, sighting
+    insert, direct and write-behind, per-bird sighting listing, timeline
+    and bird summary pages, full export) against a synthetic database and
+    save the results as JSON for comparison across commits.
+    An existing database at `path` is reused; otherwise one is generated
+    there, or in a temporary directory.
+    """
+    from datagen import generate, read_scale
+
+    commit = _git_commit()
+    with tempfile.TemporaryDirectory() as tmp:
+        if path and os.path.exists(path):
+            scale = read_scale(path)
+            generate_seconds = None
+        else:
+            path = path or os.path.join(tmp, "suite.db")
+            start = time.perf_counter()
+            scale = generate(path, sightings, birds, users, seed)
+            generate_seconds = time.perf_counter() - start
+
+        db.configure(path=path)
+        try:
+            operations = _run_suite(scale, ops, logins, exports, seed, tmp)
+        finally:
+            db.get_pool().close()
+
+    results = {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "scale": scale,
+        "generate_seconds": generate_seconds,
+        "operations": operations,
+    }
+    out = out or f"benchmark-{commit or 'local'}-{scale['sightings']}.json"
+    with open(out, mode='w', encoding='utf-8') as file:
+        json.dump(results, file, indent=2)
+
+    print(f"Scale: {scale['users']} users, {scale['birds']} birds, {scale['sightings']} sightings")
+    print(f"{'operation':24} {'ops/sec':>10} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9}")
+    for name, stats in operations.items():
+        print(f"{name:24} {stats['ops_per_sec']:10.1f} {stats['p50_ms']:9.3f} "
+              f"{stats['p90_ms']:9.3f} {stats['p99_ms']:9.3f}")
+    print(f"Results saved to '{out}'.")
+    return results
+
+
+def compare(old_path, new_path):
+    """
+    Print the change in throughput and p99 latency of each operation
+    between two suite results.
+    """
+    with open(old_path, encoding='utf-8') as file:
+        old = json.load(file)
+    with open(new_path, encoding='utf-8') as file:
+        new = json.load(file)
+
+    print(f"{old.get('commit')} -> {new.get('commit')}")
+    print(f"{'operation':24} {'ops/sec':>21} {'change':>8} {'p99 ms':>19} {'change':>8}")
+    for name, after in new["operations"].items():
+        before = old["operations"].get(name)
+        if before is None:
+            continue
+        rate = after["ops_per_sec"] / before["ops_per_sec"] - 1 if before["ops_per_sec"] else 0.0
+        p99 = after["p99_ms"] / before["p99_ms"] - 1 if before["p99_ms"] else 0.0
+        print(f"{name:24} {before['ops_per_sec']:10.1f}{after['ops_per_sec']:11.1f} {rate:+8.1%} "
+              f"{before['p99_ms']:9.3f}{after['p99_ms']:10.3f} {p99:+8.1%}")
+
+
+def _run_python(code, cwd):
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code], cwd=cwd, env=env, check=True)
+    return time.perf_counter() - start
+
+
+def bench_startup(runs=20, target_ms=STARTUP_TARGET_MS):
+    """
+    Time fresh interpreters importing bird_management and running
+    setup_database(), against a new database and against one already at
+    the current schema version, and check the latter against target_ms.
+    """
+    code = "import bird_management; bird_management.setup_database()"
+    with tempfile.TemporaryDirectory() as tmp:
+        # Warm the bytecode cache and the OS file cache first.
+        _run_python(code, tmp)
+        bare = [_run_python("pass", tmp) for _ in range(runs)]
+        current = [_run_python(code, tmp) for _ in range(runs)]
+        fresh = []
+        for _ in range(max(1, runs // 4)):
+            os.remove(os.path.join(tmp, "bird.db"))
+            fresh.append(_run_python(code, tmp))
+
+    results = {
+        "interpreter_ms": percentile(bare, 0.5) * 1000,
+        "current_schema_ms": percentile(current, 0.5) * 1000,
+        "new_database_ms": percentile(fresh, 0.5) * 1000,
+        "target_ms": target_ms,
+    }
+    results["within_target"] = results["current_schema_ms"] <= target_ms
+    print(f"Interpreter only : {results['interpreter_ms']:8.1f} ms")
+    print(f"Current schema   : {results['current_schema_ms']:8.1f} ms (target {target_ms:.0f} ms, "
+          f"{'met' if results['within_target'] else 'MISSED'})")
+    print(f"New database     : {results['new_database_ms']:8.1f} ms")
+    return results
+
+
+def main():
+    """
+    Command line entry point for the benchmarks.
+    """
+    parser = argparse.ArgumentParser(description="Avian Management System benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    pool = commands.add_parser("pool", help="per-call connect vs connection pool")
+    pool.add_argument("--ops", type=int, default=2000)
+    pool.add_argument("--birds", type=int, default=1000)
+
+    load = commands.add_parser("server", help="load-generate against the asyncio service")
+    load.add_argument("--clients", type=int, default=50)
+    load.add_argument("--requests", type=int, default=200, help="requests per client")
+    load.add_argument("--birds", type=int, default=1000)
+    load.add_argument("--write-ratio", type=float, default=0.3)
+    load.add_argument("--workers", type=int, default=8)
+
+    catalog = commands.add_parser("catalog", help="parallel catalog import of synthetic birds")
+    catalog.add_argument("--rows", type=int, default=1000000)
+    catalog.add_argument("--workers", type=int)
+
+    suite = commands.add_parser("suite", help="time the core operations on synthetic data")
+    suite.add_argument("--sightings", type=int, default=10000, help="scale, e.g. 10000 to 10000000")
+    suite.add_argument("--birds", type=int)
+    suite.add_argument("--users", type=int)
+    suite.add_argument("--ops", type=int, default=1000, help="calls per operation")
+    suite.add_argument("--logins", type=int, default=20)
+    suite.add_argument("--exports", type=int, default=3)
+    suite.add_argument("--seed", type=int, default=0)
+    suite.add_argument("--db", help="reuse or keep the generated database at this path")
+    suite.add_argument("--out", help="results file (default benchmark-<commit>-<sightings>.json)")
+
+    radius = commands.add_parser("geo", help="radius search over random sightings, checked by a full scan")
+    radius.add_argument("--sightings", type=int, default=200000)
+    radius.add_argument("--queries", type=int, default=200)
+    radius.add_argument("--radius", type=float, default=100.0, help="km")
+    radius.add_argument("--checks", type=int, default=20, help="queries checked against a full scan")
+
+    startup = commands.add_parser("startup", help="cold-start time of bird_management")
+    startup.add_argument("--runs", type=int, default=20)
+    startup.add_argument("--target-ms", type=float, default=STARTUP_TARGET_MS)
+
+    diff = commands.add_parser("compare", help="compare two suite results")
+    diff.add_argument("old")
+    diff.add_argument("new")
+
+    args = parser.parse_args()
+    if args.command == "pool":
+        bench_pool(args.ops, args.birds)
+    elif args.command == "server":
+        bench_server(args.clients, args.requests, args.birds, args.write_ratio, args.workers)
+    elif args.command == "catalog":
+        bench_catalog(args.rows, args.workers)
+    elif args.command == "geo":
+        results = bench_geo(args.sightings, args.queries, args.radius, args.checks)
+        if results["missed"] or results["extra"]:
+            sys.exit(1)
+    elif args.command == "suite":
+        bench_suite(args.sightings, args.birds, args.users, args.ops, args.logins, args.exports,
+                    args.seed, args.db, args.out)
+    elif args.command == "startup":
+        if not bench_startup(args.runs, args.target_ms)["within_target"]:
+            sys.exit(1)
+    elif args.command == "compare":
+        compare(args.old, args.new)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,32 +1,118 @@
+import atexit
+import itertools
+import json
+import os
 import sqlite3
-import csv
-from tabulate import tabulate
-from menu import *
-
-connection = sqlite3.connect("bird.db")
-cursor = connection.cursor()
-
-
-def create_register_user_table():
-    """
-    Create a user registration table with the following fields:
-    1. username
-    2. email
-    3. password
-    4. user_type
-    """
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT NOT NULL UNIQUE,
-        email TEXT NOT NULL UNIQUE,
-        password TEXT NOT NULL,
-        user_type TEXT CHECK(user_type IN ('researcher', 'common_user', 'student')) NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)
-    ''')
-
-    connection.commit()
-    connection.close()
+import time
+import analytics
+import geo
+from archive import Archive
+from auth import TooManyAttempts, authenticate, hash_password
+from export import export_birds, export_sightings, remove_if_empty
+from instrumentation import configure_from_env, instrument, timed
+from repository import (USER_TYPES, User, Bird, Sighting, UserRepository, BirdRepository, SightingRepository,
+                        columns, as_row, timeline_key)
+from schema import bootstrap
+from search import search_birds, search_sightings
+
+sighting_archive = Archive()
+users = instrument(UserRepository(), "users")
+birds = instrument(BirdRepository(archive=sighting_archive), "birds")
+sightings = instrument(SightingRepository(archive=sighting_archive), "sightings")
+
+# Every other database call made from this module, timed under its own name.
+authenticate = timed("auth.authenticate")(authenticate)
+export_birds = timed("export.birds")(export_birds)
+export_sightings = timed("export.sightings")(export_sightings)
+search_birds = timed("search.birds")(search_birds)
+search_sightings = timed("search.sightings")(search_sightings)
+sighting_counts = timed("analytics.counts")(analytics.counts)
+sighting_totals = timed("analytics.totals")(analytics.totals)
+sightings_within_radius = timed("geo.within_radius")(geo.within_radius)
+
+# Reporting mode: the view_* listings and the exports read through these,
+# which use the live database unless use_reporting_snapshot() points them
+# at a periodically refreshed snapshot.
+report_pool = None
+report_birds = birds
+report_sightings = sightings
+
+# Write-behind mode: new sightings are queued for a background writer that
+# commits them in groups, when use_write_behind() sets one.
+sighting_writer = None
+
+PAGE_SIZE = 50
+# Any tabulate format, or "tsv" for plain tab-separated output that skips
+# tabulate's column-width pass entirely.
+TABLE_FORMAT = "fancy_grid"
+# Whether show_pages() asks before each page. Batch mode turns it off, so
+# that paged listings never take a command's scripted answers.
+PAGE_PROMPT = True
+
+
+def render_table(rows, headers):
+    """
+    Render rows as a table in TABLE_FORMAT. tabulate is imported here, the
+    first time a table is printed, as it is the slowest import at startup.
+    """
+    if TABLE_FORMAT == "tsv":
+        lines = ["\t".join(str(header) for header in headers)]
+        lines.extend("\t".join("" if value is None else str(value) for value in row) for row in rows)
+        return "\n".join(lines)
+    from tabulate import tabulate
+    return tabulate(rows, headers=headers, tablefmt=TABLE_FORMAT)
+
+
+def did_you_mean(name, repository=None):
+    """
+    Offer the birds whose names are closest to a name that was not found,
+    and return the one picked, or None.
+    """
+    suggestions = birds.suggest(name)
+    if not suggestions:
+        return None
+    print("Did you mean:")
+    for number, suggestion in enumerate(suggestions, 1):
+        print(f"  {number}. {suggestion.name} ({suggestion.bio_name})")
+    choice = input("Enter a number to use it, or press Enter to skip: ").strip()
+    if not choice.isdigit() or not 1 <= int(choice) <= len(suggestions):
+        return None
+    return (repository or birds).get(suggestions[int(choice) - 1].bird_id)
+
+
+def show_pages(title, headers, fetch_page, to_row, empty_message, key=lambda record: record.id):
+    """
+    Print a table one page at a time. `fetch_page(after, limit)` returns
+    the records following the key of the last record shown, so every page
+    costs the same however large the table is. Without PAGE_PROMPT every
+    page is printed without asking. Returns the number of records shown.
+    """
+    after = 0
+    shown = 0
+    while True:
+        records = fetch_page(after, PAGE_SIZE)
+        if not records:
+            if not shown:
+                print(empty_message)
+            return shown
+
+        if not shown:
+            print(title)
+        shown += len(records)
+        print(render_table([to_row(record) for record in records], headers))
+
+        if len(records) < PAGE_SIZE:
+            return shown
+        after = key(records[-1])
+        if not PAGE_PROMPT:
+            continue
+        try:
+            answer = input("Press Enter for the next page or Q to stop: ")
+        except EOFError:
+            # No one to press Enter (batch mode, or input piped in): print every page.
+            answer = ""
+        if answer.strip().lower() == 'q':
+            return shown
 
 
 def register_user():
@@ -36,127 +122,88 @@ def register_user():
     2. email
     3. password
     4. user_type
+    Returns True if the user was registered.
     """
-    conn = sqlite3.connect('bird.db')
-    cursor = conn.cursor()
-
     user_name = input("Enter a username: ").strip()
     email = input("Enter a email: ").strip()
     password = input("Enter the password: ").strip()
     user_type = input("Select a user type from given [Student/Researcher/Common_user]: ").strip()
 
     try:
-        cursor.execute('''
-            INSERT INTO users (username, email, password, user_type) 
-            VALUES (?, ?, ?, ?)
-            ''', (user_name, email, password, user_type)) 
-        conn.commit()
+        users.add(User(username=user_name, email=email, password=hash_password(password), user_type=user_type))
         print("User registered successfully.")
+        return True
     except Exception as e:
         print("Error:", e)
-    finally:
-        conn.close()
+        return False
 
 
-def login_user():
+def login_user(username_or_email=None, user_type=None, password=None):
     """
-    Login an existing user with their credentials.
+    Login an existing user with their credentials, prompting for any not
+    given. Returns the user, or None if the login failed.
     """
-    conn = sqlite3.connect('bird.db')
-    cursor = conn.cursor()
-
-    username_or_email = input("Enter a username or email: ").strip()
-    password = input("Enter the password: ").strip()
-    user_type = input("Select a user type from given [Student/Researcher/Common_user]: ").lower().strip()
-
-    cursor.execute('''
-        SELECT * FROM users
-        WHERE (username = ? OR email = ?) AND password = ? AND user_type = ?
-        ''', (username_or_email, username_or_email, password, user_type))
+    if username_or_email is None:
+        username_or_email = input("Enter a username or email: ").strip()
+    if password is None:
+        password = input("Enter the password: ").strip()
+    if user_type is None:
+        user_type = input("Select a user type from given [Student/Researcher/Common_user]: ").lower().strip()
 
-    user = cursor.fetchone()
-    conn.close()
+    try:
+        user = authenticate(users, username_or_email, password, user_type)
+    except TooManyAttempts as e:
+        print(f"ERROR: {e}")
+        return None
 
     if user:
-        print(f"Login successful. Welcome, {user[1]}, you are logged in as a {user[4]}.")
-        if user_type == 'student':
-            student_menu()
-        elif user_type == 'researcher':
-            researcher_menu()
-        elif user_type == 'common_user':
-            common_user_menu()
-        else:
-            print("Check user type.")
+        print(f"Login successful. Welcome, {user.username}, you are logged in as a {user.user_type}.")
         return user
     else:
         print("ERROR: Login Failed!.")
         return None
 
 
-def create_bird_detail_table():
+def add_bird_details(**details):
     """
-    Create a table for storing bird details.
+    Add details of a new bird to the database. Any detail passed as a
+    keyword argument is used as given instead of being prompted for.
     """
+    prompts = [
+        ("name", "Enter bird name: "),
+        ("bio_name", "Enter biological name: "),
+        ("origin", "Enter origin: "),
+        ("habitat", "Enter habitat: "),
+        ("diet", "Enter diet: "),
+        ("conservation_status", "Enter conservation status (extinct/not extinct): "),
+        ("description", "Enter description: "),
+    ]
     try:
-        cursor.execute('''CREATE TABLE IF NOT EXISTS bird_details (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL UNIQUE,
-            bio_name TEXT NOT NULL UNIQUE,
-            origin TEXT NOT NULL,
-            habitat TEXT NOT NULL,
-            diet TEXT NOT NULL,
-            conservation_status TEXT CHECK(conservation_status IN ('extinct', 'not extinct')) NOT NULL,
-            description TEXT NOT NULL)
-        ''')
-    except Exception as e:
-        print(f"Unexpected Error: {e}")
-    finally:
-        connection.close()
-
+        for field, prompt in prompts:
+            if field not in details:
+                details[field] = input(prompt).strip()
 
-def add_bird_details():
-    """
-    Add details of a new bird to the database.
-    """
-    try:
-        conn = sqlite3.connect('bird.db')
-        cursor = conn.cursor()
-
-        name = input("Enter bird name: ").strip()
-        bio_name = input("Enter biological name: ").strip()
-        origin = input("Enter origin: ").strip()
-        habitat = input("Enter habitat: ").strip()
-        diet = input("Enter diet: ").strip()
-        conservation_status = input("Enter conservation status (extinct/not extinct): ").strip()
-        description = input("Enter description: ").strip()
-
-        cursor.execute('''
-        INSERT INTO bird_details (name, bio_name, origin, habitat, diet, conservation_status, description)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (name, bio_name, origin, habitat, diet, conservation_status, description))
-
-        conn.commit()
-        print(f"Bird '{name}' added successfully.")
+        bird = birds.add(Bird(**details))
+        print(f"Bird '{bird.name}' added successfully.")
     except Exception as e:
         print(f"Unexpected error: {e}")
         print("Warning: 'conservation_status' must be 'extinct' or 'not extinct'.")
-    finally:
-        conn.close()
 
 
 def update_bird_by_name():
     """
     Update details of an existing bird in the database.
     """
-    conn = sqlite3.connect('bird.db')
-    cursor = conn.cursor()
-
     name = input("Enter the name of the bird to edit: ").strip()
-    cursor.execute("SELECT * FROM bird_details WHERE LOWER(name) = LOWER(?)", (name.lower(),))
-    bird = cursor.fetchone()
+
+    bird = birds.get_by_name(name)
+
+    if not bird:
+        print(f"Bird '{name}' not found.")
+        bird = did_you_mean(name)
 
     if not bird:
-        choice = input(f"Bird '{name}' not found. Do you want to add it as a new bird? (T/F): ").strip().upper()
+        choice = input("Do you want to add it as a new bird? (T/F): ").strip().upper()
         if choice == 'T':
             bio_name = input("Enter biological name: ").strip()
             diet = input("Enter diet: ").strip()
@@ -176,10 +223,10 @@ def update_bird_by_name():
             )
         else:
             print("Update Cancelled!.")
-        conn.close()
         return
 
-    print(f"\nEditing details for bird: {bird}")
+    name = bird.name
+    print(f"\nEditing details for bird: {as_row(bird)}")
     print("Leave blank to keep the current value.\n")
     
     new_bio_name = input("New biological name: ").strip()
@@ -188,344 +235,315 @@ def update_bird_by_name():
     new_habitat = input("New habitat: ").strip()
     new_description = input("New description: ").strip()
 
-    updated_fields = []
-    new_values = []
+    changes = {}
 
     if new_bio_name:
-        updated_fields.append("bio_name = ?")
-        new_values.append(new_bio_name)
+        changes["bio_name"] = new_bio_name
     if new_diet:
-        updated_fields.append("diet = ?")
-        new_values.append(new_diet)
+        changes["diet"] = new_diet
     if new_conservation_status in ['extinct', 'not extinct']:
-        updated_fields.append("conservation_status = ?")
-        new_values.append(new_conservation_status)
+        changes["conservation_status"] = new_conservation_status
     elif new_conservation_status:
         print("Conservation status must be 'extinct' or 'not extinct'.")
     if new_habitat:
-        updated_fields.append("habitat = ?")
-        new_values.append(new_habitat)
+        changes["habitat"] = new_habitat
     if new_description:
-        updated_fields.append("description = ?")
-        new_values.append(new_description) 
+        changes["description"] = new_description
 
-    if not updated_fields:
+    if not changes:
         print("No fields to update.")
-        conn.close()
         return
 
     try:
-        sql = f"UPDATE bird_details SET {', '.join(updated_fields)} WHERE LOWER(name) = ?"
-        new_values.append(name.lower())
-
-        cursor.execute(sql, new_values)
-        conn.commit()
+        birds.update(name, **changes)
         print(f"Bird '{name}' details updated successfully.")
     except Exception as e:
         print(f"ERROR: {e}")
-    finally:
-        conn.close()
 
 
 def remove_bird_by_name():
     """
     Remove a bird from the database by its name.
     """
-    conn = sqlite3.connect('bird.db')
-    cursor = conn.cursor()
-
     name = input("Enter the name of the bird to be removed from table: ").strip()
 
-    cursor.execute("SELECT * FROM bird_deatils WHERE LOWER(name) = LOWER(?)", (name.lower(),))
-    bird = cursor.fetchone()
+    bird = birds.get_by_name(name)
 
     if not bird:
         print(f"Bird '{name}' does not exist in the database.")
-        conn.close()
         return
 
-    print(f"Bird {bird} exist in the database")
+    print(f"Bird {as_row(bird)} exist in the database")
     confirm = input(f"Are you sure you want to delete '{name}'? (T/F): ").strip().upper()
 
     if confirm == 'T':
         try:
-            cursor.execute("DELETE FROM bird_deatils WHERE LOWER(name) = LOWER(?)", (name.lower(),))
-            conn.commit()
+            birds.delete(name)
             print(f"Bird '{name}' deleted successfully.")
         except Exception as e:
             print(f"ERROR occurred while deleting: {e}")
     else:
         print("Deletion canceled.")
 
-    conn.close()  
+
+def use_reporting_snapshot(reporting_snapshot):
+    """
+    Serve the view_* and export_* operations from a snapshot.Snapshot, so
+    that heavy reads never hold a transaction on the live database.
+    """
+    global report_pool, report_birds, report_sightings
+    report_pool = reporting_snapshot
+    report_birds = instrument(BirdRepository(reporting_snapshot, reporting_snapshot.cache), "report.birds")
+    report_sightings = instrument(SightingRepository(reporting_snapshot, sighting_archive), "report.sightings")
+
+
+def use_write_behind(writer):
+    """
+    Queue new sightings on a writebehind.WriteBehind instead of committing
+    each one as it is entered.
+    """
+    global sighting_writer
+    sighting_writer = writer
 
 
 def view_bird_by_name():
     """
     View details of a specific bird by its name.
     """
-    conn = sqlite3.connect('bird.db')
-    cursor = conn.cursor()
-
     name = input("Enter the name of the bird to view from table: ").strip()
     
-    cursor.execute("SELECT * FROM bird_deatils WHERE LOWER(name) = LOWER(?)", (name.lower(),))
-    bird = cursor.fetchone()
+    bird = report_birds.get_by_name(name)
 
     if not bird:
         print(f"No bird named '{name}' found in the database.")
-    else:
-        column_names = [desc[0].capitalize() for desc in cursor.description]
-        table = [bird]
+        bird = did_you_mean(name, report_birds)
 
-        print(f"\n Details for bird '{name}':")
-        print(tabulate(table, headers=column_names, tablefmt="fancy_grid"))
+    if bird:
+        column_names = [column.capitalize() for column in columns(Bird)]
+        table = [as_row(bird)]
 
-    conn.close()
+        print(f"\n Details for bird '{bird.name}':")
+        print(render_table(table, headers=column_names))
    
 
 def view_bird_details_table():
     """
     View all bird details from the database.
     """
-    conn = sqlite3.connect('bird.db')
-    cursor = conn.cursor()
-
-    cursor.execute("SELECT * FROM bird_details")
-    birds = cursor.fetchall()
-
-    if not birds:
-        print("No bird records found in the database.")
-    else:
-        column_names = [desc[0].capitalize() for desc in cursor.description]
-
-        print("\n All Bird Records:")
-        print(tabulate(birds, headers=column_names, tablefmt="fancy_grid"))
-
-    conn.close()
+    column_names = [column.capitalize() for column in columns(Bird)]
+    show_pages("\n All Bird Records:", column_names, report_birds.page, as_row,
+               "No bird records found in the database.")
 
 
 def export_bird_data_to_csv():
     """
-    Export bird data to a CSV file.
+    Export bird or sighting data to a CSV file.
     """
-    conn = sqlite3.connect('bird.db')
-    cursor = conn.cursor()
-
     print("\n Export Bird Data to CSV")
     print("1. Export a specific bird by name")
     print("2. Export all birds")
-    choice = input("Enter your choice (1 or 2): ").strip()
+    print("3. Export sightings")
+    print("4. Export changes since a sequence number")
+    choice = input("Enter your choice (1, 2, 3 or 4): ").strip()
 
     if choice == "1":
         name = input("Enter the bird name to export: ").strip()
+        filename = f"{name.lower().replace(' ', '_')}_details.csv"
 
-        cursor.execute("SELECT * FROM bird_deatils WHERE LOWER(name) = LOWER(?)", (name.lower(),))
-        bird = cursor.fetchone()
-
-        if not bird:
-            print(f"Bird '{name}' not found in the database.")
-        else:
-            column_names = [desc[0] for desc in cursor.description]
-            filename = f"{name.lower().replace(' ', '_')}_details.csv"
-
-            with open(filename, mode='w', newline='', encoding='utf-8') as file:
-                writer = csv.writer(file)
-                writer.writerow(column_names)
-                writer.writerow(bird)
+        count = export_birds(filename, name=name, pool=report_pool)
 
+        if count:
             print(f"Bird '{name}' exported to '{filename}'.")
+        else:
+            remove_if_empty(filename, count)
+            print(f"Bird '{name}' not found in the database.")
 
     elif choice == "2":
-        cursor.execute("SELECT * FROM bird_deatils")
-        birds = cursor.fetchall()
+        filename = "all_bird_details.csv"
 
-        if not birds:
-            print("No saved bird records found.")
+        count = export_birds(filename, pool=report_pool)
+
+        if count:
+            print(f"All bird records exported to '{filename}'.")
         else:
-            column_names = [desc[0] for desc in cursor.description]
-            filename = "all_bird_details.csv"
+            remove_if_empty(filename, count)
+            print("No saved bird records found.")
 
-            with open(filename, mode='w', newline='', encoding='utf-8') as file:
-                writer = csv.writer(file)
-                writer.writerow(column_names)
-                writer.writerows(birds)
+    elif choice == "3":
+        print("Leave blank to skip a filter.")
+        bird_name = input("Bird name: ").strip()
+        start_date = input("From date (YYYY-MM-DD): ").strip()
+        end_date = input("To date (YYYY-MM-DD): ").strip()
+        location = input("Location contains: ").strip()
+        conservation_status = input("Conservation status (extinct/not extinct): ").strip()
+        compress = input("Compress with gzip? (T/F): ").strip().upper() == 'T'
+        filename = "avian_sightings.csv.gz" if compress else "avian_sightings.csv"
 
-            print(f"All bird records exported to '{filename}'.")
+        try:
+            count = export_sightings(filename, bird_name, start_date, end_date, location,
+                                     conservation_status, compress, pool=report_pool, archive=sighting_archive)
+        except Exception as e:
+            print(f"ERROR occurred while exporting: {e}")
+            return
 
-    else:
-        print("Invalid choice. Please enter 1 or 2.")
+        if count:
+            print(f"{count} sightings exported to '{filename}'.")
+        else:
+            remove_if_empty(filename, count)
+            print("No sightings match the given filters.")
 
-    conn.close()
-    
+    elif choice == "4":
+        from changes import export_changes
 
-def create_avian_sightings_table():
-    """
-    Create the avian_sightings table in the database.
-    """
-    conn = sqlite3.connect('bird.db')
-    cursor = conn.cursor()
+        since = input("Export changes after sequence number (blank for all): ").strip()
+        filename = "changes.csv"
 
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS avian_sightings (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        bird_id INTEGER NOT NULL,
-        date TEXT NOT NULL,
-        location TEXT NOT NULL,
-        observer TEXT,
-        notes TEXT,
-        FOREIGN KEY (bird_id) REFERENCES bird_details(id) ON DELETE CASCADE
-    );
-    ''')
+        try:
+            since = int(since or 0)
+        except ValueError:
+            print("Please enter a whole number.")
+            return
 
-    conn.commit()
-    conn.close()
-    print("Table 'avian_sightings' created or already exists.")
+        try:
+            count, until = timed("export.changes")(export_changes)(filename, since, pool=report_pool)
+        except Exception as e:
+            print(f"ERROR occurred while exporting: {e}")
+            return
+
+        if count:
+            print(f"{count} changes exported to '{filename}'. Next time, export changes after {until}.")
+        else:
+            remove_if_empty(filename, count)
+            print(f"No changes after sequence number {until}.")
+
+    else:
+        print("Invalid choice. Please enter 1, 2, 3 or 4.")
     
 
 def add_avian_sighting():
     """
     Add a new avian sighting to the database.
     """
-    conn = sqlite3.connect('bird.db')
-    cursor = conn.cursor()
-
     bird_name = input("Enter bird name: ").strip()
 
-    cursor.execute("SELECT id FROM bird_details WHERE LOWER(name) = LOWER(?)", (bird_name.lower(),))
-    result = cursor.fetchone()
-
-    if not result:
-        print(f"Bird '{bird_name}' does not exist in the bird_details table. Cannot add sighting.")
-        conn.close()
-        return
+    bird = birds.get_by_name(bird_name)
 
-    bird_id = result[0]
+    if not bird:
+        print(f"Bird '{bird_name}' does not exist in the bird_details table.")
+        bird = did_you_mean(bird_name)
+        if not bird:
+            print("Cannot add sighting.")
+            return
+        bird_name = bird.name
 
     date = input("Enter sighting date (YYYY-MM-DD): ").strip()
     location = input("Enter location: ").strip()
     observer = input("Enter observer name (optional): ").strip()
     notes = input("Additional notes (optional): ").strip()
+    latitude = input("Enter latitude (optional): ").strip()
+    longitude = input("Enter longitude (optional): ").strip()
 
     try:
-        cursor.execute('''
-            INSERT INTO avian_sightings (bird_id, date, location, observer, notes)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (bird_id, date, location, observer or None, notes or None))
-
-        conn.commit()
+        sighting = Sighting(bird_id=bird.id, date=date, location=location, observer=observer, notes=notes,
+                            latitude=float(latitude) if latitude else None,
+                            longitude=float(longitude) if longitude else None)
+        if sighting_writer is not None:
+            sighting_writer.add(sighting)
+            print(f"Sighting of '{bird_name}' queued.")
+            return
+        sightings.add(sighting)
         print(f"Sighting of '{bird_name}' added successfully.")
 
     except Exception as e:
         print(f"Failed to add sighting: {e}")
 
-    finally:
-        conn.close()
-
 
 def view_avian_sightings_by_bird_name():
     """
     View avian sightings for a specific bird by its name.
     """
-    conn = sqlite3.connect('bird.db')
-    cursor = conn.cursor()
-
     bird_name = input("Enter the bird name to view its sightings: ").strip()
 
-    cursor.execute('''
-        SELECT a.id, b.name, a.date, a.location, a.observer, a.notes
-        FROM avian_sightings a
-        JOIN bird_deatils b ON a.bird_id = b.id
-        WHERE LOWER(b.name) = LOWER(?)
-        ORDER BY a.date DESC
-    ''', (bird_name.lower(),))
-
-    sightings = cursor.fetchall()
+    bird = report_birds.get_by_name(bird_name)
 
-    if not sightings:
+    if not bird:
         print(f"No sightings found for bird '{bird_name}'.")
-    else:
-        print(f"\n Avian Sightings for '{bird_name}':")
-        headers = ["Sighting ID", "Bird Name", "Date", "Location", "Observer", "Notes"]
-        print(tabulate(sightings, headers=headers, tablefmt="fancy_grid"))
+        return
 
-    conn.close()
+    show_pages(f"\n Avian Sightings for '{bird.name}':",
+               ["Sighting ID", "Bird Name", "Date", "Location", "Observer", "Notes"],
+               lambda after, limit: report_sightings.timeline(bird.id, after, limit),
+               lambda s: (s.id, s.bird_name, s.date, s.location, s.observer, s.notes),
+               f"No sightings found for bird '{bird_name}'.", key=timeline_key)
 
 
 def update_avian_sighting_by_bird_name():
     """
     Update an existing avian sighting in the database.
     """
-    conn = sqlite3.connect('bird.db')
-    conn.execute("PRAGMA foreign_keys = ON")
-    cursor = conn.cursor()
-
     bird_name = input("Enter the bird name to update a sighting for: ").strip()
 
-    cursor.execute("SELECT id FROM bird_details WHERE LOWER(name) = LOWER(?)", (bird_name.lower(),))
-    bird = cursor.fetchone()
+    bird = birds.get_by_name(bird_name)
 
     if not bird:
         print(f"Bird '{bird_name}' not found in the database.")
-        conn.close()
         return
 
-    bird_id = bird[0]
-
-    cursor.execute("""
-        SELECT id, date, location, observer, notes
-        FROM avian_sightings
-        WHERE bird_id = ?
-        ORDER BY date DESC
-    """, (bird_id,))
-    sightings = cursor.fetchall()
+    # Q stops paging once the sighting to update has been listed. Archived
+    # sightings are read-only, so they are not offered.
+    shown = show_pages(f"\n Sightings for '{bird_name}' (archived sightings are read-only and not listed):",
+                       ["Sighting ID", "Date", "Location", "Observer", "Notes"],
+                       lambda after, limit: sightings.timeline(bird.id, after, limit, archived=False),
+                       lambda s: (s.id, s.date, s.location, s.observer, s.notes),
+                       f"No sightings found for bird '{bird_name}'.", key=timeline_key)
 
-    if not sightings:
-        print(f"No sightings found for bird '{bird_name}'.")
-        conn.close()
+    if not shown:
         return
 
-    print(f"\n Sightings for '{bird_name}':")
-    headers = ["Sighting ID", "Date", "Location", "Observer", "Notes"]
-    print(tabulate(sightings, headers=headers, tablefmt="fancy_grid"))
-
     try:
         sighting_id = int(input("Enter the Sighting ID to update: ").strip())
     except ValueError:
         print("Invalid ID Given.")
-        conn.close()
         return
 
-    cursor.execute("SELECT date, observer, notes FROM avian_sightings WHERE id = ? AND bird_id = ?", (sighting_id, bird_id))
-    result = cursor.fetchone()
+    sighting = sightings.get(sighting_id, bird_id=bird.id)
 
-    if not result:
+    if not sighting:
         print("Sighting for input bird is not found.")
-        conn.close()
         return
 
-    current_date, current_observer, current_notes = result
-
-    print(f"\n Current Date: {current_date}")
-    print(f"Current Observer: {current_observer}")
-    print(f"Current Notes:\n{current_notes or '—'}")
-
-    new_date = input("Enter a new date to append (YYYY-MM-DD), or press Enter to skip: ").strip()
-    new_observer = input("Enter a new observer name to append, or press Enter to skip: ").strip()
-    new_note = input("Enter new note to append, or press Enter to skip: ").strip()
-
-    updated_date = f"{current_date} | {new_date}" if new_date else current_date
-    updated_observer = f"{current_observer} | {new_observer}" if new_observer else current_observer
-    updated_notes = f"{current_notes}\n---\n{new_note}" if new_note else current_notes
-
-    cursor.execute("""
-        UPDATE avian_sightings
-        SET date = ?, observer = ?, notes = ?
-        WHERE id = ?
-    """, (updated_date, updated_observer, updated_notes, sighting_id))
+    history = sightings.history(sighting.id)
+    if history:
+        print(f"\n Earlier versions of sighting {sighting.id}:")
+        headers = ["Revised At", "Date", "Location", "Observer", "Notes"]
+        table = [(r.revised_at or '—', r.date, r.location, r.observer, r.notes) for r in history]
+        print(render_table(table, headers=headers))
+
+    print(f"\n Current Date: {sighting.date}")
+    print(f"Current Observer: {sighting.observer}")
+    print(f"Current Notes:\n{sighting.notes or '—'}")
+
+    new_date = input("Enter a new date (YYYY-MM-DD), or press Enter to keep the current one: ").strip()
+    new_observer = input("Enter a new observer name, or press Enter to keep the current one: ").strip()
+    new_note = input("Enter a new note, or press Enter to keep the current one: ").strip()
+
+    changes = {}
+    if new_date:
+        changes["date"] = new_date
+    if new_observer:
+        changes["observer"] = new_observer
+    if new_note:
+        changes["notes"] = new_note
+
+    if not changes:
+        print("No fields to update.")
+        return
 
-    conn.commit()
-    conn.close()
+    try:
+        sightings.update(sighting_id, **changes)
+    except ValueError as e:
+        print(f"ERROR: {e}")
+        return
 
     print("\n Sighting updated successfully.")
 
@@ -534,197 +552,316 @@ def view_sightings_for_all_birds():
     """
     View all avian sightings from the database.
     """
-    conn = sqlite3.connect('bird.db')
-    cursor = conn.cursor()
-
-    cursor.execute("SELECT * FROM avian_sightings")
-    birds = cursor.fetchall()
-
-    if not birds:
-        print("No bird records found in the database.")
-    else:
-        column_names = [desc[0].capitalize() for desc in cursor.description]
-
-        print("\n Records of All Birds:")
-        print(tabulate(birds, headers=column_names, tablefmt="fancy_grid"))
-
-    conn.close()
+    column_names = [column.capitalize() for column in columns(Sighting)]
+    show_pages("\n Records of All Birds:", column_names, report_sightings.page, as_row,
+               "No bird records found in the database.")
 
 
 def view_all_birds_existing_in_db():
     """
-    View all bird names from the database.
+    View all bird names from the database, with how often, when and by how
+    many observers each was sighted.
     """
-    conn = sqlite3.connect('bird.db')
-    cursor = conn.cursor()
+    serial_numbers = itertools.count(1)
+    show_pages("\n Names of all Birds saved in the Database:",
+               ["Sl. No.", "Bird Name", "Sightings", "First Seen", "Last Seen", "Observers"],
+               report_birds.summaries_page,
+               lambda bird: (next(serial_numbers), bird.name, bird.sightings, bird.first_seen or "-",
+                             bird.last_seen or "-", bird.observers),
+               "No bird names found.")
 
-    cursor.execute("SELECT name FROM bird_details")
-    bird_names = cursor.fetchall()
 
-    if not bird_names:
-        print("No bird names found.")
-    else:
-        bird_names_with_slno = [(i+1, name[0]) for i, name in enumerate(bird_names)]
+def search_birds_and_sightings():
+    """
+    Full-text search over bird details and sighting notes and locations.
+    """
+    text = input("Enter search words: ").strip()
+    if not text:
+        print("Nothing to search for.")
+        return
 
-        print("\n Names of all Birds saved in the Database:")
-        print(tabulate(bird_names_with_slno, headers=["Sl. No.", "Bird Name"], tablefmt="fancy_grid"))
+    bird_matches = search_birds(text)
+    sighting_matches = search_sightings(text)
 
-    conn.close()
+    if not bird_matches and not sighting_matches:
+        print(f"Nothing matches '{text}'.")
+        return
 
+    if bird_matches:
+        print(f"\n Birds matching '{text}':")
+        table = [(m.bird_id, m.name, m.snippet) for m in bird_matches]
+        print(render_table(table, headers=["Bird ID", "Bird Name", "Match"]))
+    if sighting_matches:
+        print(f"\n Sightings matching '{text}':")
+        table = [(m.sighting_id, m.bird_name, m.date, m.location, m.snippet) for m in sighting_matches]
+        print(render_table(table, headers=["Sighting ID", "Bird Name", "Date", "Location", "Match"]))
 
-def main():
+
+def view_sighting_statistics():
     """
-    Main function to run the Avian Management System.
+    View sighting counts per bird, location, day or month.
     """
-    print("\n-----WELCOME TO AVIAN MANAGEMENT SYSTEM------\n")
+    dimension = input("Count sightings per (bird/location/day/month): ").strip().lower()
+    if dimension not in analytics.DIMENSIONS:
+        print("Invalid choice. Please enter bird, location, day or month.")
+        return
 
-    user_exist = input("Are you a registered user? (T/F): ").strip().lower()
+    rows = sighting_counts(dimension, limit=PAGE_SIZE)
+    if not rows:
+        print("No sightings recorded yet.")
+        return
 
-    if user_exist == 'f':
-        want_to_register = input("Do you want to register? (T/F): ").strip().lower()
-        if want_to_register == 't':
-            register_user()
-        else:
-            print("\n Thank you for visiting!")
-            exit()
-    else:
-        user = login_user()  
-        if user:
-            user_type = user[4].lower()
-            if user_type == 'student':
-                student_menu()
-            elif user_type == 'researcher':
-                researcher_menu()
-            else:
-                common_user_menu()
+    print(f"\n Sightings per {dimension}:")
+    print(render_table(rows, headers=[dimension.capitalize(), "Sightings"]))
+    summary = sighting_totals(dimension)
+    print(f"Total: {summary['total']}, {dimension}s: {summary['keys']}, "
+          f"mean: {summary['mean']:.1f}, busiest: {summary['busiest']}")
 
 
-def student_menu():
+def view_sightings_near_place():
     """
-    Student menu for avian management system.
+    View the sightings within a radius of a latitude/longitude, nearest first.
     """
-    
-    print("\n Please choose an option below:")
-    print("1. View all saved avian species")
-    print("2. View detailed information for all avians")
-    print("3. View details for a specific bird")
-    print("4. View sightings for a specific bird")
-    print("5. View sightings for all birds")
-    print("6. Add a new avian sighting")
-    print("7. Export avian details to CSV")
-    print("0. Exit")
-
     try:
-        choice = int(input("Enter your choice: "))
+        latitude = float(input("Enter latitude: ").strip())
+        longitude = float(input("Enter longitude: ").strip())
+        radius = float(input("Enter radius in km: ").strip())
     except ValueError:
-        print("Invalid input. Please enter a number between 0 and 7.")
-
-    if choice == 1:
-        view_all_birds_existing_in_db()
-    elif choice == 2:
-        view_bird_details_table()
-    elif choice == 3:
-        view_bird_by_name()
-    elif choice == 4:
-        view_avian_sightings_by_bird_name()
-    elif choice == 5:
-        view_sightings_for_all_birds()
-    elif choice == 6:
-        update_avian_sighting_by_bird_name()
-    elif choice == 7:
-        export_bird_data_to_csv()
-    elif choice == 0:
-        print("Exiting the menu.")
-        exit()
-    else:
-        print("Invalid choice. Please select a valid option.")
+        print("Invalid input. Latitude, longitude and radius must be numbers.")
+        return
 
+    matches = sightings_within_radius(latitude, longitude, radius)
+    if not matches:
+        print(f"No sightings within {radius:g} km of ({latitude}, {longitude}).")
+        return
 
-def researcher_menu():
-    """
-    Researcher menu for avian management system.
-    """
-    print("\n Please choose an option below:")
-    print("1. View all saved avian species")
-    print("2. View detailed information for all avians")
-    print("3. View details for a specific bird")
-    print("4. View sightings for a specific bird")
-    print("5. View sightings for all birds")
-    print("6. Add a new avian sighting") 
-    print("7. Update avian detail for a specific bird")   
-    print("8. Update avian sighting for a specific bird")
-    print("9. Remove specific bird information")
-    print("10. Export avian details to CSV")
-    print("0. Exit")
+    print(f"\n Sightings within {radius:g} km of ({latitude}, {longitude}):")
+    headers = ["Sighting ID", "Bird Name", "Date", "Location", "Distance (km)"]
+    table = [(s.id, s.bird_name, s.date, s.location, round(distance, 2)) for s, distance in matches]
+    print(render_table(table, headers=headers))
+
+
+@timed("setup_database")
+def setup_database():
+    """
+    Create the tables and apply pending schema migrations, unless the
+    database is already at the current schema version.
+    """
+    bootstrap()
+
+
+# Every menu command, by the name batch files use for it.
+COMMANDS = {
+    "view_all_birds_existing_in_db": ("View all saved avian species", view_all_birds_existing_in_db),
+    "view_bird_details_table": ("View detailed information for all avians", view_bird_details_table),
+    "view_bird_by_name": ("View details for a specific bird", view_bird_by_name),
+    "view_avian_sightings_by_bird_name": ("View sightings for a specific bird", view_avian_sightings_by_bird_name),
+    "view_sightings_for_all_birds": ("View sightings for all birds", view_sightings_for_all_birds),
+    "add_avian_sighting": ("Add a new avian sighting", add_avian_sighting),
+    "update_bird_by_name": ("Update avian detail for a specific bird", update_bird_by_name),
+    "update_avian_sighting_by_bird_name": ("Update avian sighting for a specific bird",
+                                           update_avian_sighting_by_bird_name),
+    "remove_bird_by_name": ("Remove specific bird information", remove_bird_by_name),
+    "export_bird_data_to_csv": ("Export avian details to CSV", export_bird_data_to_csv),
+    "search_birds_and_sightings": ("Search birds and sightings", search_birds_and_sightings),
+    "view_sighting_statistics": ("View sighting statistics", view_sighting_statistics),
+    "view_sightings_near_place": ("Find sightings near a place", view_sightings_near_place),
+}
+
+# The menu of each user type, in option order from 1; 0 always exits.
+ROLE_MENUS = {
+    "student": (
+        "view_all_birds_existing_in_db", "view_bird_details_table", "view_bird_by_name",
+        "view_avian_sightings_by_bird_name", "view_sightings_for_all_birds", "add_avian_sighting",
+        "export_bird_data_to_csv", "search_birds_and_sightings",
+    ),
+    "researcher": (
+        "view_all_birds_existing_in_db", "view_bird_details_table", "view_bird_by_name",
+        "view_avian_sightings_by_bird_name", "view_sightings_for_all_birds", "add_avian_sighting",
+        "update_bird_by_name", "update_avian_sighting_by_bird_name", "remove_bird_by_name",
+        "export_bird_data_to_csv", "search_birds_and_sightings", "view_sighting_statistics",
+        "view_sightings_near_place",
+    ),
+    "common_user": (
+        "view_all_birds_existing_in_db", "view_bird_details_table", "view_bird_by_name",
+        "view_avian_sightings_by_bird_name", "view_sightings_for_all_birds", "export_bird_data_to_csv",
+        "search_birds_and_sightings",
+    ),
+}
+
+PASSWORD_ENV = "BIRD_PASSWORD"
+
+
+class Session:
+    """
+    A logged-in user's session: the menu of their user type is looked up
+    once, and commands run one after another in the same process, on the
+    same connection pool and caches, until the user exits.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self.menu = [(name, *COMMANDS[name]) for name in ROLE_MENUS[user.user_type.lower()]]
+        self.commands = {name: function for name, _, function in self.menu}
+
+    def show_menu(self):
+        print("\n Please choose an option below:")
+        for number, (_, label, _) in enumerate(self.menu, 1):
+            print(f"{number}. {label}")
+        print("0. Exit")
+
+    def dispatch(self, choice):
+        """
+        Run the command with this menu number. Returns False for 0 (exit).
+        """
+        if choice == 0:
+            return False
+        if 1 <= choice <= len(self.menu):
+            self.menu[choice - 1][2]()
+        else:
+            print("Invalid choice. Please select a valid option.")
+        return True
+
+    def run(self):
+        """
+        Show the menu and run the chosen command until the user exits.
+        """
+        while True:
+            self.show_menu()
+            try:
+                choice = int(input("Enter your choice: "))
+            except ValueError:
+                print(f"Invalid input. Please enter a number between 0 and {len(self.menu)}.")
+                continue
+            except EOFError:
+                choice = 0
+            if not self.dispatch(choice):
+                print("Exiting the menu.")
+                return
+
+    def run_batch(self, path):
+        """
+        Run the commands of a JSON-lines file, one per line, such as
+
+            {"command": "view_bird_by_name", "input": ["Robin"]}
+
+        where "input" answers the command's prompts in order. A command
+        that is not on the user's menu, runs out of answers or hits a
+        database error is reported with its line number and skipped. Paged
+        listings print every page without asking. Returns (commands run,
+        failed).
+        """
+        global PAGE_PROMPT
+        start = time.perf_counter()
+        PAGE_PROMPT = False
+        try:
+            run, failed = self._run_lines(path)
+        finally:
+            PAGE_PROMPT = True
+        elapsed = time.perf_counter() - start
+        print(f"Ran {run} commands in {elapsed:.2f}s ({run / elapsed if elapsed else 0.0:.0f}/sec), {failed} failed.")
+        return run, failed
+
+    def _run_lines(self, path):
+        run = failed = 0
+        with open(path, encoding='utf-8') as file:
+            for line_number, line in enumerate(file, 1):
+                if not line.strip():
+                    continue
+                try:
+                    request = json.loads(line)
+                    name = request["command"]
+                    function = self.commands.get(name)
+                    if function is None:
+                        raise ValueError(f"'{name}' is not a command for a {self.user.user_type}.")
+                    _scripted_input(request.get("input", []))
+                    try:
+                        function()
+                    finally:
+                        globals().pop("input", None)
+                    run += 1
+                except EOFError:
+                    failed += 1
+                    print(f"Line {line_number}: not enough input for '{name}'.")
+                except (ValueError, KeyError, TypeError) as e:
+                    failed += 1
+                    print(f"Line {line_number}: {e}")
+                except sqlite3.Error as e:
+                    failed += 1
+                    print(f"Line {line_number}: database error: {e}")
+        return run, failed
+
+
+def _scripted_input(answers):
+    """
+    Answer this module's input() prompts from a list, raising EOFError
+    once it runs out, like input() at the end of a file.
+    """
+    answers = iter(answers)
+
+    def scripted(prompt=""):
+        print(prompt, end="")
+        try:
+            answer = str(next(answers))
+        except StopIteration:
+            print()
+            raise EOFError
+        print(answer)
+        return answer
 
-    try:
-        choice = int(input("Enter your choice: "))
-    except ValueError:
-        print("Invalid input. Please enter a number between 0 and 10.")
-
-    if choice == 1:
-        view_all_birds_existing_in_db()
-    elif choice == 2:
-        view_bird_details_table()
-    elif choice == 3:
-        view_bird_by_name()
-    elif choice == 4:
-        view_avian_sightings_by_bird_name()
-    elif choice == 5:
-        view_sightings_for_all_birds()
-    elif choice == 6:
-        add_avian_sighting()
-    elif choice == 7:
-        update_bird_by_name()
-    elif choice == 8:
-        update_avian_sighting_by_bird_name()
-    elif choice == 9:
-        remove_bird_by_name()
-    elif choice == 10:
-        export_bird_data_to_csv()
-    elif choice == 0:
-        print("Exiting the menu.")
-        exit()
-    else:
-        print("Invalid choice. Please select a valid option.")
+    # Module globals shadow the builtin for every function defined here.
+    globals()["input"] = scripted
 
 
-def common_user_menu():
-    """
-    Menu for common users in the avian management system.
+def main():
     """
-    print("\n Please choose an option below:")
-    print("1. View all saved avian species")
-    print("2. View detailed information for all avians")
-    print("3. View details for a specific bird")
-    print("4. View sightings for a specific bird")
-    print("5. View sightings for all birds")
-    print("6. Export avian details to CSV")
-    print("0. Exit")
+    Main function to run the Avian Management System.
+
+        python bird_management.py
+        python bird_management.py --batch commands.jsonl --user alice --role researcher
+
+    In batch mode the password is read from BIRD_PASSWORD, or prompted for.
+    """
+    import argparse
+    import snapshot
+    import writebehind
+
+    parser = argparse.ArgumentParser(description="Avian Management System.")
+    parser.add_argument("--batch", metavar="FILE", help="run the JSON-lines commands in FILE, then exit")
+    parser.add_argument("--user", help="user name or email to log in as")
+    parser.add_argument("--role", choices=USER_TYPES, help="user type to log in as")
+    args = parser.parse_args()
+
+    configure_from_env()
+    setup_database()
+    reporting_snapshot = snapshot.from_env()
+    if reporting_snapshot is not None:
+        use_reporting_snapshot(reporting_snapshot)
+        atexit.register(reporting_snapshot.close)
+    writer = writebehind.from_env()
+    if writer is not None:
+        use_write_behind(writer)
+
+    if args.batch:
+        user = login_user(args.user, args.role, os.environ.get(PASSWORD_ENV))
+        if user:
+            Session(user).run_batch(args.batch)
+        return
+
+    print("\n-----WELCOME TO AVIAN MANAGEMENT SYSTEM------\n")
+
+    user_exist = input("Are you a registered user? (T/F): ").strip().lower()
+
+    if user_exist == 'f':
+        want_to_register = input("Do you want to register? (T/F): ").strip().lower()
+        if want_to_register != 't' or not register_user():
+            print("\n Thank you for visiting!")
+            return
+
+    user = login_user()
+    if user:
+        Session(user).run()
 
-    try:
-        choice = int(input("Enter your choice: "))
-    except ValueError:
-        print("Invalid input. Please enter a number between 0 and 7.")
-
-    if choice == 1:
-        view_all_birds_existing_in_db()
-    elif choice == 2:
-        view_bird_details_table()
-    elif choice == 3:
-        view_bird_by_name()
-    elif choice == 4:
-        view_avian_sightings_by_bird_name()
-    elif choice == 5:
-        view_sightings_for_all_birds()
-    elif choice == 6:
-        export_bird_data_to_csv()    
-    elif choice == 0:
-        print("Exiting the menu.")
-        exit()
-    else:
-        print("Invalid choice. Please select a valid option.")    
 
-  
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
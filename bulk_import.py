@@ -0,0 +1,184 @@
+import argparse
+import csv
+import json
+import time
+from dataclasses import dataclass, field
+
+from db import session
+from repository import INSERT_SIGHTING, check_coordinates, check_date
+
+BATCH_SIZE = 5000
+MAX_REJECT_DETAILS = 100
+
+
+@dataclass
+class ImportReport:
+    rows_read: int = 0
+    inserted: int = 0
+    rejected: int = 0
+    elapsed: float = 0.0
+    rejects: list = field(default_factory=list)
+
+    @property
+    def rows_per_sec(self):
+        return self.inserted / self.elapsed if self.elapsed else 0.0
+
+    def reject(self, line, reason):
+        self.rejected += 1
+        if len(self.rejects) < MAX_REJECT_DETAILS:
+            self.rejects.append((line, reason))
+
+
+def read_records(path, fmt=None):
+    """
+    Stream sighting records from a CSV file with a header row or from a
+    JSON-lines file, yielding (line number, dict) one at a time. The format
+    is taken from the file extension unless given.
+    """
+    if fmt is None:
+        fmt = "jsonl" if path.endswith((".jsonl", ".ndjson", ".json")) else "csv"
+
+    with open(path, newline='', encoding='utf-8') as file:
+        if fmt == "csv":
+            reader = csv.DictReader(file)
+            for record in reader:
+                yield reader.line_num, record
+        elif fmt == "jsonl":
+            for line_num, line in enumerate(file, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError as e:
+                    yield line_num, e
+                    continue
+                yield line_num, record
+        else:
+            raise ValueError(f"Unknown format '{fmt}', expected 'csv' or 'jsonl'.")
+
+
+def load_bird_ids(conn):
+    """
+    Build the lower-cased bird name -> bird_details.id map used to resolve
+    every row of an import without a per-row lookup.
+    """
+    return {name.lower(): bird_id for bird_id, name in conn.execute("SELECT id, name FROM bird_details")}
+
+
+def _text(record, *keys):
+    for key in keys:
+        value = record.get(key)
+        if value is not None and str(value).strip():
+            return str(value).strip()
+    return None
+
+
+def _to_row(record, bird_ids):
+    """
+    Validate one record and return the avian_sightings row to insert.
+    Raises ValueError with the rejection reason otherwise.
+    """
+    if not isinstance(record, dict):
+        raise ValueError(f"Unreadable record: {record}")
+
+    bird_name = _text(record, "bird_name", "bird")
+    date = _text(record, "date")
+    location = _text(record, "location")
+    if not bird_name:
+        raise ValueError("Missing bird_name.")
+    if not date:
+        raise ValueError("Missing date.")
+    if not location:
+        raise ValueError("Missing location.")
+    check_date(date)
+
+    bird_id = bird_ids.get(bird_name.lower())
+    if bird_id is None:
+        raise ValueError(f"Bird '{bird_name}' does not exist in the bird_details table.")
+
+    latitude = _text(record, "latitude", "lat")
+    longitude = _text(record, "longitude", "lon")
+    try:
+        latitude = float(latitude) if latitude is not None else None
+        longitude = float(longitude) if longitude is not None else None
+    except ValueError:
+        raise ValueError("Latitude and longitude must be numbers.")
+    check_coordinates(latitude, longitude)
+
+    return bird_id, date, location, _text(record, "observer"), _text(record, "notes"), latitude, longitude
+
+
+def _flush(conn, batch, report):
+    conn.execute("BEGIN")
+    try:
+        conn.executemany(INSERT_SIGHTING, batch)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    report.inserted += len(batch)
+    batch.clear()
+
+
+def import_sightings(path, batch_size=BATCH_SIZE, fmt=None):
+    """
+    Import sightings from a CSV or JSON-lines file.
+
+    Records need bird_name, date and location, and may have observer,
+    notes, latitude and longitude. Bird names are resolved through a map
+    built once at the start, and valid rows are inserted with
+    executemany, `batch_size` rows per transaction. Invalid rows are
+    counted and skipped.
+    """
+    if batch_size < 1:
+        raise ValueError("Batch size must be at least 1.")
+
+    report = ImportReport()
+    start = time.perf_counter()
+
+    with session() as conn:
+        if conn.in_transaction:
+            conn.commit()
+        bird_ids = load_bird_ids(conn)
+        batch = []
+
+        for line, record in read_records(path, fmt):
+            report.rows_read += 1
+            try:
+                batch.append(_to_row(record, bird_ids))
+            except ValueError as e:
+                report.reject(line, str(e))
+                continue
+            if len(batch) >= batch_size:
+                _flush(conn, batch, report)
+
+        if batch:
+            _flush(conn, batch, report)
+
+    report.elapsed = time.perf_counter() - start
+    return report
+
+
+def main():
+    """
+    Command line entry point: python bulk_import.py sightings.csv
+    """
+    parser = argparse.ArgumentParser(description="Bulk import avian sightings from CSV or JSON-lines files.")
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--format", choices=["csv", "jsonl"])
+    args = parser.parse_args()
+
+    for path in args.paths:
+        report = import_sightings(path, args.batch_size, args.format)
+        print(f"{path}: {report.inserted} inserted, {report.rejected} rejected "
+              f"of {report.rows_read} rows in {report.elapsed:.2f}s ({report.rows_per_sec:.0f} rows/sec)")
+        for line, reason in report.rejects:
+            print(f"  line {line}: {reason}")
+        if report.rejected > len(report.rejects):
+            print(f"  ... and {report.rejected - len(report.rejects)} more")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+import argparse
+import csv
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+from bulk_import import ImportReport
+from db import session
+from repository import CONSERVATION_STATUSES, bird_cache, bird_names
+
+BATCH_SIZE = 10000
+CHUNK_SIZE = 10000
+WORKERS = os.cpu_count() or 1
+
+BIRD_FIELDS = ('name', 'bio_name', 'origin', 'habitat', 'diet', 'conservation_status', 'description')
+
+UPSERT_BIRD = '''
+    INSERT INTO bird_details (name, bio_name, origin, habitat, diet, conservation_status, description)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(name) DO UPDATE SET
+        bio_name = excluded.bio_name,
+        origin = excluded.origin,
+        habitat = excluded.habitat,
+        diet = excluded.diet,
+        conservation_status = excluded.conservation_status,
+        description = excluded.description
+'''
+
+
+@dataclass
+class CatalogReport(ImportReport):
+    updated: int = 0
+
+
+def read_chunks(path, fmt=None, chunk_size=CHUNK_SIZE):
+    """
+    Split a catalog file into chunks of (line number, raw record) for the
+    worker processes: lists of CSV fields paired with the header, or
+    unparsed JSON lines. Yields (header, chunk).
+    """
+    if fmt is None:
+        fmt = "jsonl" if path.endswith((".jsonl", ".ndjson", ".json")) else "csv"
+    if fmt not in ("csv", "jsonl"):
+        raise ValueError(f"Unknown format '{fmt}', expected 'csv' or 'jsonl'.")
+
+    with open(path, newline='', encoding='utf-8') as file:
+        if fmt == "csv":
+            reader = csv.reader(file)
+            header = [column.strip().lower() for column in next(reader, [])]
+            records = ((reader.line_num, fields) for fields in reader)
+        else:
+            header = None
+            records = ((line_num, line) for line_num, line in enumerate(file, start=1) if line.strip())
+
+        chunk = []
+        for record in records:
+            chunk.append(record)
+            if len(chunk) >= chunk_size:
+                yield header, chunk
+                chunk = []
+        if chunk:
+            yield header, chunk
+
+
+def _to_row(header, raw):
+    """
+    Parse and validate one catalog record and return the bird_details row.
+    Raises ValueError with the rejection reason otherwise.
+    """
+    if header is None:
+        record = json.loads(raw)
+        if not isinstance(record, dict):
+            raise ValueError(f"Unreadable record: {raw.strip()}")
+    else:
+        if len(raw) != len(header):
+            raise ValueError(f"Expected {len(header)} fields, found {len(raw)}.")
+        record = dict(zip(header, raw))
+
+    row = []
+    for name in BIRD_FIELDS:
+        value = record.get(name)
+        value = str(value).strip() if value is not None else ""
+        if not value:
+            raise ValueError(f"Missing {name}.")
+        row.append(value)
+
+    row[5] = row[5].lower()
+    if row[5] not in CONSERVATION_STATUSES:
+        raise ValueError("conservation_status must be 'extinct' or 'not extinct'.")
+    return tuple(row)
+
+
+def validate_chunk(header, chunk):
+    """
+    Worker process entry point: validate a chunk and return
+    ([(line, row), ...], [(line, reason), ...]).
+    """
+    rows = []
+    rejects = []
+    for line, raw in chunk:
+        try:
+            rows.append((line, _to_row(header, raw)))
+        except ValueError as e:
+            rejects.append((line, str(e)))
+    return rows, rejects
+
+
+class _Uniqueness:
+    """
+    In-memory check of name and bio_name uniqueness, seeded from the birds
+    already in the database. Names match case-insensitively and a row for
+    an existing bird keeps the stored spelling, so that the upsert updates
+    it rather than adding a near-duplicate.
+    """
+
+    def __init__(self, conn):
+        self.names = {}
+        self.bio_names = {}
+        for name, bio_name in conn.execute("SELECT name, bio_name FROM bird_details"):
+            self.names[name.lower()] = name
+            self.bio_names[bio_name.lower()] = name.lower()
+        self.existing = set(self.names)
+        self.seen = set()
+
+    def check(self, row):
+        """
+        Return the row to write, with the stored name of an existing bird,
+        or raise ValueError if the name or bio_name is already taken.
+        """
+        key = row[0].lower()
+        if key in self.seen:
+            raise ValueError(f"Duplicate name '{row[0]}' in the catalog.")
+        owner = self.bio_names.get(row[1].lower())
+        if owner is not None and owner != key:
+            raise ValueError(f"bio_name '{row[1]}' already belongs to '{self.names[owner]}'.")
+
+        self.seen.add(key)
+        self.names.setdefault(key, row[0])
+        self.bio_names[row[1].lower()] = key
+        return (self.names[key],) + row[1:]
+
+
+def _flush(conn, batch, report):
+    conn.execute("BEGIN")
+    try:
+        conn.executemany(UPSERT_BIRD, batch)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    report.inserted += len(batch)
+    batch.clear()
+
+
+def import_catalog(path, workers=WORKERS, batch_size=BATCH_SIZE, fmt=None, chunk_size=CHUNK_SIZE):
+    """
+    Import a bird catalog from a CSV or JSON-lines file into bird_details.
+
+    Records need name, bio_name, origin, habitat, diet, conservation_status
+    and description. Chunks of the file are parsed and validated in a pool
+    of `workers` processes; this process checks name and bio_name
+    uniqueness in file order and writes the clean rows, `batch_size` per
+    transaction, with an upsert on name. Existing birds are updated in
+    place. `report.inserted` counts every row written and
+    `report.updated` those that were already in the table.
+    """
+    if batch_size < 1:
+        raise ValueError("Batch size must be at least 1.")
+
+    report = CatalogReport()
+    start = time.perf_counter()
+
+    with session() as conn, ProcessPoolExecutor(max_workers=workers) as executor:
+        if conn.in_transaction:
+            conn.commit()
+        unique = _Uniqueness(conn)
+        batch = []
+        pending = deque()
+
+        def collect(future):
+            rows, rejects = future.result()
+            report.rows_read += len(rows) + len(rejects)
+            for line, reason in rejects:
+                report.reject(line, reason)
+            for line, row in rows:
+                try:
+                    row = unique.check(row)
+                except ValueError as e:
+                    report.reject(line, str(e))
+                    continue
+                if row[0].lower() in unique.existing:
+                    report.updated += 1
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    _flush(conn, batch, report)
+
+        # Keep a couple of chunks per worker in flight and collect them in
+        # submission order, so that the first occurrence of a name wins.
+        for header, chunk in read_chunks(path, fmt, chunk_size):
+            pending.append(executor.submit(validate_chunk, header, chunk))
+            if len(pending) >= workers * 2:
+                collect(pending.popleft())
+        while pending:
+            collect(pending.popleft())
+        if batch:
+            _flush(conn, batch, report)
+
+    bird_cache.clear()
+    bird_names.clear()
+    report.elapsed = time.perf_counter() - start
+    return report
+
+
+def main():
+    """
+    Command line entry point: python catalog_import.py taxonomy.csv --workers 8
+    """
+    parser = argparse.ArgumentParser(description="Import bird catalogs into bird_details.")
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--format", choices=["csv", "jsonl"])
+    args = parser.parse_args()
+
+    for path in args.paths:
+        report = import_catalog(path, args.workers, args.batch_size, args.format)
+        print(f"{path}: {report.inserted - report.updated} inserted, {report.updated} updated, "
+              f"{report.rejected} rejected of {report.rows_read} rows in {report.elapsed:.2f}s "
+              f"({report.rows_per_sec:.0f} rows/sec)")
+        for line, reason in report.rejects:
+            print(f"  line {line}: {reason}")
+        if report.rejected > len(report.rejects):
+            print(f"  ... and {report.rejected - len(report.rejects)} more")
+
+
+if __name__ == "__main__":
+    main()
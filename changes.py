@@ -0,0 +1,115 @@
+import os
+
+from db import session
+from export import export_query
+from schema import CHANGE_LOG_COLUMNS
+
+CHANGE_COLUMNS = ['seq', 'table_name', 'row_id', 'operation', 'data', 'changed_at']
+
+
+def latest_seq(conn=None):
+    """
+    Return the sequence number of the newest change, or 0 if there is none.
+    """
+    if conn is None:
+        with session() as conn:
+            return latest_seq(conn)
+    return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM change_log").fetchone()[0]
+
+
+def export_changes(path, since=0, tables=None, compress=None, pool=None):
+    """
+    Stream the changes after sequence number `since` to a CSV file, oldest
+    first, and return (rows written, the sequence number to pass as
+    `since` next time). `data` holds the row's new values as JSON, empty
+    for a delete. Changes committed while the export runs are left for
+    the next one.
+    """
+    with (pool.connection() if pool is not None else session()) as conn:
+        until = latest_seq(conn)
+    conditions = ["seq > ?", "seq <= ?"]
+    params = [since, until]
+    if tables:
+        unknown = set(tables) - set(CHANGE_LOG_COLUMNS)
+        if unknown:
+            raise ValueError(f"No change log for table(s): {', '.join(sorted(unknown))}.")
+        conditions.append(f"table_name IN ({', '.join('?' * len(tables))})")
+        params.extend(tables)
+
+    sql = f"SELECT {', '.join(CHANGE_COLUMNS)} FROM change_log WHERE {' AND '.join(conditions)} ORDER BY seq"
+    return export_query(path, sql, params, compress, pool=pool), max(since, until)
+
+
+def prune(through_seq):
+    """
+    Delete the changes up to and including `through_seq`, once every
+    downstream copy has applied them. Returns the number deleted.
+    """
+    with session() as conn:
+        return conn.execute("DELETE FROM change_log WHERE seq <= ?", (through_seq,)).rowcount
+
+
+def read_state(path):
+    """
+    Return the sequence number saved in a state file, or 0 if there is none.
+    """
+    if not os.path.exists(path):
+        return 0
+    with open(path, encoding='utf-8') as file:
+        return int(file.read().strip() or 0)
+
+
+def write_state(path, seq):
+    """
+    Save a sequence number to a state file, replacing it atomically.
+    """
+    temp = f"{path}.tmp"
+    with open(temp, mode='w', encoding='utf-8') as file:
+        file.write(f"{seq}\n")
+    os.replace(temp, path)
+
+
+def main():
+    """
+    Command line entry point, e.g. for nightly incremental exports:
+
+        python changes.py --out changes.csv.gz --state warehouse.seq
+
+    reads the sequence number to start after from warehouse.seq and saves
+    the new one there once the export is written.
+
+    Rows that existed before the change log was added have no changes, so
+    a new downstream copy starts from a baseline: note the number printed
+    by --latest, take one full export (export.py), then export the
+    changes after the noted number, e.g. with --since. Changes made while
+    the full export runs are exported again; applying one twice is
+    harmless.
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export the changes to birds, sightings and users since a "
+                                                 "sequence number.")
+    parser.add_argument("--out", help="write the changes to this CSV file")
+    parser.add_argument("--since", type=int, help="export the changes after this sequence number")
+    parser.add_argument("--state", help="file holding the sequence number to start after, updated after export")
+    parser.add_argument("--table", action="append", choices=list(CHANGE_LOG_COLUMNS), dest="tables",
+                        help="only this table (may be repeated)")
+    parser.add_argument("--gzip", action="store_true", default=None)
+    parser.add_argument("--latest", action="store_true", help="print the newest sequence number")
+    parser.add_argument("--prune-through", type=int, metavar="SEQ", help="delete changes up to this sequence number")
+    args = parser.parse_args()
+
+    if args.latest:
+        print(latest_seq())
+    if args.out:
+        since = args.since if args.since is not None else read_state(args.state) if args.state else 0
+        count, until = export_changes(args.out, since, args.tables, args.gzip)
+        if args.state:
+            write_state(args.state, until)
+        print(f"Exported {count} changes after sequence {since} to '{args.out}'; next run starts after {until}.")
+    if args.prune_through is not None:
+        print(f"Pruned {prune(args.prune_through)} changes.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+import argparse
+import datetime
+import os
+import random
+import sqlite3
+import time
+
+import db
+from auth import hash_password
+from repository import USER_TYPES
+from schema import bootstrap
+
+BATCH_SIZE = 50000
+PASSWORD = "birdwatcher"
+START_DATE = datetime.date(2015, 1, 1)
+DAYS = 3650
+LOCATIONS = 500
+
+ORIGINS = ("Africa", "Asia", "Australia", "Europe", "North America", "South America", "Antarctica")
+HABITATS = ("Forest", "Wetland", "Grassland", "Desert", "Coast", "Mountain", "Urban")
+DIETS = ("Seeds", "Insects", "Fish", "Fruit", "Nectar", "Small mammals", "Omnivore")
+WORDS = ("small", "large", "bright", "dark", "crested", "spotted", "striped", "long-tailed",
+         "short-billed", "migratory", "shy", "noisy", "ground-nesting", "colonial", "solitary")
+
+
+def default_scale(sightings):
+    """
+    Return (birds, users) in proportion to the number of sightings.
+    """
+    return max(100, sightings // 100), max(10, sightings // 1000)
+
+
+def user_rows(count, rng, password_hash):
+    for i in range(count):
+        yield (f"user{i}", f"user{i}@example.org", password_hash, USER_TYPES[i % len(USER_TYPES)])
+
+
+def bird_rows(count, rng):
+    for i in range(count):
+        description = " ".join(rng.choice(WORDS) for _ in range(8))
+        yield (f"Bird {i}", f"Avis synthetica {i}", rng.choice(ORIGINS), rng.choice(HABITATS),
+               rng.choice(DIETS), "extinct" if rng.random() < 0.02 else "not extinct",
+               f"A {description} bird.")
+
+
+def sighting_rows(count, birds, users, rng):
+    """
+    Sightings spread over ten years and LOCATIONS places, each place with
+    a fixed position so that nearby-sighting queries find clusters.
+    """
+    places = [(f"Site {i}", rng.uniform(-60.0, 70.0), rng.uniform(-180.0, 180.0)) for i in range(LOCATIONS)]
+    for _ in range(count):
+        location, latitude, longitude = rng.choice(places)
+        date = START_DATE + datetime.timedelta(days=rng.randrange(DAYS))
+        notes = " ".join(rng.choice(WORDS) for _ in range(4)) if rng.random() < 0.3 else None
+        yield (rng.randrange(1, birds + 1), date.isoformat(), location, f"user{rng.randrange(users)}", notes,
+               round(latitude + rng.uniform(-0.05, 0.05), 5), round(longitude + rng.uniform(-0.05, 0.05), 5))
+
+
+def _insert(conn, sql, rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            conn.executemany(sql, batch)
+            conn.commit()
+            batch.clear()
+    if batch:
+        conn.executemany(sql, batch)
+        conn.commit()
+
+
+def generate(path, sightings=10000, birds=None, users=None, seed=0, batch_size=BATCH_SIZE):
+    """
+    Create a database at `path` with the full schema and synthetic users,
+    birds and sightings. The same arguments always produce the same data.
+    Every user's password is PASSWORD. Returns the scale used as a dict.
+    """
+    default_birds, default_users = default_scale(sightings)
+    birds = birds or default_birds
+    users = users or default_users
+    rng = random.Random(seed)
+
+    pool = db.ConnectionPool(path, size=1)
+    try:
+        with pool.connection() as conn:
+            bootstrap(conn)
+            if conn.execute("SELECT 1 FROM bird_details LIMIT 1").fetchone():
+                raise ValueError(f"'{path}' already has data.")
+
+            # A single hash for every user keeps generation fast; logins
+            # still pay the full scrypt cost.
+            _insert(conn, "INSERT INTO users (username, email, password, user_type) VALUES (?, ?, ?, ?)",
+                    user_rows(users, rng, hash_password(PASSWORD)), batch_size)
+            _insert(conn, '''
+                INSERT INTO bird_details (name, bio_name, origin, habitat, diet, conservation_status, description)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', bird_rows(birds, rng), batch_size)
+            _insert(conn, '''
+                INSERT INTO avian_sightings (bird_id, date, location, observer, notes, latitude, longitude)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', sighting_rows(sightings, birds, users, rng), batch_size)
+            conn.execute("ANALYZE")
+    finally:
+        pool.close()
+    return {"users": users, "birds": birds, "sightings": sightings, "seed": seed}
+
+
+def read_scale(path):
+    """
+    Return the row counts of an existing database as a scale dict.
+    """
+    conn = sqlite3.connect(path)
+    try:
+        return {key: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for key, table in (("users", "users"), ("birds", "bird_details"), ("sightings", "avian_sightings"))}
+    finally:
+        conn.close()
+
+
+def main():
+    """
+    Command line entry point: python datagen.py synthetic.db --sightings 1000000
+    """
+    parser = argparse.ArgumentParser(description="Generate a synthetic Avian Management System database.")
+    parser.add_argument("path")
+    parser.add_argument("--sightings", type=int, default=10000)
+    parser.add_argument("--birds", type=int)
+    parser.add_argument("--users", type=int)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if os.path.exists(args.path):
+        parser.error(f"'{args.path}' already exists.")
+    start = time.perf_counter()
+    scale = generate(args.path, args.sightings, args.birds, args.users, args.seed)
+    print(f"Generated {scale['users']} users, {scale['birds']} birds and {scale['sightings']} sightings "
+          f"in {time.perf_counter() - start:.1f}s.")
+
+
+if __name__ == "__main__":
+    main()
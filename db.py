@@ -0,0 +1,159 @@
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+DB_PATH = "bird.db"
+POOL_SIZE = 4
+POOL_TIMEOUT = 30.0
+
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "foreign_keys": "ON",
+    "cache_size": -16000,
+    "mmap_size": 268435456,
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,
+}
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of SQLite connections to a single database file.
+
+    Connections are opened lazily up to `size`, configured once with the
+    PRAGMAs given, and handed back to the pool after each session so that
+    the page cache and prepared statements survive between calls. Callables
+    in `connect_hooks` are run on every new connection.
+    """
+
+    def __init__(self, path=DB_PATH, size=POOL_SIZE, pragmas=None, timeout=POOL_TIMEOUT):
+        if size < 1:
+            raise ValueError("Pool size must be at least 1.")
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.pragmas = dict(PRAGMAS if pragmas is None else pragmas)
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._closed = False
+        self.connect_hooks = []
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        for hook in self.connect_hooks:
+            hook(conn)
+        return conn
+
+    def acquire(self):
+        """
+        Take a connection from the pool, opening a new one if the pool has
+        not reached its size yet, otherwise waiting for one to be released.
+        """
+        if self._closed:
+            raise RuntimeError("Connection pool is closed.")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._opened < self.size:
+                self._opened += 1
+                try:
+                    return self._connect()
+                except Exception:
+                    self._opened -= 1
+                    raise
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No database connection available after {self.timeout} seconds.")
+
+    def release(self, conn):
+        """
+        Return a connection to the pool. Any open transaction is rolled back.
+        """
+        if conn.in_transaction:
+            conn.rollback()
+        if self._closed:
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+            return
+        self._idle.put_nowait(conn)
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a connection for the duration of a `with` block, committing
+        on success and rolling back if the block raises.
+        """
+        conn = self.acquire()
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self.release(conn)
+
+    def close(self):
+        """
+        Close every idle connection. Connections still checked out are
+        closed as they are released.
+        """
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def configure(path=DB_PATH, size=POOL_SIZE, pragmas=None, timeout=POOL_TIMEOUT):
+    """
+    Replace the shared pool, e.g. to point the application at another
+    database file or to change the pool size and PRAGMA setup.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        _pool = ConnectionPool(path, size, pragmas, timeout)
+    return _pool
+
+
+def get_pool():
+    """
+    Return the shared pool, creating it with the defaults on first use.
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+
+def session():
+    """
+    Borrow a connection from the shared pool:
+
+        with session() as conn:
+            conn.execute(...)
+    """
+    return get_pool().connection()
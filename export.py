@@ -0,0 +1,179 @@
+import csv
+import gzip
+import os
+
+from db import session
+
+FETCH_SIZE = 1000
+
+BIRD_COLUMNS = ['id', 'name', 'bio_name', 'origin', 'habitat', 'diet', 'conservation_status', 'description']
+SIGHTING_COLUMNS = ['id', 'bird_id', 'bird_name', 'date', 'location', 'observer', 'notes', 'latitude', 'longitude']
+
+
+def _open(path, compress=None):
+    """
+    Open an export file for writing text, gzip-compressed if asked to or if
+    the file name ends in .gz.
+    """
+    if compress is None:
+        compress = path.endswith('.gz')
+    if compress:
+        return gzip.open(path, mode='wt', newline='', encoding='utf-8')
+    return open(path, mode='w', newline='', encoding='utf-8')
+
+
+def export_query(path, sql, params=(), compress=None, fetch_size=FETCH_SIZE, pool=None, leading_rows=None):
+    """
+    Stream the result of a query into a CSV file with a header row,
+    `fetch_size` rows at a time, and return the number of rows written.
+    Memory use does not grow with the size of the result. The query runs
+    on `pool` (e.g. a reporting snapshot) when given, else the shared pool.
+    `leading_rows(conn)` may yield rows to write before the query's own.
+    """
+    rows_written = 0
+    with (pool.connection() if pool is not None else session()) as conn, _open(path, compress) as file:
+        cursor = conn.execute(sql, params)
+        writer = csv.writer(file)
+        writer.writerow([desc[0] for desc in cursor.description])
+        if leading_rows is not None:
+            for row in leading_rows(conn):
+                writer.writerow(row)
+                rows_written += 1
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            writer.writerows(rows)
+            rows_written += len(rows)
+    return rows_written
+
+
+def _where(conditions):
+    return f" WHERE {' AND '.join(conditions)}" if conditions else ""
+
+
+def export_birds(path, name=None, conservation_status=None, compress=None, pool=None):
+    """
+    Export bird_details to CSV, optionally only the bird with this name or
+    the birds with this conservation status.
+    """
+    conditions = []
+    params = []
+    if name:
+        conditions.append("LOWER(name) = LOWER(?)")
+        params.append(name)
+    if conservation_status:
+        conditions.append("conservation_status = ?")
+        params.append(conservation_status)
+
+    sql = f"SELECT {', '.join(BIRD_COLUMNS)} FROM bird_details{_where(conditions)} ORDER BY id"
+    return export_query(path, sql, params, compress, pool=pool)
+
+
+def _archived_sightings(conn, archive, bird_name, start_date, end_date, location, conservation_status):
+    """
+    Yield archived sightings matching the export filters, as export rows.
+    """
+    bird_id = None
+    if bird_name:
+        row = conn.execute("SELECT id FROM bird_details WHERE LOWER(name) = LOWER(?)", (bird_name,)).fetchone()
+        if row is None:
+            return
+        bird_id = row[0]
+    birds = {row[0]: row[1:] for row in conn.execute("SELECT id, name, conservation_status FROM bird_details")}
+    location = location.lower() if location else None
+
+    for row in archive.iter_rows(conn, bird_id, start_date, end_date):
+        bird = birds.get(row[1])
+        if bird is None:
+            continue
+        if location and location not in row[3].lower():
+            continue
+        if conservation_status and bird[1] != conservation_status:
+            continue
+        yield (row[0], row[1], bird[0]) + row[2:]
+
+
+def export_sightings(path, bird_name=None, start_date=None, end_date=None, location=None,
+                     conservation_status=None, compress=None, pool=None, archive=None):
+    """
+    Export avian_sightings joined with the bird name to CSV. Dates filter as
+    an inclusive range, location as a substring, and conservation status on
+    the sighted bird. Sightings in `archive` that match come first.
+    """
+    conditions = []
+    params = []
+    if bird_name:
+        conditions.append("a.bird_id = (SELECT id FROM bird_details WHERE LOWER(name) = LOWER(?))")
+        params.append(bird_name)
+    if start_date:
+        conditions.append("a.date >= ?")
+        params.append(start_date)
+    if end_date:
+        conditions.append("a.date <= ?")
+        params.append(end_date)
+    if location:
+        conditions.append("a.location LIKE ?")
+        params.append(f"%{location}%")
+    if conservation_status:
+        conditions.append("b.conservation_status = ?")
+        params.append(conservation_status)
+
+    sql = f'''
+        SELECT a.id, a.bird_id, b.name AS bird_name, a.date, a.location, a.observer, a.notes,
+               a.latitude, a.longitude
+        FROM avian_sightings a
+        JOIN bird_details b ON a.bird_id = b.id
+        {_where(conditions)}
+        ORDER BY a.id
+    '''
+    leading_rows = None
+    if archive is not None:
+        def leading_rows(conn):
+            return _archived_sightings(conn, archive, bird_name, start_date, end_date, location,
+                                       conservation_status)
+    return export_query(path, sql, params, compress, pool=pool, leading_rows=leading_rows)
+
+
+def remove_if_empty(path, rows_written):
+    """
+    Delete an export file that received no rows, so that an empty export
+    does not leave a header-only file behind.
+    """
+    if rows_written == 0 and os.path.exists(path):
+        os.remove(path)
+
+
+def main():
+    """
+    Command line entry point, e.g. for nightly exports:
+
+        python export.py sightings --out sightings.csv.gz --from 2024-01-01
+    """
+    import argparse
+    from archive import ARCHIVE_DIR, Archive
+
+    parser = argparse.ArgumentParser(description="Export birds or sightings to CSV.")
+    parser.add_argument("table", choices=["birds", "sightings"])
+    parser.add_argument("--out", required=True)
+    parser.add_argument("--name", help="bird name")
+    parser.add_argument("--status", choices=["extinct", "not extinct"], help="conservation status")
+    parser.add_argument("--from", dest="start_date", help="first sighting date (inclusive)")
+    parser.add_argument("--to", dest="end_date", help="last sighting date (inclusive)")
+    parser.add_argument("--location")
+    parser.add_argument("--gzip", action="store_true", default=None)
+    parser.add_argument("--archive-dir", default=ARCHIVE_DIR, help="include sightings archived here")
+    parser.add_argument("--live-only", action="store_true", help="leave archived sightings out")
+    args = parser.parse_args()
+
+    if args.table == "birds":
+        count = export_birds(args.out, args.name, args.status, args.gzip)
+    else:
+        count = export_sightings(args.out, args.name, args.start_date, args.end_date,
+                                 args.location, args.status, args.gzip,
+                                 archive=None if args.live_only else Archive(args.archive_dir))
+    print(f"Exported {count} rows to '{args.out}'.")
+
+
+if __name__ == "__main__":
+    main()
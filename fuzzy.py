@@ -0,0 +1,191 @@
+import heapq
+import re
+import sys
+import threading
+from array import array
+from dataclasses import dataclass
+
+SUGGESTIONS = 5
+# Most names scored for one query, so that a name made of common trigrams
+# cannot make a lookup scan most of the index.
+MAX_CANDIDATES = 1000
+# Least trigram similarity for a suggestion, as in PostgreSQL's pg_trgm.
+SIMILARITY_THRESHOLD = 0.3
+
+WORD = re.compile(r"[^\W_]+")
+
+NAME = 0
+BIO_NAME = 1
+
+
+@dataclass
+class Suggestion:
+    bird_id: int
+    name: str
+    bio_name: str
+    score: float
+
+
+def trigrams(text):
+    """
+    Return the set of trigrams of a name: each word lower-cased and padded
+    with two spaces in front and one behind, so 'Robin' gives '  r', ' ro',
+    'rob', 'obi', 'bin' and 'in '.
+    """
+    grams = set()
+    for word in WORD.findall(text.lower()):
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class NameIndex:
+    """
+    In-memory trigram index over bird names and biological names, for
+    "did you mean" suggestions when a name is not found.
+
+    Each trigram maps to an array of keys (bird id and which name), and
+    each key keeps its own trigrams for scoring. A query reads its
+    trigrams' lists rarest first and scores new keys by the Jaccard
+    similarity of their trigrams with the query's. After n lists, a key
+    not seen yet shares at most len(query) - n trigrams with it, which
+    bounds its score; the scan stops once that bound falls below the
+    threshold or below the scores already found, so a selective query
+    only reads a few short lists. It also stops before a list would take
+    it past max_candidates keys: the rarest lists hold the names that
+    share the most unusual parts of the query, and a typo rarely leaves
+    the intended name out of all of them.
+
+    Removing a bird or changing its biological name leaves its old keys
+    in the lists; they are skipped or rescored against the current
+    trigrams, and the lists are rebuilt once they hold more stale keys
+    than live ones.
+    """
+
+    def __init__(self, threshold=SIMILARITY_THRESHOLD, max_candidates=MAX_CANDIDATES):
+        self.threshold = threshold
+        self.max_candidates = max_candidates
+        self.loaded = False
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._names = {}
+        self._grams = {}
+        self._postings = {}
+        self._live = 0
+        self._stale = 0
+
+    def _index(self, key, text):
+        grams = []
+        for gram in trigrams(text):
+            # Interned, so every key holding a trigram shares one string.
+            gram = sys.intern(gram)
+            keys = self._postings.get(gram)
+            if keys is None:
+                keys = self._postings[gram] = array('I')
+            keys.append(key)
+            grams.append(gram)
+        self._grams[key] = tuple(grams)
+        self._live += len(grams)
+
+    def _unindex(self, bird_id):
+        if self._names.pop(bird_id, None) is None:
+            return
+        for key in (bird_id * 2 + NAME, bird_id * 2 + BIO_NAME):
+            grams = self._grams.pop(key, ())
+            self._live -= len(grams)
+            self._stale += len(grams)
+
+    def _add(self, bird_id, name, bio_name):
+        self._unindex(bird_id)
+        self._names[bird_id] = (name, bio_name)
+        self._index(bird_id * 2 + NAME, name)
+        if bio_name:
+            self._index(bird_id * 2 + BIO_NAME, bio_name)
+        if self._stale > max(self._live, 1024):
+            names = self._names
+            self._reset()
+            for bird_id, (name, bio_name) in names.items():
+                self._add(bird_id, name, bio_name)
+
+    def ensure_loaded(self, fetch):
+        """
+        Build the index from fetch(), an iterable of (id, name, bio_name)
+        rows, unless it is already built. fetch is called under the index
+        lock, so a write that misses an unbuilt index is always seen by
+        the build that follows it.
+        """
+        with self._lock:
+            if self.loaded:
+                return
+            self._reset()
+            for bird_id, name, bio_name in fetch():
+                self._add(bird_id, name, bio_name)
+            self.loaded = True
+
+    def add(self, bird_id, name, bio_name):
+        """
+        Index a new bird, or re-index one whose names changed.
+        """
+        with self._lock:
+            if self.loaded:
+                self._add(bird_id, name, bio_name)
+
+    def remove(self, bird_id):
+        with self._lock:
+            if self.loaded:
+                self._unindex(bird_id)
+
+    def clear(self):
+        """
+        Drop the index; it is rebuilt from the database on the next query.
+        """
+        with self._lock:
+            self.loaded = False
+            self._reset()
+
+    def __len__(self):
+        return len(self._names)
+
+    def suggest(self, text, limit=SUGGESTIONS):
+        """
+        Return up to `limit` birds whose name or biological name is most
+        similar to `text`, best first.
+        """
+        query = trigrams(text)
+        size = len(query)
+        if not size or limit < 1:
+            return []
+        with self._lock:
+            lists = sorted((self._postings.get(gram, ()) for gram in query), key=len)
+            grams_of = self._grams.get
+            shared_with = query.intersection
+            seen = set()
+            best = {}
+            floor = self.threshold
+            for read, keys in enumerate(lists, 1):
+                keys = set(keys) - seen
+                if seen and len(seen) + len(keys) > self.max_candidates:
+                    break
+                seen |= keys
+                for key in keys:
+                    grams = grams_of(key)
+                    if grams is None:
+                        continue
+                    shared = len(shared_with(grams))
+                    score = shared / (size + len(grams) - shared)
+                    if score >= floor and score > best.get(key >> 1, 0.0):
+                        best[key >> 1] = score
+                if len(best) >= limit:
+                    floor = max(floor, heapq.nlargest(limit, best.values())[-1])
+                # Keys not seen yet share at most size - read trigrams.
+                if (size - read) / size < floor:
+                    break
+            ranked = sorted(best.items(), key=lambda item: (-item[1], self._names[item[0]][NAME]))[:limit]
+            return [Suggestion(bird_id, *self._names[bird_id], score) for bird_id, score in ranked]
+
+    def stats(self):
+        with self._lock:
+            return {"birds": len(self._names), "trigrams": len(self._postings),
+                    "postings": self._live, "stale_postings": self._stale}
@@ -0,0 +1,75 @@
+import math
+
+from repository import SightingRepository
+
+EARTH_RADIUS_KM = 6371.0088
+# Kilometres per degree of latitude on the sphere haversine_km() measures
+# on, so the bounding box never cuts into the circle it is refined to.
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+sightings = SightingRepository()
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """
+    Great-circle distance in kilometres between two points given in degrees.
+    """
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _boxes(min_lat, min_lon, max_lat, max_lon):
+    """
+    Split a box crossing the antimeridian (min_lon > max_lon) in two.
+    """
+    if min_lon <= max_lon:
+        return [(min_lat, min_lon, max_lat, max_lon)]
+    return [(min_lat, min_lon, max_lat, 180.0), (min_lat, -180.0, max_lat, max_lon)]
+
+
+def within_box(min_lat, min_lon, max_lat, max_lon, limit=None):
+    """
+    Return the sightings inside a latitude/longitude bounding box, found
+    through the R*Tree index. A box with min_lon > max_lon wraps across
+    the antimeridian.
+    """
+    results = []
+    for box in _boxes(min_lat, min_lon, max_lat, max_lon):
+        results.extend(sightings.in_box(*box, limit=limit - len(results) if limit else None))
+        if limit and len(results) >= limit:
+            break
+    return results
+
+
+def within_radius(latitude, longitude, radius_km, limit=None):
+    """
+    Return [(sighting, distance in km), ...] for the sightings within
+    `radius_km` of a point, nearest first. Candidates come from the
+    bounding box of the circle and are refined with the haversine distance.
+    """
+    lat_delta = radius_km / KM_PER_DEGREE
+    min_lat = max(-90.0, latitude - lat_delta)
+    max_lat = min(90.0, latitude + lat_delta)
+
+    widest = max(abs(min_lat), abs(max_lat))
+    if widest >= 90.0 or radius_km / (KM_PER_DEGREE * math.cos(math.radians(widest))) >= 180.0:
+        min_lon, max_lon = -180.0, 180.0
+    else:
+        lon_delta = radius_km / (KM_PER_DEGREE * math.cos(math.radians(widest)))
+        min_lon = longitude - lon_delta
+        max_lon = longitude + lon_delta
+        if min_lon < -180.0:
+            min_lon += 360.0
+        if max_lon > 180.0:
+            max_lon -= 360.0
+
+    matches = []
+    for sighting in within_box(min_lat, min_lon, max_lat, max_lon):
+        distance = haversine_km(latitude, longitude, sighting.latitude, sighting.longitude)
+        if distance <= radius_km:
+            matches.append((sighting, distance))
+    matches.sort(key=lambda match: match[1])
+    return matches[:limit] if limit else matches
@@ -0,0 +1,350 @@
+import atexit
+import functools
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+
+import db
+
+# Upper bounds of the latency histogram buckets, in seconds.
+BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+SLOW_LOG_SIZE = 100
+EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+
+METRICS_ENV = "BIRD_METRICS"
+SLOW_MS_ENV = "BIRD_SLOW_MS"
+TRACE_ENV = "BIRD_TRACE"
+
+
+class OperationStats:
+    """
+    Counters of one instrumented operation.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.rows = 0
+        self.statements = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def add(self, seconds, rows, statements, error):
+        self.count += 1
+        self.errors += error
+        self.rows += rows
+        self.statements += statements
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    def quantile(self, fraction):
+        """
+        Estimate a latency quantile as the upper bound of the bucket it
+        falls in (the maximum for the overflow bucket).
+        """
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for i, bound in enumerate(BUCKETS):
+            seen += self.buckets[i]
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def as_dict(self):
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(BUCKETS + ("+Inf",), self.buckets):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "rows": self.rows,
+            "statements": self.statements,
+            "total_ms": self.total * 1000,
+            "mean_ms": self.total * 1000 / self.count if self.count else 0.0,
+            "p50_ms": self.quantile(0.50) * 1000,
+            "p99_ms": self.quantile(0.99) * 1000,
+            "max_ms": self.max * 1000,
+            "buckets": buckets,
+        }
+
+
+def _rows(result):
+    """
+    Number of rows an operation returned: the length of a list, the value
+    of a row count or True/False, one for a single record, none for None
+    or an unconsumed iterator.
+    """
+    if result is None or hasattr(result, '__next__'):
+        return 0
+    if isinstance(result, (bool, int)):
+        return int(result)
+    if hasattr(result, '__len__') and not isinstance(result, str):
+        return len(result)
+    return 1
+
+
+class Metrics:
+    """
+    Per-operation counts, latency histograms and rows returned, gauges
+    read when a snapshot is taken, and an optional slow-query log. With
+    tracing on, every SQL statement run by a pooled connection is
+    attributed to the operation running it, and slow operations are
+    logged with the EXPLAIN QUERY PLAN of their statements.
+    """
+
+    def __init__(self, slow_ms=None, slow_log_size=SLOW_LOG_SIZE):
+        self.slow_ms = slow_ms
+        self.slow_log_path = None
+        self.operations = {}
+        self.gauges = {}
+        self.slow_queries = deque(maxlen=slow_log_size)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _frames(self):
+        frames = getattr(self._local, "frames", None)
+        if frames is None:
+            frames = self._local.frames = []
+        return frames
+
+    def _trace(self, statement):
+        # Statements starting with '--' come from inside triggers and
+        # virtual tables; they belong to the statement that ran them.
+        if statement.startswith("--"):
+            return
+        frames = self._frames()
+        if frames and not getattr(self._local, "explaining", False):
+            frames[-1].append(statement)
+
+    def enable_tracing(self, pool=None):
+        """
+        Attribute SQL statements to operations through sqlite3's
+        set_trace_callback. Applies to connections the pool opens from now
+        on, so call it before the first query.
+        """
+        pool = pool or db.get_pool()
+        pool.connect_hooks.append(lambda conn: conn.set_trace_callback(self._trace))
+
+    def record(self, name, seconds, rows=0, statements=(), error=False):
+        with self._lock:
+            stats = self.operations.get(name)
+            if stats is None:
+                stats = self.operations[name] = OperationStats()
+            stats.add(seconds, rows, len(statements), error)
+        if self.slow_ms is not None and seconds * 1000 >= self.slow_ms:
+            self._log_slow(name, seconds, statements)
+
+    def gauge(self, name, function):
+        """
+        Report `function()`, e.g. a queue's current length, as the gauge
+        `name` in every snapshot.
+        """
+        with self._lock:
+            self.gauges[name] = function
+
+    def _explain(self, statement):
+        self._local.explaining = True
+        try:
+            with db.session() as conn:
+                return [row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {statement}")]
+        except Exception as e:
+            return [f"(not explained: {e})"]
+        finally:
+            self._local.explaining = False
+
+    def _log_slow(self, name, seconds, statements):
+        entry = {
+            "operation": name,
+            "ms": seconds * 1000,
+            "at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            # Traced statements carry their bound values, password hashes
+            # included, so string literals are masked in the log.
+            "statements": [
+                {"sql": STRING_LITERAL.sub("'?'", statement),
+                 "plan": self._explain(statement) if statement.lstrip().upper().startswith(EXPLAINABLE) else []}
+                for statement in statements
+            ],
+        }
+        with self._lock:
+            self.slow_queries.append(entry)
+            if self.slow_log_path:
+                with open(self.slow_log_path, mode='a', encoding='utf-8') as file:
+                    file.write(json.dumps(entry) + "\n")
+
+    def timed(self, name):
+        """
+        Decorator recording the latency, rows returned and SQL statements
+        of every call under `name`.
+        """
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                frames = self._frames()
+                frames.append([])
+                start = time.perf_counter()
+                error = False
+                result = None
+                try:
+                    result = function(*args, **kwargs)
+                    return result
+                except BaseException:
+                    error = True
+                    raise
+                finally:
+                    seconds = time.perf_counter() - start
+                    statements = frames.pop()
+                    if frames:
+                        frames[-1].extend(statements)
+                    self.record(name, seconds, _rows(result), statements, error)
+            return wrapper
+        return decorator
+
+    def instrument(self, target, prefix, names=None):
+        """
+        Replace the public methods of an object (e.g. a repository) with
+        timed wrappers named '<prefix>.<method>', and return the object.
+        """
+        if names is None:
+            names = [name for name in dir(target)
+                     if not name.startswith('_') and callable(getattr(target, name))]
+        for name in names:
+            setattr(target, name, self.timed(f"{prefix}.{name}")(getattr(target, name)))
+        return target
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "operations": {name: stats.as_dict() for name, stats in sorted(self.operations.items())},
+                "gauges": {name: function() for name, function in sorted(self.gauges.items())},
+                "slow_queries": list(self.slow_queries),
+            }
+
+    def reset(self):
+        with self._lock:
+            self.operations.clear()
+            self.slow_queries.clear()
+
+    def to_prometheus(self):
+        """
+        Render the operation metrics in the Prometheus text format.
+        """
+        lines = [
+            "# HELP bird_operation_seconds Latency of database operations.",
+            "# TYPE bird_operation_seconds histogram",
+        ]
+        operations = self.snapshot()["operations"]
+        for name, stats in operations.items():
+            for bound, count in stats["buckets"].items():
+                lines.append(f'bird_operation_seconds_bucket{{operation="{name}",le="{bound}"}} {count}')
+            lines.append(f'bird_operation_seconds_sum{{operation="{name}"}} {stats["total_ms"] / 1000}')
+            lines.append(f'bird_operation_seconds_count{{operation="{name}"}} {stats["count"]}')
+        for metric, key, text in (("errors", "errors", "Operations that raised."),
+                                  ("rows", "rows", "Rows returned by operations."),
+                                  ("statements", "statements", "SQL statements run by operations.")):
+            lines.append(f"# HELP bird_operation_{metric}_total {text}")
+            lines.append(f"# TYPE bird_operation_{metric}_total counter")
+            for name, stats in operations.items():
+                lines.append(f'bird_operation_{metric}_total{{operation="{name}"}} {stats[key]}')
+        gauges = self.snapshot()["gauges"]
+        if gauges:
+            lines.append("# HELP bird_gauge Current values such as queue depths.")
+            lines.append("# TYPE bird_gauge gauge")
+            for name, value in gauges.items():
+                lines.append(f'bird_gauge{{name="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def export(self, path, fmt=None):
+        """
+        Write the metrics to a file as JSON, or in the Prometheus text
+        format when asked to or when the file name ends in .prom.
+        """
+        if fmt is None:
+            fmt = "prometheus" if path.endswith(".prom") else "json"
+        with open(path, mode='w', encoding='utf-8') as file:
+            if fmt == "prometheus":
+                file.write(self.to_prometheus())
+            else:
+                json.dump(self.snapshot(), file, indent=2)
+
+
+metrics = Metrics()
+timed = metrics.timed
+instrument = metrics.instrument
+
+
+def configure_from_env():
+    """
+    Set up instrumentation from the environment:
+
+        BIRD_SLOW_MS=50           log operations slower than 50 ms
+        BIRD_TRACE=1              attribute SQL statements to operations
+        BIRD_METRICS=metrics.prom export the metrics to this file at exit
+
+    Slow operations are also appended to '<BIRD_METRICS>.slow.jsonl'.
+    """
+    slow_ms = os.environ.get(SLOW_MS_ENV)
+    if slow_ms:
+        metrics.slow_ms = float(slow_ms)
+    if os.environ.get(TRACE_ENV, "") not in ("", "0"):
+        metrics.enable_tracing()
+    path = os.environ.get(METRICS_ENV)
+    if path:
+        metrics.slow_log_path = f"{path}.slow.jsonl"
+        atexit.register(metrics.export, path)
+
+
+def report(snapshot, sort="total_ms", limit=None):
+    """
+    Print the operations of a metrics snapshot, the most expensive first,
+    then the slow-query log.
+    """
+    operations = sorted(snapshot["operations"].items(), key=lambda item: item[1][sort], reverse=True)
+    print(f"{'operation':40} {'count':>8} {'errors':>6} {'rows':>9} {'mean ms':>9} "
+          f"{'p50 ms':>8} {'p99 ms':>8} {'max ms':>9} {'total ms':>10}")
+    for name, stats in operations[:limit]:
+        print(f"{name:40} {stats['count']:8d} {stats['errors']:6d} {stats['rows']:9d} {stats['mean_ms']:9.2f} "
+              f"{stats['p50_ms']:8.2f} {stats['p99_ms']:8.2f} {stats['max_ms']:9.2f} {stats['total_ms']:10.1f}")
+    for name, value in snapshot.get("gauges", {}).items():
+        print(f"{name:40} {value}")
+    for entry in snapshot.get("slow_queries", []):
+        print(f"\nSlow: {entry['operation']} took {entry['ms']:.1f} ms at {entry['at']}")
+        for statement in entry["statements"]:
+            print(f"  {' '.join(statement['sql'].split())}")
+            for step in statement["plan"]:
+                print(f"    {step}")
+
+
+def main():
+    """
+    Command line entry point: python instrumentation.py metrics.json
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Report on exported instrumentation metrics.")
+    parser.add_argument("path", help="a JSON metrics export")
+    parser.add_argument("--sort", default="total_ms",
+                        choices=["total_ms", "count", "mean_ms", "p99_ms", "max_ms", "rows", "errors"])
+    parser.add_argument("--limit", type=int)
+    args = parser.parse_args()
+
+    with open(args.path, encoding='utf-8') as file:
+        report(json.load(file), args.sort, args.limit)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,629 @@
+import datetime
+import re
+from dataclasses import dataclass, fields, astuple, replace
+from typing import Optional
+
+from cache import LRUCache
+from db import session
+from fuzzy import SUGGESTIONS, NameIndex
+
+PAGE_SIZE = 50
+FETCH_SIZE = 500
+BIRD_CACHE_SIZE = 4096
+
+CONSERVATION_STATUSES = ('extinct', 'not extinct')
+USER_TYPES = ('researcher', 'common_user', 'student')
+ISO_DATE = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+INSERT_SIGHTING = '''
+    INSERT INTO avian_sightings (bird_id, date, location, observer, notes, latitude, longitude)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+@dataclass
+class User:
+    username: str
+    email: str
+    password: str
+    user_type: str
+    id: Optional[int] = None
+    created_at: Optional[str] = None
+
+
+@dataclass
+class Bird:
+    name: str
+    bio_name: str
+    origin: str
+    habitat: str
+    diet: str
+    conservation_status: str
+    description: str
+    id: Optional[int] = None
+
+
+@dataclass
+class Sighting:
+    bird_id: int
+    date: str
+    location: str
+    observer: Optional[str] = None
+    notes: Optional[str] = None
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    id: Optional[int] = None
+    bird_name: Optional[str] = None
+
+
+@dataclass
+class BirdSummary:
+    id: int
+    name: str
+    sightings: int = 0
+    first_seen: Optional[str] = None
+    last_seen: Optional[str] = None
+    observers: int = 0
+
+
+@dataclass
+class SightingRevision:
+    sighting_id: int
+    date: Optional[str]
+    location: Optional[str]
+    observer: Optional[str]
+    notes: Optional[str]
+    revised_at: Optional[str] = None
+    id: Optional[int] = None
+
+
+def check_coordinates(latitude, longitude):
+    """
+    Raise ValueError unless both coordinates are missing or both are
+    valid degrees.
+    """
+    if latitude is None and longitude is None:
+        return
+    if latitude is None or longitude is None:
+        raise ValueError("Give both latitude and longitude, or neither.")
+    if not -90 <= latitude <= 90:
+        raise ValueError("Latitude must be between -90 and 90.")
+    if not -180 <= longitude <= 180:
+        raise ValueError("Longitude must be between -180 and 180.")
+
+
+def check_date(date):
+    """
+    Raise ValueError unless `date` is a valid date written as YYYY-MM-DD,
+    the form sightings are stored, compared and sorted in.
+    """
+    try:
+        if ISO_DATE.fullmatch(date) and datetime.date.fromisoformat(date):
+            return
+    except (TypeError, ValueError):
+        pass
+    raise ValueError(f"Date must be a valid date in YYYY-MM-DD form, not '{date}'.")
+
+
+def sighting_row(sighting):
+    """
+    Return the values of a new sighting in INSERT_SIGHTING order, with
+    empty observer and notes stored as NULL.
+    """
+    return (sighting.bird_id, sighting.date, sighting.location, sighting.observer or None,
+            sighting.notes or None, sighting.latitude, sighting.longitude)
+
+
+def timeline_key(sighting):
+    """
+    Return the position of a sighting in a bird's timeline, to pass as
+    `after` for the next page of SightingRepository.timeline().
+    """
+    return sighting.date, sighting.id
+
+
+def columns(record_type):
+    """
+    Return the table column names of a record type, in display order.
+    """
+    names = [f.name for f in fields(record_type) if f.name != 'bird_name']
+    return ['id'] + [name for name in names if name != 'id']
+
+
+def as_row(record):
+    """
+    Return a record as a tuple in the same order as columns().
+    """
+    values = dict(zip([f.name for f in fields(record)], astuple(record)))
+    return tuple(values[name] for name in columns(type(record)))
+
+
+class _Repository:
+    def __init__(self, pool=None):
+        self.pool = pool
+
+    def _session(self):
+        return self.pool.connection() if self.pool is not None else session()
+
+    @staticmethod
+    def _pages(fetch, key, fetch_size=FETCH_SIZE):
+        """
+        Yield records lazily from keyset pages of `fetch_size`: fetch(after,
+        limit) is called with key() of the last record of the previous
+        page, None for the first. Each page borrows a pooled connection and
+        returns it, so an iteration that is stopped early or abandoned holds
+        none; rows written while it runs may or may not be seen.
+        """
+        after = None
+        while True:
+            page = fetch(after, fetch_size)
+            yield from page
+            if len(page) < fetch_size:
+                return
+            after = key(page[-1])
+
+
+class UserRepository(_Repository):
+    """
+    Data access for the users table.
+    """
+    _select = "SELECT id, username, email, password, user_type, created_at FROM users"
+
+    @staticmethod
+    def _record(row):
+        if row is None:
+            return None
+        return User(id=row[0], username=row[1], email=row[2], password=row[3], user_type=row[4], created_at=row[5])
+
+    def add(self, user):
+        """
+        Insert a new user and return it with its id set.
+        """
+        user_type = user.user_type.lower()
+        if user_type not in USER_TYPES:
+            raise ValueError(f"user_type must be one of {', '.join(USER_TYPES)}.")
+        with self._session() as conn:
+            cursor = conn.execute('''
+                INSERT INTO users (username, email, password, user_type)
+                VALUES (?, ?, ?, ?)
+                ''', (user.username, user.email, user.password, user_type))
+            user.id = cursor.lastrowid
+        user.user_type = user_type
+        return user
+
+    def get(self, user_id):
+        with self._session() as conn:
+            return self._record(conn.execute(f"{self._select} WHERE id = ?", (user_id,)).fetchone())
+
+    def find_for_login(self, username_or_email, user_type):
+        """
+        Return the user with this user name or email and role, or None. The
+        password is checked by the caller against the stored hash.
+        """
+        with self._session() as conn:
+            row = conn.execute(f'''
+                {self._select}
+                WHERE (username = ? OR email = ?) AND user_type = ?
+                ''', (username_or_email, username_or_email, user_type.lower())).fetchone()
+        return self._record(row)
+
+    def set_password(self, user_id, password_hash):
+        with self._session() as conn:
+            conn.execute("UPDATE users SET password = ? WHERE id = ?", (password_hash, user_id))
+
+
+# Shared by every BirdRepository on the default pool, so a write through
+# one repository invalidates what the others have cached.
+bird_cache = LRUCache(BIRD_CACHE_SIZE)
+bird_names = NameIndex()
+
+
+class BirdRepository(_Repository):
+    """
+    Data access for the bird_details table. Names are matched case-insensitively.
+
+    Lookups by id and by name go through an LRU cache keyed on the id and
+    the lower-cased name; add, update and delete invalidate the entries of
+    the bird they change, and a lookup that raced with one of them does
+    not cache what it read. suggest() offers similar names from a trigram
+    index that the same writes keep current.
+    """
+    _select = "SELECT id, name, bio_name, origin, habitat, diet, conservation_status, description FROM bird_details"
+    _editable = ('bio_name', 'origin', 'habitat', 'diet', 'conservation_status', 'description')
+
+    def __init__(self, pool=None, cache=None, name_index=None, archive=None):
+        super().__init__(pool)
+        self.archive = archive
+        if cache is None:
+            cache = bird_cache if pool is None else LRUCache(BIRD_CACHE_SIZE)
+        if name_index is None:
+            name_index = bird_names if pool is None else NameIndex()
+        self.cache = cache
+        self.name_index = name_index
+
+    def _remember(self, bird, generation):
+        if bird is not None:
+            self.cache.put_many([(("id", bird.id), bird), (("name", bird.name.lower()), bird)], generation)
+        return replace(bird) if bird is not None else None
+
+    @staticmethod
+    def _stored(conn, name):
+        """
+        Return the (id, name) of the bird with this name, or None.
+        """
+        return conn.execute("SELECT id, name FROM bird_details WHERE LOWER(name) = LOWER(?)", (name,)).fetchone()
+
+    @staticmethod
+    def _cache_keys(stored, name):
+        """
+        Return the cache keys of the bird with this name, to invalidate
+        once a write to it has committed.
+        """
+        keys = [("name", name.lower())]
+        if stored:
+            keys += [("id", stored[0]), ("name", stored[1].lower())]
+        return keys
+
+    @staticmethod
+    def _record(row):
+        if row is None:
+            return None
+        return Bird(id=row[0], name=row[1], bio_name=row[2], origin=row[3], habitat=row[4],
+                    diet=row[5], conservation_status=row[6], description=row[7])
+
+    def add(self, bird):
+        """
+        Insert a new bird and return it with its id set.
+        """
+        if bird.conservation_status not in CONSERVATION_STATUSES:
+            raise ValueError("conservation_status must be 'extinct' or 'not extinct'.")
+        with self._session() as conn:
+            cursor = conn.execute('''
+                INSERT INTO bird_details (name, bio_name, origin, habitat, diet, conservation_status, description)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (bird.name, bird.bio_name, bird.origin, bird.habitat, bird.diet,
+                      bird.conservation_status, bird.description))
+            bird.id = cursor.lastrowid
+        self.cache.invalidate(("id", bird.id), ("name", bird.name.lower()))
+        self.name_index.add(bird.id, bird.name, bird.bio_name)
+        return bird
+
+    def get(self, bird_id):
+        bird = self.cache.get(("id", bird_id))
+        if bird is not None:
+            return replace(bird)
+        # Taken before the read, so a write that invalidates while it runs
+        # keeps what was read out of the cache.
+        generation = self.cache.generation()
+        with self._session() as conn:
+            row = conn.execute(f"{self._select} WHERE id = ?", (bird_id,)).fetchone()
+        return self._remember(self._record(row), generation)
+
+    def get_by_name(self, name):
+        bird = self.cache.get(("name", name.lower()))
+        if bird is not None:
+            return replace(bird)
+        generation = self.cache.generation()
+        with self._session() as conn:
+            row = conn.execute(f"{self._select} WHERE LOWER(name) = LOWER(?)", (name,)).fetchone()
+        return self._remember(self._record(row), generation)
+
+    def update(self, name, **changes):
+        """
+        Update the given columns of the bird with this name. Returns True
+        if a bird was updated.
+        """
+        unknown = set(changes) - set(self._editable)
+        if unknown:
+            raise ValueError(f"Cannot update column(s): {', '.join(sorted(unknown))}.")
+        if 'conservation_status' in changes and changes['conservation_status'] not in CONSERVATION_STATUSES:
+            raise ValueError("conservation_status must be 'extinct' or 'not extinct'.")
+        if not changes:
+            return False
+
+        assignments = ', '.join(f"{column} = ?" for column in changes)
+        with self._session() as conn:
+            stored = self._stored(conn, name)
+            cursor = conn.execute(
+                f"UPDATE bird_details SET {assignments} WHERE LOWER(name) = LOWER(?)",
+                (*changes.values(), name)
+            )
+        self.cache.invalidate(*self._cache_keys(stored, name))
+        if stored and 'bio_name' in changes:
+            self.name_index.add(stored[0], stored[1], changes['bio_name'])
+        return cursor.rowcount > 0
+
+    def delete(self, name):
+        """
+        Delete the bird with this name, and through ON DELETE CASCADE its
+        sightings. Its archived sightings are dropped from the archive
+        (the default one unless the repository was given another) in the
+        same transaction. Returns True if a bird was deleted.
+        """
+        with self._session() as conn:
+            stored = self._stored(conn, name)
+            if stored:
+                archive = self.archive
+                if archive is None:
+                    from archive import Archive
+                    archive = Archive()
+                archive.drop_bird(conn, stored[0])
+            cursor = conn.execute("DELETE FROM bird_details WHERE LOWER(name) = LOWER(?)", (name,))
+        self.cache.invalidate(*self._cache_keys(stored, name))
+        if stored:
+            self.name_index.remove(stored[0])
+        return cursor.rowcount > 0
+
+    def list(self):
+        return list(self.iter_all())
+
+    def iter_all(self, fetch_size=FETCH_SIZE):
+        """
+        Yield every bird in id order without loading the table into memory.
+        """
+        return self._pages(lambda after, limit: self.page(after or 0, limit), lambda bird: bird.id, fetch_size)
+
+    def page(self, after_id=0, limit=PAGE_SIZE):
+        """
+        Return up to `limit` birds with an id greater than `after_id`. Pass
+        the id of the last bird of a page to get the next one.
+        """
+        with self._session() as conn:
+            rows = conn.execute(f"{self._select} WHERE id > ? ORDER BY id LIMIT ?", (after_id, limit))
+            return [self._record(row) for row in rows]
+
+    def names(self):
+        with self._session() as conn:
+            return [row[0] for row in conn.execute("SELECT name FROM bird_details ORDER BY id")]
+
+    def summaries_page(self, after_id=0, limit=PAGE_SIZE):
+        """
+        Return up to `limit` BirdSummary records with an id greater than
+        `after_id`, read from bird_stats rather than counted from the
+        sightings, so a page costs the same however many sightings there are.
+        """
+        with self._session() as conn:
+            rows = conn.execute('''
+                SELECT b.id, b.name, COALESCE(s.sightings, 0), s.first_seen, s.last_seen, COALESCE(s.observers, 0)
+                FROM bird_details b LEFT JOIN bird_stats s ON s.bird_id = b.id
+                WHERE b.id > ? ORDER BY b.id LIMIT ?
+            ''', (after_id, limit))
+            return [BirdSummary(*row) for row in rows]
+
+    def _name_rows(self):
+        with self._session() as conn:
+            return conn.execute("SELECT id, name, bio_name FROM bird_details").fetchall()
+
+    def suggest(self, name, limit=SUGGESTIONS):
+        """
+        Return up to `limit` fuzzy.Suggestion for the birds whose name or
+        biological name is closest to `name`, e.g. to offer when a lookup
+        by name finds nothing. The index is built on first use.
+        """
+        self.name_index.ensure_loaded(self._name_rows)
+        return self.name_index.suggest(name, limit)
+
+    def search(self, text):
+        """
+        Return birds whose common or biological name contains `text`.
+        """
+        pattern = f"%{text}%"
+        with self._session() as conn:
+            rows = conn.execute(f"{self._select} WHERE name LIKE ? OR bio_name LIKE ?", (pattern, pattern))
+            return [self._record(row) for row in rows]
+
+
+class SightingRepository(_Repository):
+    """
+    Data access for the avian_sightings table. Given an archive.Archive,
+    per-bird listings include the bird's archived sightings.
+    """
+    _select = '''
+        SELECT a.id, a.bird_id, a.date, a.location, a.observer, a.notes, a.latitude, a.longitude, b.name
+        FROM avian_sightings a
+        JOIN bird_details b ON a.bird_id = b.id
+    '''
+    _editable = ('date', 'location', 'observer', 'notes', 'latitude', 'longitude')
+
+    def __init__(self, pool=None, archive=None):
+        super().__init__(pool)
+        self.archive = archive
+
+    @staticmethod
+    def _record(row):
+        if row is None:
+            return None
+        return Sighting(id=row[0], bird_id=row[1], date=row[2], location=row[3], observer=row[4],
+                        notes=row[5], latitude=row[6], longitude=row[7], bird_name=row[8])
+
+    def add(self, sighting):
+        """
+        Insert a new sighting and return it with its id set.
+        """
+        check_date(sighting.date)
+        check_coordinates(sighting.latitude, sighting.longitude)
+        with self._session() as conn:
+            cursor = conn.execute(INSERT_SIGHTING, sighting_row(sighting))
+            sighting.id = cursor.lastrowid
+        return sighting
+
+    def get(self, sighting_id, bird_id=None):
+        """
+        Return a sighting by id, optionally requiring it to belong to `bird_id`.
+        """
+        sql = f"{self._select} WHERE a.id = ?"
+        params = [sighting_id]
+        if bird_id is not None:
+            sql += " AND a.bird_id = ?"
+            params.append(bird_id)
+        with self._session() as conn:
+            return self._record(conn.execute(sql, params).fetchone())
+
+    def update(self, sighting_id, **changes):
+        """
+        Update the given columns of a sighting, first saving its previous
+        values as a row in sighting_revisions. Returns True if it was updated.
+        """
+        unknown = set(changes) - set(self._editable)
+        if unknown:
+            raise ValueError(f"Cannot update column(s): {', '.join(sorted(unknown))}.")
+        if 'date' in changes:
+            check_date(changes['date'])
+        if 'latitude' in changes or 'longitude' in changes:
+            check_coordinates(changes.get('latitude'), changes.get('longitude'))
+        if not changes:
+            return False
+
+        assignments = ', '.join(f"{column} = ?" for column in changes)
+        with self._session() as conn:
+            conn.execute('''
+                INSERT INTO sighting_revisions (sighting_id, date, location, observer, notes)
+                SELECT id, date, location, observer, notes FROM avian_sightings WHERE id = ?
+                ''', (sighting_id,))
+            cursor = conn.execute(
+                f"UPDATE avian_sightings SET {assignments} WHERE id = ?",
+                (*changes.values(), sighting_id)
+            )
+        return cursor.rowcount > 0
+
+    def delete(self, sighting_id):
+        with self._session() as conn:
+            cursor = conn.execute("DELETE FROM avian_sightings WHERE id = ?", (sighting_id,))
+        return cursor.rowcount > 0
+
+    def history(self, sighting_id):
+        """
+        Return the earlier versions of a sighting, oldest first.
+        """
+        with self._session() as conn:
+            rows = conn.execute('''
+                SELECT sighting_id, date, location, observer, notes, revised_at, id
+                FROM sighting_revisions
+                WHERE sighting_id = ?
+                ORDER BY id
+                ''', (sighting_id,))
+            return [SightingRevision(*row) for row in rows]
+
+    def list(self, bird_id=None):
+        """
+        Return all sightings, or those of one bird newest first.
+        """
+        return list(self.iter_all(bird_id))
+
+    def iter_all(self, bird_id=None, fetch_size=FETCH_SIZE):
+        """
+        Yield all sightings in id order, or those of one bird newest first,
+        without loading them into memory.
+        """
+        if bird_id is None:
+            return self._pages(lambda after, limit: self.page(after or 0, limit), lambda s: s.id, fetch_size)
+        return self._pages(lambda after, limit: self.timeline(bird_id, after, limit, archived=False),
+                           timeline_key, fetch_size)
+
+    def timeline(self, bird_id, after=None, limit=PAGE_SIZE, archived=True):
+        """
+        Return up to `limit` sightings of a bird, newest first, starting
+        after `after`, the timeline_key() of the last sighting of the
+        previous page. Pages are read in order from the (bird_id, date DESC,
+        id DESC) index, so each costs the same however many sightings the
+        bird has. Unless `archived` is False, archived sightings are merged
+        in once a page reaches back to the dates of an archive chunk
+        holding the bird.
+        """
+        sql = f"{self._select} WHERE a.bird_id = ?"
+        params = [bird_id]
+        if after:
+            sql += " AND (a.date, a.id) < (?, ?)"
+            params.extend(after)
+        sql += " ORDER BY a.date DESC, a.id DESC LIMIT ?"
+        params.append(limit)
+        with self._session() as conn:
+            page = [self._record(row) for row in conn.execute(sql, params)]
+            if self.archive is None or not archived:
+                return page
+
+            # Archived sightings older than a full page cannot be on it.
+            start_date = page[-1].date if len(page) == limit else None
+            end_date = after[0] if after else None
+            archived = [row for row in self.archive.iter_rows(conn, bird_id, start_date, end_date)
+                        if not after or (row[2], row[0]) < tuple(after)]
+            if not archived:
+                return page
+            bird_name = conn.execute("SELECT name FROM bird_details WHERE id = ?", (bird_id,)).fetchone()
+        archived = [Sighting(*row[1:], id=row[0], bird_name=bird_name[0] if bird_name else None) for row in archived]
+        return sorted(page + archived, key=timeline_key, reverse=True)[:limit]
+
+    def page(self, after_id=0, limit=PAGE_SIZE):
+        """
+        Return up to `limit` sightings with an id greater than `after_id`.
+        """
+        with self._session() as conn:
+            rows = conn.execute(f"{self._select} WHERE a.id > ? ORDER BY a.id LIMIT ?", (after_id, limit))
+            return [self._record(row) for row in rows]
+
+    def in_box(self, min_lat, min_lon, max_lat, max_lon, limit=None):
+        """
+        Return the sightings whose coordinates fall inside a bounding box,
+        looked up through the avian_sightings_rtree index.
+        """
+        sql = f'''
+            {self._select}
+            JOIN avian_sightings_rtree r ON r.id = a.id
+            WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ?
+            ORDER BY a.id
+        '''
+        params = [min_lat, max_lat, min_lon, max_lon]
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self._session() as conn:
+            return [self._record(row) for row in conn.execute(sql, params)]
+
+    def list_for_bird_name(self, name):
+        """
+        Return the sightings of the bird with this name, newest first.
+        """
+        with self._session() as conn:
+            rows = conn.execute(f'''
+                {self._select}
+                WHERE a.bird_id = (SELECT id FROM bird_details WHERE LOWER(name) = LOWER(?))
+                ORDER BY a.date DESC, a.id DESC
+                ''', (name,))
+            sightings = [self._record(row) for row in rows]
+            if self.archive is None:
+                return sightings
+
+            bird = conn.execute("SELECT id, name FROM bird_details WHERE LOWER(name) = LOWER(?)", (name,)).fetchone()
+            if bird is None:
+                return sightings
+            archived = [Sighting(*row[1:], id=row[0], bird_name=bird[1])
+                        for row in self.archive.iter_rows(conn, bird_id=bird[0])]
+        if not archived:
+            return sightings
+        return sorted(sightings + archived, key=timeline_key, reverse=True)
+
+    def search(self, location=None, observer=None, start_date=None, end_date=None):
+        """
+        Return sightings matching every filter given. Location and observer
+        match as substrings, dates as an inclusive range.
+        """
+        conditions = []
+        params = []
+        if location:
+            conditions.append("a.location LIKE ?")
+            params.append(f"%{location}%")
+        if observer:
+            conditions.append("a.observer LIKE ?")
+            params.append(f"%{observer}%")
+        if start_date:
+            conditions.append("a.date >= ?")
+            params.append(start_date)
+        if end_date:
+            conditions.append("a.date <= ?")
+            params.append(end_date)
+
+        sql = self._select
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        with self._session() as conn:
+            return [self._record(row) for row in conn.execute(sql + " ORDER BY a.id", params)]
@@ -0,0 +1,673 @@
+import datetime
+import re
+
+from db import session
+
+# The tables the application started with, before any migration.
+BASE_TABLES = [
+    '''CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT NOT NULL UNIQUE,
+        email TEXT NOT NULL UNIQUE,
+        password TEXT NOT NULL,
+        user_type TEXT CHECK(user_type IN ('researcher', 'common_user', 'student')) NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)
+    ''',
+    '''CREATE TABLE IF NOT EXISTS bird_details (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL UNIQUE,
+        bio_name TEXT NOT NULL UNIQUE,
+        origin TEXT NOT NULL,
+        habitat TEXT NOT NULL,
+        diet TEXT NOT NULL,
+        conservation_status TEXT CHECK(conservation_status IN ('extinct', 'not extinct')) NOT NULL,
+        description TEXT NOT NULL)
+    ''',
+    '''CREATE TABLE IF NOT EXISTS avian_sightings (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        bird_id INTEGER NOT NULL,
+        date TEXT NOT NULL,
+        location TEXT NOT NULL,
+        observer TEXT,
+        notes TEXT,
+        FOREIGN KEY (bird_id) REFERENCES bird_details(id) ON DELETE CASCADE)
+    ''',
+]
+
+
+def create_tables(conn=None):
+    """
+    Create the base tables if they do not exist. migrate() builds the rest
+    of the schema on top of them.
+    """
+    if conn is None:
+        with session() as conn:
+            return create_tables(conn)
+    for statement in BASE_TABLES:
+        conn.execute(statement)
+    conn.commit()
+
+
+def _add_lookup_indexes(conn):
+    """
+    Index the case-insensitive name lookups and per-bird sighting listings.
+    The expression index matches `WHERE LOWER(name) = LOWER(?)` exactly, so
+    the existing queries use it without being rewritten.
+    """
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_bird_details_name_lower ON bird_details (LOWER(name))")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_avian_sightings_bird_date ON avian_sightings (bird_id, date)")
+
+
+def _add_full_text_search(conn):
+    """
+    Add external-content FTS5 indexes over the searchable text of birds
+    and sightings, kept in sync with their tables by triggers.
+    """
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS bird_details_fts USING fts5(
+            name, bio_name, description, habitat, diet,
+            content='bird_details', content_rowid='id')
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS bird_details_fts_insert AFTER INSERT ON bird_details BEGIN
+            INSERT INTO bird_details_fts (rowid, name, bio_name, description, habitat, diet)
+            VALUES (new.id, new.name, new.bio_name, new.description, new.habitat, new.diet);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS bird_details_fts_delete AFTER DELETE ON bird_details BEGIN
+            INSERT INTO bird_details_fts (bird_details_fts, rowid, name, bio_name, description, habitat, diet)
+            VALUES ('delete', old.id, old.name, old.bio_name, old.description, old.habitat, old.diet);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS bird_details_fts_update AFTER UPDATE ON bird_details BEGIN
+            INSERT INTO bird_details_fts (bird_details_fts, rowid, name, bio_name, description, habitat, diet)
+            VALUES ('delete', old.id, old.name, old.bio_name, old.description, old.habitat, old.diet);
+            INSERT INTO bird_details_fts (rowid, name, bio_name, description, habitat, diet)
+            VALUES (new.id, new.name, new.bio_name, new.description, new.habitat, new.diet);
+        END
+    ''')
+
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS avian_sightings_fts USING fts5(
+            location, notes,
+            content='avian_sightings', content_rowid='id')
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS avian_sightings_fts_insert AFTER INSERT ON avian_sightings BEGIN
+            INSERT INTO avian_sightings_fts (rowid, location, notes) VALUES (new.id, new.location, new.notes);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS avian_sightings_fts_delete AFTER DELETE ON avian_sightings BEGIN
+            INSERT INTO avian_sightings_fts (avian_sightings_fts, rowid, location, notes)
+            VALUES ('delete', old.id, old.location, old.notes);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS avian_sightings_fts_update AFTER UPDATE OF location, notes ON avian_sightings BEGIN
+            INSERT INTO avian_sightings_fts (avian_sightings_fts, rowid, location, notes)
+            VALUES ('delete', old.id, old.location, old.notes);
+            INSERT INTO avian_sightings_fts (rowid, location, notes) VALUES (new.id, new.location, new.notes);
+        END
+    ''')
+
+    conn.execute("INSERT INTO bird_details_fts (bird_details_fts) VALUES ('rebuild')")
+    conn.execute("INSERT INTO avian_sightings_fts (avian_sightings_fts) VALUES ('rebuild')")
+
+
+def _split_history(value, separator):
+    """
+    Split a value built by the old append-style sighting update into its
+    successive values, oldest first. The string 'None' stands for an empty
+    value that was appended to.
+    """
+    if value is None:
+        return [None]
+    return [None if part.strip() in ('', 'None') else part.strip() for part in value.split(separator)]
+
+
+def _add_sighting_revisions(conn):
+    """
+    Keep one row per sighting edit in sighting_revisions, holding the
+    values the sighting had before that edit, instead of appending to the
+    sighting's own date, observer and notes columns.
+
+    Existing sightings with appended values are split: the last value of
+    each column stays on the sighting, and the earlier ones become
+    revisions. The old format never recorded which columns one edit
+    changed together, so the k-th earlier value of each column is grouped
+    into the k-th revision, and revised_at is left NULL for these rows.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS sighting_revisions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        sighting_id INTEGER NOT NULL,
+        date TEXT,
+        location TEXT,
+        observer TEXT,
+        notes TEXT,
+        revised_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (sighting_id) REFERENCES avian_sightings(id) ON DELETE CASCADE)
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sighting_revisions_sighting ON sighting_revisions (sighting_id, id)")
+
+    appended = conn.execute('''
+        SELECT id, date, location, observer, notes FROM avian_sightings
+        WHERE date LIKE '% | %' OR observer LIKE '% | %' OR notes LIKE '%' || char(10) || '---' || char(10) || '%'
+    ''').fetchall()
+
+    for sighting_id, date, location, observer, notes in appended:
+        dates = _split_history(date, ' | ')
+        observers = _split_history(observer, ' | ')
+        notes_list = _split_history(notes, '\n---\n')
+        edits = max(len(dates), len(observers), len(notes_list)) - 1
+
+        for k in range(edits):
+            conn.execute('''
+                INSERT INTO sighting_revisions (sighting_id, date, location, observer, notes, revised_at)
+                VALUES (?, ?, ?, ?, ?, NULL)
+            ''', (sighting_id, dates[min(k, len(dates) - 1)], location, observers[min(k, len(observers) - 1)],
+                  notes_list[min(k, len(notes_list) - 1)]))
+
+        conn.execute(
+            "UPDATE avian_sightings SET date = ?, observer = ?, notes = ? WHERE id = ?",
+            (dates[-1] or date, observers[-1], notes_list[-1], sighting_id)
+        )
+
+
+ROLLUPS = {
+    # table: (key column, expression over a sighting row `r`)
+    "sighting_counts_by_bird": ("bird_id", "{r}.bird_id"),
+    "sighting_counts_by_location": ("location", "{r}.location"),
+    "sighting_counts_by_day": ("day", "substr({r}.date, 1, 10)"),
+    "sighting_counts_by_month": ("month", "substr({r}.date, 1, 7)"),
+}
+
+
+def _add_sighting_rollups(conn):
+    """
+    Keep sighting counts per bird, location, day and month in rollup
+    tables maintained by triggers, so reading a count is a primary key
+    lookup instead of a scan of avian_sightings.
+    """
+    for table, (key, expression) in ROLLUPS.items():
+        key_type = "INTEGER" if key == "bird_id" else "TEXT"
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({key} {key_type} PRIMARY KEY, count INTEGER NOT NULL)")
+        conn.execute(f"DELETE FROM {table}")
+        conn.execute(f'''
+            INSERT INTO {table} ({key}, count)
+            SELECT {expression.format(r="a")}, COUNT(*) FROM avian_sightings a GROUP BY 1
+        ''')
+
+    increments = []
+    decrements = []
+    for table, (key, expression) in ROLLUPS.items():
+        increments.append(f'''
+            INSERT INTO {table} ({key}, count) VALUES ({expression.format(r="new")}, 1)
+            ON CONFLICT ({key}) DO UPDATE SET count = count + 1;''')
+        decrements.append(f'''
+            UPDATE {table} SET count = count - 1 WHERE {key} = {expression.format(r="old")};
+            DELETE FROM {table} WHERE {key} = {expression.format(r="old")} AND count <= 0;''')
+
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS avian_sightings_rollup_insert AFTER INSERT ON avian_sightings BEGIN
+            {"".join(increments)}
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS avian_sightings_rollup_delete AFTER DELETE ON avian_sightings BEGIN
+            {"".join(decrements)}
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS avian_sightings_rollup_update
+        AFTER UPDATE OF bird_id, date, location ON avian_sightings BEGIN
+            {"".join(decrements)}
+            {"".join(increments)}
+        END
+    ''')
+
+
+def _add_sighting_coordinates(conn):
+    """
+    Add optional latitude and longitude columns to avian_sightings, with
+    an R*Tree index over the sightings that have them, kept in sync by
+    triggers.
+    """
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(avian_sightings)")}
+    for column in ("latitude", "longitude"):
+        if column not in existing:
+            conn.execute(f"ALTER TABLE avian_sightings ADD COLUMN {column} REAL")
+
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS avian_sightings_rtree
+        USING rtree(id, min_lat, max_lat, min_lon, max_lon)
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS avian_sightings_rtree_insert AFTER INSERT ON avian_sightings
+        WHEN new.latitude IS NOT NULL AND new.longitude IS NOT NULL BEGIN
+            INSERT INTO avian_sightings_rtree VALUES (new.id, new.latitude, new.latitude, new.longitude, new.longitude);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS avian_sightings_rtree_delete AFTER DELETE ON avian_sightings BEGIN
+            DELETE FROM avian_sightings_rtree WHERE id = old.id;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS avian_sightings_rtree_update
+        AFTER UPDATE OF latitude, longitude ON avian_sightings BEGIN
+            DELETE FROM avian_sightings_rtree WHERE id = old.id;
+            INSERT INTO avian_sightings_rtree
+            SELECT new.id, new.latitude, new.latitude, new.longitude, new.longitude
+            WHERE new.latitude IS NOT NULL AND new.longitude IS NOT NULL;
+        END
+    ''')
+    conn.execute('''
+        INSERT OR REPLACE INTO avian_sightings_rtree
+        SELECT id, latitude, latitude, longitude, longitude FROM avian_sightings
+        WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+    ''')
+
+
+def _add_sighting_archive(conn):
+    """
+    Index the chunk files of the sighting archive (see archive.py): one row
+    per chunk, and the birds each chunk holds so that a per-bird listing
+    only opens the chunks it needs.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS archive_chunks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            file TEXT NOT NULL UNIQUE,
+            rows INTEGER NOT NULL,
+            min_date TEXT NOT NULL,
+            max_date TEXT NOT NULL,
+            bytes INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS archive_chunk_birds (
+            bird_id INTEGER NOT NULL,
+            chunk_id INTEGER NOT NULL REFERENCES archive_chunks(id) ON DELETE CASCADE,
+            rows INTEGER NOT NULL,
+            PRIMARY KEY (bird_id, chunk_id)) WITHOUT ROWID
+    ''')
+
+
+# Dates as people type them: year first, any of - / . between the parts,
+# optionally followed by a time.
+LOOSE_DATE = re.compile(r"\s*(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})(?:[ T].*)?")
+
+# True for a date not in the stored YYYY-MM-DD form, including impossible
+# ones such as 2024-02-30, which the '+0 days' modifier rolls over.
+NOT_ISO_DATE = "{date} IS NOT date({date}, '+0 days')"
+
+# {date} if it is in the stored form, else NULL, for MIN and MAX over
+# archived rows, which may predate the date check.
+ISO_DATE_OR_NULL = "CASE WHEN {date} IS date({date}, '+0 days') THEN {date} END"
+
+
+def _normalize_date(value):
+    """
+    Return a loosely written date as YYYY-MM-DD, or None if it is not one.
+    """
+    match = LOOSE_DATE.fullmatch(value or "")
+    if not match:
+        return None
+    try:
+        return datetime.date(*(int(part) for part in match.groups())).isoformat()
+    except ValueError:
+        return None
+
+
+def _quarantine_bad_dates(conn):
+    """
+    Move the sightings whose date is not YYYY-MM-DD out of avian_sightings
+    into avian_sightings_bad_dates, which has the same columns, so they
+    neither sort among real dates in the timeline nor become a bird's
+    first or last sighting. Returns the number moved.
+    """
+    conn.execute("CREATE TABLE IF NOT EXISTS avian_sightings_bad_dates AS SELECT * FROM avian_sightings WHERE 0")
+    where = NOT_ISO_DATE.format(date="date")
+    moved = conn.execute(f"INSERT INTO avian_sightings_bad_dates SELECT * FROM avian_sightings WHERE {where}").rowcount
+    if moved:
+        conn.execute(f"DELETE FROM avian_sightings WHERE {where}")
+        print(f"Moved {moved} sightings with unreadable dates to avian_sightings_bad_dates.")
+    return moved
+
+
+def _add_sighting_timeline(conn):
+    """
+    Store sighting dates as YYYY-MM-DD, which sorts as text in date order,
+    and reject any other form from now on. The (bird_id, date) index is
+    replaced by one on (bird_id, date DESC, id DESC), which returns a
+    bird's sightings newest first, a page at a time, without sorting.
+    Sightings whose date cannot be read are quarantined.
+    """
+    rows = conn.execute(f"SELECT id, date FROM avian_sightings WHERE {NOT_ISO_DATE.format(date='date')}").fetchall()
+    fixed = [(_normalize_date(date), sighting_id) for sighting_id, date in rows]
+    conn.executemany("UPDATE avian_sightings SET date = ? WHERE id = ?", [row for row in fixed if row[0]])
+    _quarantine_bad_dates(conn)
+
+    for name, event in (("insert", "INSERT"), ("update", "UPDATE OF date")):
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS avian_sightings_date_{name} BEFORE {event} ON avian_sightings
+            WHEN {NOT_ISO_DATE.format(date="new.date")} BEGIN
+                SELECT RAISE(ABORT, 'Sighting date must be a valid date in YYYY-MM-DD form.');
+            END
+        ''')
+    conn.execute("DROP INDEX IF EXISTS idx_avian_sightings_bird_date")
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_avian_sightings_timeline ON avian_sightings (bird_id, date DESC, id DESC)
+    ''')
+
+
+def fill_bird_stats(conn):
+    """
+    Recompute bird_stats and bird_observers from avian_sightings alone.
+    """
+    conn.execute("DELETE FROM bird_observers")
+    conn.execute("DELETE FROM bird_stats")
+    conn.execute('''
+        INSERT INTO bird_observers (bird_id, observer, sightings)
+        SELECT bird_id, observer, COUNT(*) FROM avian_sightings WHERE observer IS NOT NULL GROUP BY 1, 2
+    ''')
+    conn.execute('''
+        INSERT INTO bird_stats (bird_id, sightings, first_seen, last_seen, observers)
+        SELECT a.bird_id, COUNT(*), MIN(a.date), MAX(a.date),
+               (SELECT COUNT(*) FROM bird_observers o WHERE o.bird_id = a.bird_id)
+        FROM avian_sightings a GROUP BY a.bird_id
+    ''')
+
+
+# Earliest and latest sighting date of bird {r}.bird_id, live or archived.
+# Both halves are index seeks: MIN and MAX on the timeline index, and the
+# bird's rows of archive_chunk_birds.
+SEEN_BOUNDS = '''(SELECT {agg}(d) FROM (
+    SELECT {agg}(date) AS d FROM avian_sightings WHERE bird_id = {r}.bird_id
+    UNION ALL
+    SELECT {agg}({column}) FROM archive_chunk_birds WHERE bird_id = {r}.bird_id))'''
+
+
+def _add_bird_stats(conn):
+    """
+    Keep a summary row per bird in bird_stats: its number of sightings,
+    first and last sighting dates and number of distinct observers, with
+    bird_observers counting each observer's sightings of the bird.
+    Triggers on avian_sightings keep both in step with every write, so
+    the species overview reads one row per bird instead of aggregating
+    its sightings. Archived sightings still count (see archive.py);
+    archive_chunk_birds gains each bird's date range in a chunk so that
+    deleting a bird's first or last sighting can find the next one.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS bird_stats (
+            bird_id INTEGER PRIMARY KEY REFERENCES bird_details(id) ON DELETE CASCADE,
+            sightings INTEGER NOT NULL,
+            first_seen TEXT,
+            last_seen TEXT,
+            observers INTEGER NOT NULL)
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS bird_observers (
+            bird_id INTEGER NOT NULL REFERENCES bird_details(id) ON DELETE CASCADE,
+            observer TEXT NOT NULL,
+            sightings INTEGER NOT NULL,
+            PRIMARY KEY (bird_id, observer)) WITHOUT ROWID
+    ''')
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(archive_chunk_birds)")}
+    for column in ("first_date", "last_date"):
+        if column not in existing:
+            conn.execute(f"ALTER TABLE archive_chunk_birds ADD COLUMN {column} TEXT")
+
+    fill_bird_stats(conn)
+    # Chunks archived before this migration only record how many rows each
+    # bird has in them; their date range stands in for the bird's until
+    # analytics.py --rebuild reads the chunks.
+    conn.execute('''
+        INSERT INTO bird_stats (bird_id, sightings, first_seen, last_seen, observers)
+        SELECT cb.bird_id, SUM(cb.rows), MIN(c.min_date), MAX(c.max_date), 0
+        FROM archive_chunk_birds cb JOIN archive_chunks c ON c.id = cb.chunk_id
+        WHERE cb.bird_id IN (SELECT id FROM bird_details)
+        GROUP BY cb.bird_id
+        ON CONFLICT (bird_id) DO UPDATE SET
+            sightings = sightings + excluded.sightings,
+            first_seen = min(first_seen, excluded.first_seen),
+            last_seen = max(last_seen, excluded.last_seen)
+    ''')
+
+    # A sighting's observer is new to the bird if bird_observers has no row
+    # for them yet, and gone once their row's count drops to zero.
+    add = '''
+        INSERT INTO bird_stats (bird_id, sightings, first_seen, last_seen, observers)
+        VALUES (new.bird_id, 1, new.date, new.date, new.observer IS NOT NULL AND NOT EXISTS (
+            SELECT 1 FROM bird_observers WHERE bird_id = new.bird_id AND observer = new.observer))
+        ON CONFLICT (bird_id) DO UPDATE SET
+            sightings = sightings + 1,
+            first_seen = min(first_seen, excluded.first_seen),
+            last_seen = max(last_seen, excluded.last_seen),
+            observers = observers + excluded.observers;
+        INSERT INTO bird_observers (bird_id, observer, sightings)
+        SELECT new.bird_id, new.observer, 1 WHERE new.observer IS NOT NULL
+        ON CONFLICT (bird_id, observer) DO UPDATE SET sightings = sightings + 1;'''
+    remove = f'''
+        UPDATE bird_stats SET
+            sightings = sightings - 1,
+            observers = observers - IFNULL((
+                SELECT sightings = 1 FROM bird_observers WHERE bird_id = old.bird_id AND observer = old.observer), 0)
+        WHERE bird_id = old.bird_id;
+        UPDATE bird_observers SET sightings = sightings - 1 WHERE bird_id = old.bird_id AND observer = old.observer;
+        DELETE FROM bird_observers WHERE bird_id = old.bird_id AND observer = old.observer AND sightings <= 0;
+        UPDATE bird_stats SET first_seen = {SEEN_BOUNDS.format(agg="MIN", column="first_date", r="old")}
+        WHERE bird_id = old.bird_id AND first_seen = old.date;
+        UPDATE bird_stats SET last_seen = {SEEN_BOUNDS.format(agg="MAX", column="last_date", r="old")}
+        WHERE bird_id = old.bird_id AND last_seen = old.date;
+        DELETE FROM bird_stats WHERE bird_id = old.bird_id AND sightings <= 0;'''
+
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS avian_sightings_stats_insert AFTER INSERT ON avian_sightings BEGIN
+            {add}
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS avian_sightings_stats_delete AFTER DELETE ON avian_sightings BEGIN
+            {remove}
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS avian_sightings_stats_update
+        AFTER UPDATE OF bird_id, date, observer ON avian_sightings BEGIN
+            {remove}
+            {add}
+        END
+    ''')
+
+
+# The columns recorded in change_log for each table; users' passwords are
+# left out, and so are updates that only change a password.
+CHANGE_LOG_COLUMNS = {
+    "bird_details": ("id", "name", "bio_name", "origin", "habitat", "diet", "conservation_status", "description"),
+    "avian_sightings": ("id", "bird_id", "date", "location", "observer", "notes", "latitude", "longitude"),
+    "users": ("id", "username", "email", "user_type", "created_at"),
+}
+
+
+def _add_change_log(conn):
+    """
+    Record every insert, update and delete of birds, sightings and users in
+    change_log, under a sequence number that only grows, with the row's
+    new values as a JSON object (none for a delete). A downstream copy
+    applies the changes after the last sequence number it has seen,
+    instead of reloading whole tables. Rows that existed before this
+    migration have no entries; changes.main() describes how to start
+    a downstream copy from a full export.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            operation TEXT CHECK(operation IN ('insert', 'update', 'delete')) NOT NULL,
+            data TEXT,
+            changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)
+    ''')
+    for table, columns in CHANGE_LOG_COLUMNS.items():
+        pairs = ", ".join(f"'{column}', new.{column}" for column in columns)
+        data = f"json_object({pairs})"
+        updated = "" if table != "users" else f" OF {', '.join(columns)}"
+        for operation, event, row, values in (("insert", "INSERT", "new", data),
+                                              ("update", f"UPDATE{updated}", "new", data),
+                                              ("delete", "DELETE", "old", "NULL")):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_change_{operation} AFTER {event} ON {table} BEGIN
+                    INSERT INTO change_log (table_name, row_id, operation, data)
+                    VALUES ('{table}', {row}.id, '{operation}', {values});
+                END
+            ''')
+
+
+def _quarantine_unreadable_dates(conn):
+    """
+    Quarantine the sightings with unreadable dates that the timeline
+    migration used to leave in place; their delete triggers take them out
+    of the rollups and bird_stats. Chunks archived before that migration
+    may hold such dates too, so chunk date ranges and bird_stats bounds
+    that are not dates are recomputed without them. analytics.py
+    --rebuild fills the cleared chunk ranges from the chunks.
+    """
+    _quarantine_bad_dates(conn)
+    conn.execute(f'''
+        UPDATE archive_chunk_birds SET first_date = NULL, last_date = NULL
+        WHERE {NOT_ISO_DATE.format(date="first_date")} OR {NOT_ISO_DATE.format(date="last_date")}
+    ''')
+    conn.execute(f'''
+        UPDATE bird_stats SET
+            first_seen = {SEEN_BOUNDS.format(agg="MIN", column="first_date", r="bird_stats")},
+            last_seen = {SEEN_BOUNDS.format(agg="MAX", column="last_date", r="bird_stats")}
+        WHERE {NOT_ISO_DATE.format(date="first_seen")} OR {NOT_ISO_DATE.format(date="last_seen")}
+    ''')
+
+
+MIGRATIONS = [
+    _add_lookup_indexes,
+    _add_full_text_search,
+    _add_sighting_revisions,
+    _add_sighting_rollups,
+    _add_sighting_coordinates,
+    _add_sighting_archive,
+    _add_sighting_timeline,
+    _add_bird_stats,
+    _add_change_log,
+    _quarantine_unreadable_dates,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def migrate(conn=None):
+    """
+    Apply every migration newer than the database's PRAGMA user_version,
+    each in its own transaction, and return the resulting version.
+    """
+    if conn is None:
+        with session() as conn:
+            return migrate(conn)
+
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if conn.in_transaction:
+        conn.commit()
+    for number, step in enumerate(MIGRATIONS[version:], start=version + 1):
+        conn.execute("BEGIN")
+        try:
+            step(conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return max(version, SCHEMA_VERSION)
+
+
+def bootstrap(conn=None):
+    """
+    Bring a database up to the current schema: create the base tables and
+    apply pending migrations. A database already at SCHEMA_VERSION costs a
+    single PRAGMA read. Returns the schema version.
+    """
+    if conn is None:
+        with session() as conn:
+            return bootstrap(conn)
+
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return version
+    create_tables(conn)
+    return migrate(conn)
+
+
+LOOKUP_QUERIES = {
+    "bird by name": ("SELECT * FROM bird_details WHERE LOWER(name) = LOWER(?)", ("x",)),
+    "bird id by name": ("SELECT id FROM bird_details WHERE LOWER(name) = LOWER(?)", ("x",)),
+    "update bird by name": ("UPDATE bird_details SET diet = ? WHERE LOWER(name) = LOWER(?)", ("x", "x")),
+    "delete bird by name": ("DELETE FROM bird_details WHERE LOWER(name) = LOWER(?)", ("x",)),
+    "sightings by bird name": ('''
+        SELECT a.id, b.name, a.date, a.location, a.observer, a.notes
+        FROM avian_sightings a
+        JOIN bird_details b ON a.bird_id = b.id
+        WHERE a.bird_id = (SELECT id FROM bird_details WHERE LOWER(name) = LOWER(?))
+        ORDER BY a.date DESC
+    ''', ("x",)),
+    "sightings by bird id": ('''
+        SELECT id, date, location, observer, notes
+        FROM avian_sightings
+        WHERE bird_id = ?
+        ORDER BY date DESC
+    ''', (1,)),
+    "sighting timeline page": ('''
+        SELECT a.id, a.bird_id, a.date, a.location, a.observer, a.notes, a.latitude, a.longitude, b.name
+        FROM avian_sightings a
+        JOIN bird_details b ON a.bird_id = b.id
+        WHERE a.bird_id = ? AND (a.date, a.id) < (?, ?)
+        ORDER BY a.date DESC, a.id DESC
+        LIMIT ?
+    ''', (1, "2024-01-01", 1, 50)),
+}
+
+
+def explain_lookups(conn=None):
+    """
+    Run EXPLAIN QUERY PLAN for every name and per-bird lookup path and
+    return a dict of {lookup: [plan detail, ...]}.
+    """
+    if conn is None:
+        with session() as conn:
+            return explain_lookups(conn)
+
+    plans = {}
+    for label, (sql, params) in LOOKUP_QUERIES.items():
+        rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+        plans[label] = [row[-1] for row in rows]
+    return plans
+
+
+def check_lookup_indexes(conn=None):
+    """
+    Return the lookups whose query plan scans a table or sorts in a temp
+    B-tree instead of using an index. An empty list means every lookup is
+    index-backed.
+    """
+    problems = []
+    for label, details in explain_lookups(conn).items():
+        for detail in details:
+            if detail.startswith("SCAN") or "TEMP B-TREE" in detail:
+                problems.append(f"{label}: {detail}")
+    return problems
+
+
+if __name__ == "__main__":
+    print(f"Schema version: {bootstrap()}")
+    for problem in check_lookup_indexes():
+        print(f"Not index-backed: {problem}")
@@ -0,0 +1,94 @@
+from dataclasses import dataclass
+
+from db import session
+
+SEARCH_LIMIT = 20
+SNIPPET_TOKENS = 12
+
+# bm25 column weights, in FTS column order. A match in the name ranks
+# far above one in the description.
+BIRD_WEIGHTS = (10.0, 5.0, 1.0, 2.0, 2.0)
+SIGHTING_WEIGHTS = (3.0, 1.0)
+
+
+@dataclass
+class BirdMatch:
+    bird_id: int
+    name: str
+    snippet: str
+    score: float
+
+
+@dataclass
+class SightingMatch:
+    sighting_id: int
+    bird_name: str
+    date: str
+    location: str
+    snippet: str
+    score: float
+
+
+def to_match_query(text):
+    """
+    Turn free text into an FTS5 query matching every word, with the last
+    word as a prefix, so user input never trips over FTS5 syntax.
+    """
+    words = [word.replace('"', '""') for word in text.split()]
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words[:-1]]
+    terms.append(f'"{words[-1]}"*')
+    return " ".join(terms)
+
+
+def _query(text, raw):
+    return text if raw else to_match_query(text)
+
+
+def search_birds(text, limit=SEARCH_LIMIT, raw=False):
+    """
+    Search bird names, biological names, descriptions, habitats and diets,
+    best match first. Pass raw=True to use FTS5 query syntax directly.
+    """
+    query = _query(text, raw)
+    if not query:
+        return []
+
+    weights = ", ".join(str(weight) for weight in BIRD_WEIGHTS)
+    with session() as conn:
+        rows = conn.execute(f'''
+            SELECT b.id, b.name,
+                   snippet(bird_details_fts, -1, '[', ']', '...', {SNIPPET_TOKENS}),
+                   bm25(bird_details_fts, {weights}) AS score
+            FROM bird_details_fts
+            JOIN bird_details b ON b.id = bird_details_fts.rowid
+            WHERE bird_details_fts MATCH ?
+            ORDER BY score
+            LIMIT ?
+        ''', (query, limit)).fetchall()
+    return [BirdMatch(*row) for row in rows]
+
+
+def search_sightings(text, limit=SEARCH_LIMIT, raw=False):
+    """
+    Search sighting locations and notes, best match first.
+    """
+    query = _query(text, raw)
+    if not query:
+        return []
+
+    weights = ", ".join(str(weight) for weight in SIGHTING_WEIGHTS)
+    with session() as conn:
+        rows = conn.execute(f'''
+            SELECT a.id, b.name, a.date, a.location,
+                   snippet(avian_sightings_fts, -1, '[', ']', '...', {SNIPPET_TOKENS}),
+                   bm25(avian_sightings_fts, {weights}) AS score
+            FROM avian_sightings_fts
+            JOIN avian_sightings a ON a.id = avian_sightings_fts.rowid
+            JOIN bird_details b ON b.id = a.bird_id
+            WHERE avian_sightings_fts MATCH ?
+            ORDER BY score
+            LIMIT ?
+        ''', (query, limit)).fetchall()
+    return [SightingMatch(*row) for row in rows]
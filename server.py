@@ -0,0 +1,217 @@
+import argparse
+import asyncio
+import json
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+
+import db
+import search
+from archive import Archive
+from fuzzy import SUGGESTIONS
+from instrumentation import configure_from_env, instrument, metrics
+from repository import (PAGE_SIZE, BirdRepository, Sighting, SightingRepository, check_coordinates, check_date,
+                        timeline_key)
+from schema import bootstrap
+from writebehind import WriteBehind
+
+HOST = "127.0.0.1"
+PORT = 8765
+WORKERS = 8
+WRITE_BATCH_SIZE = 500
+WRITE_WINDOW = 0.005
+WRITE_QUEUE_SIZE = 10000
+
+
+class RequestError(Exception):
+    """
+    A request that cannot be served, reported back to the client.
+    """
+
+
+class BirdService:
+    """
+    JSON-lines service over the bird and sighting operations. Each request
+    is one line such as
+
+        {"id": 1, "op": "get_bird", "args": {"name": "Robin"}}
+
+    and gets one response line {"id": 1, "ok": true, "result": ...} or
+    {"id": 1, "ok": false, "error": "..."}. The "metrics" operation returns
+    the instrumentation snapshot. Reads run on a bounded thread pool; new
+    sightings go through a writebehind.WriteBehind, which commits them in
+    groups, and are answered once committed.
+    """
+
+    def __init__(self, workers=WORKERS, batch_size=WRITE_BATCH_SIZE, window=WRITE_WINDOW):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bird-service")
+        self.writer = WriteBehind(batch_size, window, WRITE_QUEUE_SIZE, flush_on_exit=False)
+        self.birds = instrument(BirdRepository(), "birds")
+        self.sightings = instrument(SightingRepository(archive=Archive()), "sightings")
+        self.server = None
+        self.operations = {
+            "get_bird": self.get_bird,
+            "list_birds": self.list_birds,
+            "list_sightings": self.list_sightings,
+            "sightings_for_bird": self.sightings_for_bird,
+            "timeline": self.timeline,
+            "search": self.search,
+            "suggest_birds": self.suggest_birds,
+            "add_sighting": self.add_sighting,
+            "metrics": self.get_metrics,
+        }
+
+    async def _run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    async def _not_found(self, message, name):
+        suggestions = await self._run(self.birds.suggest, name)
+        if suggestions:
+            message += f" Did you mean: {', '.join(s.name for s in suggestions)}?"
+        return RequestError(message)
+
+    async def get_bird(self, name):
+        bird = await self._run(self.birds.get_by_name, name)
+        if bird is None:
+            raise await self._not_found(f"Bird '{name}' not found.", name)
+        return asdict(bird)
+
+    async def suggest_birds(self, name, limit=SUGGESTIONS):
+        return [asdict(s) for s in await self._run(self.birds.suggest, name, limit)]
+
+    async def list_birds(self, after_id=0, limit=50):
+        return [asdict(bird) for bird in await self._run(self.birds.page, after_id, limit)]
+
+    async def list_sightings(self, after_id=0, limit=50):
+        return [asdict(s) for s in await self._run(self.sightings.page, after_id, limit)]
+
+    async def sightings_for_bird(self, name):
+        return [asdict(s) for s in await self._run(self.sightings.list_for_bird_name, name)]
+
+    async def timeline(self, name, after=None, limit=PAGE_SIZE):
+        """
+        A page of a bird's sightings, newest first. Pass the "next" of a
+        page as `after` for the following one; it is null on the last page.
+        """
+        bird = await self._run(self.birds.get_by_name, name)
+        if bird is None:
+            raise await self._not_found(f"Bird '{name}' not found.", name)
+        page = await self._run(self.sightings.timeline, bird.id, after, limit)
+        return {"sightings": [asdict(s) for s in page],
+                "next": list(timeline_key(page[-1])) if len(page) == limit else None}
+
+    async def search(self, text, limit=search.SEARCH_LIMIT):
+        birds = await self._run(search.search_birds, text, limit)
+        sightings = await self._run(search.search_sightings, text, limit)
+        return {"birds": [asdict(m) for m in birds], "sightings": [asdict(m) for m in sightings]}
+
+    async def get_metrics(self):
+        return metrics.snapshot()
+
+    async def add_sighting(self, bird_name, date, location, observer=None, notes=None,
+                           latitude=None, longitude=None):
+        bird = await self._run(self.birds.get_by_name, bird_name)
+        if bird is None:
+            raise await self._not_found(f"Bird '{bird_name}' does not exist in the bird_details table.", bird_name)
+        if not date or not location:
+            raise RequestError("A sighting needs a date and a location.")
+        check_date(date)
+        check_coordinates(latitude, longitude)
+        sighting = Sighting(bird_id=bird.id, date=date, location=location, observer=observer or None,
+                            notes=notes or None, latitude=latitude, longitude=longitude)
+        # add() waits on a worker thread while the write queue is full;
+        # the future is done once the sighting is committed, with its id set.
+        try:
+            await asyncio.wrap_future(await self._run(self.writer.add, sighting))
+        except sqlite3.IntegrityError as e:
+            raise RequestError(f"Sighting of '{bird_name}' was not saved: {e}.")
+        sighting.bird_name = bird.name
+        return asdict(sighting)
+
+    async def handle(self, line):
+        """
+        Serve one request line and return the response as a dict.
+        """
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get("id")
+            operation = self.operations.get(request.get("op"))
+            if operation is None:
+                raise RequestError(f"Unknown operation '{request.get('op')}'.")
+            result = await operation(**request.get("args", {}))
+            return {"id": request_id, "ok": True, "result": result}
+        except (RequestError, ValueError, TypeError) as e:
+            return {"id": request_id, "ok": False, "error": str(e)}
+        except Exception as e:
+            return {"id": request_id, "ok": False, "error": f"Internal error: {e}"}
+
+    async def _client(self, reader, writer):
+        lock = asyncio.Lock()
+        tasks = set()
+
+        async def respond(line):
+            response = await self.handle(line)
+            async with lock:
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+
+        try:
+            while line := await reader.readline():
+                if line.strip():
+                    task = asyncio.create_task(respond(line))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host=HOST, port=PORT):
+        self.writer.start()
+        self.server = await asyncio.start_server(self._client, host, port)
+        return self.server
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        await self._run(self.writer.close)
+        self.executor.shutdown(wait=True)
+
+
+async def serve(host=HOST, port=PORT, workers=WORKERS):
+    service = BirdService(workers)
+    server = await service.start(host, port)
+    print(f"Serving on {', '.join(str(sock.getsockname()) for sock in server.sockets)}")
+    try:
+        await server.serve_forever()
+    finally:
+        await service.close()
+
+
+def main():
+    """
+    Command line entry point: python server.py --port 8765 --workers 8
+    """
+    parser = argparse.ArgumentParser(description="Avian Management System JSON-lines service.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--db", default=db.DB_PATH)
+    args = parser.parse_args()
+
+    # One connection per worker plus one for the writer.
+    db.configure(path=args.db, size=args.workers + 1)
+    configure_from_env()
+    bootstrap()
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import db
+from cache import LRUCache
+from repository import BIRD_CACHE_SIZE
+
+SNAPSHOT_PATH = "bird_report.db"
+MEMORY = ":memory:"
+REFRESH_INTERVAL = 300.0
+
+INTERVAL_ENV = "BIRD_SNAPSHOT_INTERVAL"
+PATH_ENV = "BIRD_SNAPSHOT_PATH"
+
+# The snapshot is only read, and can always be taken again, so it does
+# without a journal and fsyncs.
+SNAPSHOT_PRAGMAS = dict(db.PRAGMAS, journal_mode="OFF", synchronous="OFF")
+
+
+class Snapshot:
+    """
+    A copy of the database for reporting queries, taken with the sqlite3
+    backup API and replaced once it is older than `interval` seconds.
+
+    It offers the connection() method of a ConnectionPool, so repositories
+    and exports can be pointed at it. Each refresh backs up into a new file
+    (or a new in-memory database when `path` is ':memory:') and swaps it
+    in, so long reports never hold a read transaction on the live database
+    and a refresh never waits for a report to finish.
+    """
+
+    def __init__(self, path=SNAPSHOT_PATH, interval=REFRESH_INTERVAL, source=None, size=db.POOL_SIZE,
+                 clock=time.monotonic):
+        self.path = path
+        self.interval = interval
+        self.source = source
+        # Every connection to ':memory:' is its own database, so an
+        # in-memory snapshot is served by a single connection.
+        self.size = 1 if path == MEMORY else size
+        self.clock = clock
+        self.cache = LRUCache(BIRD_CACHE_SIZE)
+        self.refreshed_at = None
+        self.refreshes = 0
+        self._pool = None
+        self._file = None
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _next_file(self):
+        if self.path == MEMORY:
+            return None
+        self._generation += 1
+        root, ext = os.path.splitext(self.path)
+        return f"{root}.{self._generation}{ext}"
+
+    @staticmethod
+    def _remove(path):
+        for name in (path, f"{path}-wal", f"{path}-shm", f"{path}-journal"):
+            try:
+                os.remove(name)
+            except OSError:
+                pass
+
+    def refresh(self):
+        """
+        Copy the live database into a new snapshot and switch readers to it.
+        """
+        with self._lock:
+            path = self._next_file()
+            if path is not None:
+                self._remove(path)
+            pool = db.ConnectionPool(path or MEMORY, self.size, SNAPSHOT_PRAGMAS)
+            source = self.source or db.get_pool()
+            try:
+                with source.connection() as src, pool.connection() as dst:
+                    src.backup(dst)
+            except Exception:
+                pool.close()
+                if path is not None:
+                    self._remove(path)
+                raise
+
+            old_pool, old_file = self._pool, self._file
+            self._pool, self._file = pool, path
+            self.cache.clear()
+            self.refreshed_at = self.clock()
+            self.refreshes += 1
+
+        if old_pool is not None:
+            # Reports still running keep their connection until they finish;
+            # on POSIX the removed file stays readable until then.
+            old_pool.close()
+            if old_file is not None:
+                self._remove(old_file)
+
+    def is_stale(self):
+        if self._pool is None:
+            return True
+        return self.interval is not None and self.clock() - self.refreshed_at >= self.interval
+
+    def age(self):
+        """
+        Seconds since the last refresh, or None before the first one.
+        """
+        return None if self.refreshed_at is None else self.clock() - self.refreshed_at
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a connection to the current snapshot, refreshing it first if
+        it is older than the interval and no background refresher runs.
+        """
+        if self._pool is None or (self._thread is None and self.is_stale()):
+            self.refresh()
+        while True:
+            pool = self._pool
+            try:
+                conn = pool.acquire()
+                break
+            except RuntimeError:
+                # Swapped out and closed by a refresh in the meantime.
+                continue
+        try:
+            yield conn
+        finally:
+            pool.release(conn)
+
+    def start(self):
+        """
+        Refresh in a background thread every `interval` seconds instead of
+        on demand.
+        """
+        if self._thread is not None:
+            return
+        if self._pool is None:
+            self.refresh()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="snapshot-refresh", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Snapshot refresh failed: {e}")
+
+    def close(self):
+        """
+        Stop refreshing and remove the snapshot.
+        """
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool = None
+            if self._file is not None:
+                self._remove(self._file)
+                self._file = None
+
+
+def from_env():
+    """
+    Return a Snapshot configured from the environment, or None:
+
+        BIRD_SNAPSHOT_INTERVAL=300         refresh interval in seconds
+        BIRD_SNAPSHOT_PATH=:memory:        snapshot file (default bird_report.db)
+    """
+    interval = os.environ.get(INTERVAL_ENV)
+    if not interval:
+        return None
+    return Snapshot(os.environ.get(PATH_ENV, SNAPSHOT_PATH), float(interval))
@@ -0,0 +1,190 @@
+import atexit
+import os
+import queue
+import threading
+import time
+
+import db
+from instrumentation import metrics
+from repository import INSERT_SIGHTING, check_coordinates, check_date, sighting_row
+
+BATCH_SIZE = 500
+WINDOW = 0.05
+QUEUE_SIZE = 10000
+
+WINDOW_ENV = "BIRD_WRITE_BEHIND_MS"
+BATCH_ENV = "BIRD_WRITE_BEHIND_BATCH"
+QUEUE_ENV = "BIRD_WRITE_BEHIND_QUEUE"
+
+# Queued by close() behind the last sighting, to stop the writer.
+_STOP = object()
+
+
+class QueueFull(Exception):
+    """
+    A sighting could not be queued before the timeout.
+    """
+
+
+class WriteBehind:
+    """
+    Background writer for new sightings. add() checks a sighting, queues
+    it and returns a Future at once; a writer thread takes what has
+    queued, up to `batch_size` sightings or `window` seconds after the
+    first, and inserts them in one transaction, so they share one commit
+    and its fsync. The Future gets the sighting with its id once it is
+    committed, or the error that kept it out.
+
+    The queue holds at most `maxsize` sightings. When it is full add()
+    waits for room, for at most `timeout` seconds if one is given, then
+    raises QueueFull. Queued sightings are lost if the process dies before
+    the writer reaches them: flush() waits until everything queued so far
+    is committed, and close(), registered with atexit when
+    `flush_on_exit` is set, writes the rest before the process exits.
+
+    Commit latencies are recorded as the 'writebehind.commit' operation,
+    and the time sightings spent queued as 'writebehind.delay'; the queue
+    depth is the 'writebehind.queue_depth' gauge.
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE, window=WINDOW, maxsize=QUEUE_SIZE, timeout=None,
+                 flush_on_exit=True, pool=None):
+        self.batch_size = batch_size
+        self.window = window
+        self.timeout = timeout
+        self.flush_on_exit = flush_on_exit
+        self.pool = pool
+        self.queue = queue.Queue(maxsize)
+        self.batches = 0
+        self.rows = 0
+        self.failed = 0
+        self.max_depth = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        metrics.gauge("writebehind.queue_depth", self.queue.qsize)
+
+    def start(self):
+        """
+        Start the writer thread; add() does so on first use.
+        """
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="sighting-write-behind", daemon=True)
+            self._thread.start()
+            if self.flush_on_exit:
+                atexit.register(self.close)
+
+    def add(self, sighting):
+        """
+        Queue a new sighting and return a Future of it with its id set.
+        Raises ValueError for an invalid date or coordinates, and
+        QueueFull if the queue stays full for longer than the timeout.
+        """
+        from concurrent.futures import Future
+
+        check_date(sighting.date)
+        check_coordinates(sighting.latitude, sighting.longitude)
+        if self._thread is None:
+            self.start()
+        future = Future()
+        try:
+            self.queue.put((sighting, future, time.perf_counter()), timeout=self.timeout)
+        except queue.Full:
+            raise QueueFull(f"The write queue stayed full for {self.timeout} seconds.") from None
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+        return future
+
+    def flush(self):
+        """
+        Wait until every sighting queued so far has been written.
+        """
+        if self._thread is not None:
+            self.queue.join()
+
+    def close(self):
+        """
+        Write what is queued, then stop the writer.
+        """
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self.queue.put(_STOP)
+        thread.join()
+        if self.flush_on_exit:
+            atexit.unregister(self.close)
+
+    def _next_batch(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.window
+        while batch[-1] is not _STOP and len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                # Past the window, still take whatever has already queued.
+                batch.append(self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            stop = batch[-1] is _STOP
+            items = batch[:-1] if stop else batch
+            try:
+                if items:
+                    self._write(items)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+            if stop:
+                return
+
+    def _write(self, items):
+        start = time.perf_counter()
+        try:
+            with (self.pool or db.get_pool()).connection() as conn:
+                ids = [conn.execute(INSERT_SIGHTING, sighting_row(sighting)).lastrowid for sighting, _, _ in items]
+        except Exception as e:
+            metrics.record("writebehind.commit", time.perf_counter() - start, error=True)
+            if len(items) > 1:
+                # One bad sighting, such as one of a bird deleted since it
+                # was queued, fails the whole transaction: write the rest
+                # one at a time so only it is lost.
+                for item in items:
+                    self._write([item])
+                return
+            sighting, future, _ = items[0]
+            self.failed += 1
+            print(f"Failed to write sighting of bird {sighting.bird_id} on {sighting.date}: {e}")
+            future.set_exception(e)
+            return
+
+        done = time.perf_counter()
+        metrics.record("writebehind.commit", done - start, rows=len(items))
+        metrics.record("writebehind.delay", done - items[0][2], rows=len(items))
+        self.batches += 1
+        self.rows += len(items)
+        for (sighting, future, _), sighting_id in zip(items, ids):
+            sighting.id = sighting_id
+            future.set_result(sighting)
+
+    def stats(self):
+        return {"queued": self.queue.qsize(), "max_queued": self.max_depth, "batches": self.batches,
+                "rows": self.rows, "failed": self.failed}
+
+
+def from_env():
+    """
+    Return a WriteBehind configured from the environment, or None:
+
+        BIRD_WRITE_BEHIND_MS=50          group commit window in milliseconds
+        BIRD_WRITE_BEHIND_BATCH=500      most sightings per commit
+        BIRD_WRITE_BEHIND_QUEUE=10000    most sightings waiting to be written
+    """
+    window = os.environ.get(WINDOW_ENV)
+    if not window:
+        return None
+    return WriteBehind(int(os.environ.get(BATCH_ENV, BATCH_SIZE)), float(window) / 1000,
+                       int(os.environ.get(QUEUE_ENV, QUEUE_SIZE)))